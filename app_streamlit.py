@@ -2,60 +2,171 @@
 # IA com Escuta Ativa, Memória Permanente e Estabilidade Aprimorada
 import os
 import streamlit as st
-from openai import OpenAI
 from dotenv import load_dotenv
 import datetime
-import pandas as pd
-import altair as alt
 import smtplib
 from email.message import EmailMessage
 import sqlite3
 import json
-from google.cloud import storage
+import threading
+import time
+import random
+import collections
+import functools
+import hashlib
+import uuid
+import secrets
+import hmac
+from sync_gcs import DeltaSyncEngine, GCSBucket
+from sqlite_pool import SQLiteConnectionManager
+from smtp_pool import SMTPConnectionManager
+from tracing import Rastreador
+from prompt_relatorio import PromptRelatorioBuilder
+from gateway_openai import OpenAIGateway, PRIORIDADE_INTERATIVA, PRIORIDADE_RELATORIO
+from compressao import FUNCOES_SQL, comprimir, descomprimir, comprimir_respostas, descomprimir_respostas
+from lexico_risco import LexicoRisco, normalizar_texto
+import re
 
 # --- LÓGICA DE PERSISTÊNCIA COM GOOGLE CLOUD STORAGE ---
 BUCKET_NAME = "relatorios-triagem-rede-elle"
 DATABASE_FILE = "redeelle_relatorios.db"
+# Janela de agrupamento: escritas dentro dela viram um único sync com o bucket
+SYNC_JANELA_S = float(os.getenv("SYNC_JANELA_S", "10"))
+SYNC_COMPACTAR_APOS_DELTAS = int(os.getenv("SYNC_COMPACTAR_APOS_DELTAS", "100"))
+
+# O Streamlit reexecuta o módulo a cada interação: estado que precisa durar o processo inteiro vem de st.cache_resource
+@st.cache_resource(show_spinner=False)
+def _get_sync_engine():
+    return DeltaSyncEngine(GCSBucket(BUCKET_NAME), DATABASE_FILE, compactar_apos_deltas=SYNC_COMPACTAR_APOS_DELTAS)
+
+@st.cache_resource(show_spinner=False)
+def get_rastreador():
+    """Spans e tokens do processo (ver tracing.py); os de cada atendimento são gravados em trace_spans com o relatório."""
+    return Rastreador()
+
+sync_engine = _get_sync_engine()
+rastreador = get_rastreador()
 
 def download_database():
-    """Baixa o banco de dados do Google Cloud Storage, se existir."""
+    """Reconstrói o banco de dados a partir do Google Cloud Storage (snapshot base + deltas), se existir."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(DATABASE_FILE)
-        if blob.exists():
-            blob.download_to_filename(DATABASE_FILE)
+        with rastreador.span("gcs.download"):
+            restaurado = sync_engine.restore()
+        if restaurado:
             print(f"Banco de dados '{DATABASE_FILE}' baixado com sucesso.")
         else:
             print(f"Nenhum banco de dados encontrado. Um novo será criado.")
     except Exception as e:
-        st.warning(f"Não foi possível baixar o banco de dados: {e}")
+        # Roda na thread de aquecimento, sem ScriptRunContext: st.warning não chegaria a ninguém
         print(f"ERRO ao baixar o banco de dados: {e}")
 
 def upload_database():
-    """Envia o banco de dados para o Google Cloud Storage."""
+    """Envia ao Google Cloud Storage apenas as páginas alteradas do banco. Retorna True em caso de sucesso."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(DATABASE_FILE)
-        blob.upload_from_filename(DATABASE_FILE)
-        print(f"Banco de dados '{DATABASE_FILE}' salvo com sucesso na nuvem.")
+        with rastreador.span("gcs.upload"):
+            resultado = sync_engine.sync()
+        print(f"Banco de dados '{DATABASE_FILE}' salvo com sucesso na nuvem ({resultado['modo']}, {resultado['bytes']} bytes).")
+        return True
     except Exception as e:
-        st.error(f"FALHA CRÍTICA: Não foi possível salvar os relatórios permanentemente: {e}")
-        print(f"ERRO ao salvar o banco de dados: {e}")
+        # Roda no worker do outbox: a falha volta ao job de upload, que a registra e tenta de novo
+        print(f"FALHA CRÍTICA ao salvar o banco de dados na nuvem: {e}")
+        return False
 
 # --- CONFIGURAÇÃO INICIAL ---
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 DB_NAME = "redeelle_relatorios.db"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MAX_LEITORES = int(os.getenv("SQLITE_MAX_LEITORES", "4"))
+BANCO_AQUECIMENTO_TIMEOUT_S = float(os.getenv("BANCO_AQUECIMENTO_TIMEOUT_S", "60"))
+# Pontos por série nos gráficos do painel; históricos longos passam a ser agregados por semana, mês, ...
+GRAFICOS_MAX_PONTOS = int(os.getenv("GRAFICOS_MAX_PONTOS", "120"))
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# Gateway da OpenAI (ver gateway_openai.py): até OPENAI_MAX_CONCORRENTES chamadas em voo, das quais
+# OPENAI_VAGAS_INTERATIVAS e a fração OPENAI_RESERVA_INTERATIVA do limite de taxa ficam para as reflexões ao vivo
+OPENAI_MAX_CONCORRENTES = int(os.getenv("OPENAI_MAX_CONCORRENTES", "16"))
+OPENAI_VAGAS_INTERATIVAS = int(os.getenv("OPENAI_VAGAS_INTERATIVAS", "8"))
+OPENAI_RESERVA_INTERATIVA = float(os.getenv("OPENAI_RESERVA_INTERATIVA", "0.2"))
+OPENAI_MAX_TENTATIVAS = int(os.getenv("OPENAI_MAX_TENTATIVAS", "5"))
+OPENAI_KEEPALIVE_S = float(os.getenv("OPENAI_KEEPALIVE_S", "60"))
+
+@st.cache_resource(show_spinner=False)
+def get_openai_gateway():
+    """Gateway único por processo: todas as sessões dividem conexões, fila com prioridade e limite de taxa."""
+    return OpenAIGateway(
+        api_key=os.getenv("OPENAI_API_KEY"), max_concorrentes=OPENAI_MAX_CONCORRENTES, vagas_interativas=OPENAI_VAGAS_INTERATIVAS,
+        reserva_interativa=OPENAI_RESERVA_INTERATIVA, max_tentativas=OPENAI_MAX_TENTATIVAS, keepalive_s=OPENAI_KEEPALIVE_S
+    )
+
+@st.cache_resource
+def _get_db_manager():
+    """Gerenciador de conexões do processo: WAL, pool de conexões de leitura e fila única de escrita."""
+    return SQLiteConnectionManager(
+        DB_NAME, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS, max_leitores=SQLITE_MAX_LEITORES,
+        # Usadas pela busca para ler o conteúdo comprimido dos relatórios (ver _criar_indice_busca)
+        funcoes=FUNCOES_SQL
+    )
+
+class BancoIndisponivel(RuntimeError):
+    """O aquecimento do banco falhou ou ainda não terminou depois de BANCO_AQUECIMENTO_TIMEOUT_S."""
+
+class AquecimentoBanco:
+    """Resultado do aquecimento: `pronto` quando terminou, `erro` com a exceção se ele falhou.
+
+    Só a primeira espera por um aquecimento lento dura BANCO_AQUECIMENTO_TIMEOUT_S; depois dela, quem chega falha na hora
+    até o aquecimento terminar, em vez de cada get_db() (inclusive o checkpoint de cada resposta) esperar tudo de novo.
+    """
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.erro = None
+        self._esgotado = False
+
+    def aguardar(self):
+        if not self.pronto.is_set():
+            if self._esgotado or not self.pronto.wait(timeout=BANCO_AQUECIMENTO_TIMEOUT_S):
+                self._esgotado = True
+                raise BancoIndisponivel(f"o banco de dados não ficou pronto em {BANCO_AQUECIMENTO_TIMEOUT_S:.0f} s")
+        if self.erro is not None:
+            raise BancoIndisponivel(f"falha ao preparar o banco de dados: {self.erro}") from self.erro
+
+@st.cache_resource
+def iniciar_aquecimento_banco():
+    """Baixa o banco do GCS e prepara o schema numa thread, sem bloquear a primeira renderização da triagem."""
+    aquecimento = AquecimentoBanco()
+    def aquecer():
+        try:
+            download_database()
+            init_db()
+        except Exception as e:
+            # Sem o schema, o worker do outbox e as leituras falhariam em cada job: o erro fica registrado para get_db()
+            print(f"ERRO no aquecimento do banco de dados: {e}")
+            aquecimento.erro = e
+            return
+        finally:
+            aquecimento.pronto.set()
+        iniciar_worker_outbox()
+        get_openai_gateway()
+    threading.Thread(target=aquecer, name="aquecimento-banco", daemon=True).start()
+    return aquecimento
+
+def get_db():
+    """Acesso ao banco; aguarda o aquecimento (download + schema) na primeira vez que alguém precisa dele.
+
+    Levanta BancoIndisponivel se o aquecimento falhou ou se ainda não terminou (ver AquecimentoBanco).
+    """
+    iniciar_aquecimento_banco().aguardar()
+    return _get_db_manager()
+
+def _criar_tabelas(cursor):
+    # Respostas posicionais (contra perguntas_triagem) e corpo do relatório comprimidos; ver _migrar_relatorios_compactos
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS reports (
         id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, patient_name_for_file TEXT,
-        patient_data TEXT NOT NULL, generated_report TEXT NOT NULL, risk_alert TEXT, email_sent INTEGER
+        risk_alert TEXT, email_sent INTEGER, perguntas_versao INTEGER, respostas BLOB, relatorio BLOB
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS perguntas_triagem (
+        versao INTEGER PRIMARY KEY AUTOINCREMENT, impressao TEXT NOT NULL UNIQUE, perguntas TEXT NOT NULL, criada_em TEXT NOT NULL
     );
     """)
     cursor.execute("""
@@ -64,15 +175,378 @@ def init_db():
         timestamp TEXT NOT NULL, FOREIGN KEY (report_id) REFERENCES reports (id) ON DELETE CASCADE
     );
     """)
-    conn.commit()
-    conn.close()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pendente', attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL, next_attempt_at REAL NOT NULL, last_error TEXT, prioridade INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    if "prioridade" not in {linha[1] for linha in cursor.execute("PRAGMA table_info(outbox)")}:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN prioridade INTEGER NOT NULL DEFAULT 0")
+        cursor.executemany("UPDATE outbox SET prioridade = ? WHERE kind = ?", ((p, k) for k, p in OUTBOX_PRIORIDADES.items()))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pendentes ON outbox (status, next_attempt_at);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_fila ON outbox (status, prioridade, id);")
+    # Índices da listagem paginada (keyset em timestamp, id) e da busca de feedback por página
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reports_timestamp ON reports (timestamp DESC, id DESC);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reports_risk ON reports (risk_alert, timestamp DESC, id DESC);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reports_email ON reports (email_sent, timestamp DESC, id DESC);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_feedback_report ON feedback (report_id, timestamp DESC);")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS trace_spans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER, trace_id TEXT NOT NULL, nome TEXT NOT NULL,
+        inicio REAL NOT NULL, duracao_ms REAL NOT NULL, modelo TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, erro TEXT
+    );''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trace_spans_report ON trace_spans (report_id);")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessoes_triagem (
+        sessao_id TEXT PRIMARY KEY, respostas TEXT NOT NULL, reflexoes TEXT NOT NULL, alerta INTEGER NOT NULL DEFAULT 0,
+        trace_id TEXT, atualizado_em REAL NOT NULL, segredo_hash TEXT
+    );''')
+    # Checkpoints gravados antes do segredo de retomada ficam com segredo_hash NULL e não são mais retomados
+    if "segredo_hash" not in {linha[1] for linha in cursor.execute("PRAGMA table_info(sessoes_triagem)")}:
+        cursor.execute("ALTER TABLE sessoes_triagem ADD COLUMN segredo_hash TEXT")
+    # Uma linha por triagem (hash do conteúdo + sessão): reruns e refreshs reaproveitam o job em vez de gerar outro relatório
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS relatorio_idempotencia (
+        chave TEXT PRIMARY KEY, sessao_id TEXT, job_id INTEGER NOT NULL, report_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'reservado', criado_em REAL NOT NULL, atualizado_em REAL NOT NULL
+    );''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS email_digest (
+        report_id INTEGER PRIMARY KEY, subject TEXT NOT NULL, body TEXT NOT NULL, created_at REAL NOT NULL, sent_at REAL
+    );''')
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS risk_screening (
+        report_id INTEGER PRIMARY KEY, lexicon_version TEXT NOT NULL, categories TEXT NOT NULL, matches TEXT NOT NULL,
+        screened_at TEXT NOT NULL, FOREIGN KEY (report_id) REFERENCES reports (id) ON DELETE CASCADE
+    );
+    """)
+    # Relatórios regenerados em lote (regeneracao_relatorios.py), um por versão do prompt; o original continua em reports
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS relatorio_versoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER NOT NULL, prompt_versao TEXT NOT NULL, relatorio BLOB NOT NULL,
+        gerado_em TEXT NOT NULL, UNIQUE (report_id, prompt_versao), FOREIGN KEY (report_id) REFERENCES reports (id) ON DELETE CASCADE
+    );
+    """)
+
+# Busca textual: índices FTS5 com remoção de acentos, de conteúdo externo (não guardam uma segunda cópia do texto).
+# busca_relatorios lê reports por uma view que descomprime relatório e respostas; busca_feedback lê a tabela feedback.
+# A view e o trigger de DELETE em reports chamam as funções SQL descomprimir/respostas_busca, que não existem no SQLite:
+# toda conexão que apague relatórios ou leia o índice precisa de compressao.registrar_funcoes_sql (o CLI sqlite3 não
+# as tem; para manutenção manual, use sqlite3.connect + registrar_funcoes_sql num script Python).
+_OPCOES_FTS = "tokenize = 'unicode61 remove_diacritics 2', prefix = '3 4 5'"
+
+def _criar_indice_busca(cursor):
+    """Cria as tabelas FTS5 e os triggers; na primeira criação (ou vindo do índice antigo) reconstrói os índices."""
+    ja_existia = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'busca_relatorios'").fetchone()
+    # Índice antigo, com cópia própria de todo o texto
+    for trigger in ("reports_busca_ai", "reports_busca_au", "reports_busca_ad", "feedback_busca_ai"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS busca_fts")
+    cursor.execute("""
+    CREATE VIEW IF NOT EXISTS busca_relatorios_conteudo AS
+        SELECT id, descomprimir(relatorio) AS relatorio, respostas_busca(respostas) AS respostas FROM reports
+    """)
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS busca_relatorios USING fts5(
+        relatorio, respostas, content = 'busca_relatorios_conteudo', content_rowid = 'id', {_OPCOES_FTS}
+    );
+    """)
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS busca_feedback USING fts5(
+        feedback_text, content = 'feedback', content_rowid = 'id', {_OPCOES_FTS}
+    );
+    """)
+    # Relatórios entram por _indexar_relatorio_busca, que já tem o texto em mãos; a remoção precisa do conteúdo antigo
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS reports_busca_relatorios_ad AFTER DELETE ON reports BEGIN
+        INSERT INTO busca_relatorios (busca_relatorios, rowid, relatorio, respostas)
+        VALUES ('delete', OLD.id, descomprimir(OLD.relatorio), respostas_busca(OLD.respostas));
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS feedback_busca_ai AFTER INSERT ON feedback BEGIN
+        INSERT INTO busca_feedback (rowid, feedback_text) VALUES (NEW.id, NEW.feedback_text);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS feedback_busca_ad AFTER DELETE ON feedback BEGIN
+        INSERT INTO busca_feedback (busca_feedback, rowid, feedback_text) VALUES ('delete', OLD.id, OLD.feedback_text);
+    END;
+    """)
+    if not ja_existia:
+        _backfill_indice_busca(cursor)
+
+def _indexar_relatorio_busca(conn, report_id, relatorio, respostas):
+    conn.execute(
+        "INSERT INTO busca_relatorios (rowid, relatorio, respostas) VALUES (?, ?, ?)",
+        (report_id, relatorio, "\n".join(r for r in respostas if isinstance(r, str)))
+    )
+
+def _backfill_indice_busca(cursor):
+    for tabela in ("busca_relatorios", "busca_feedback"):
+        cursor.execute(f"INSERT INTO {tabela} ({tabela}) VALUES ('rebuild')")
+        # Sem o optimize, o segmento único do rebuild seria remesclado aos poucos a cada inserção (dezenas de páginas por relatório)
+        cursor.execute(f"INSERT INTO {tabela} ({tabela}) VALUES ('optimize')")
+
+# --- AGREGADOS DO PAINEL ---
+# Contagens diárias por alerta de risco e status do e-mail, e de feedbacks, mantidas por triggers na mesma transação
+# da gravação. Triggers (e não código em save_report_internally) porque email_sent muda depois, no outbox e no resumo.
+# Os gráficos do painel leem só essas tabelas: o custo acompanha o número de dias, não o de relatórios
+def _dia_sql(coluna):
+    """Expressão SQL que converte um timestamp YYYYMMDD_HHMMSS em data ISO (YYYY-MM-DD)."""
+    return f"substr({coluna}, 1, 4) || '-' || substr({coluna}, 5, 2) || '-' || substr({coluna}, 7, 2)"
+
+def _somar_agregado_relatorios(registro, delta):
+    chave = f"{_dia_sql(registro + '.timestamp')}, COALESCE({registro}.risk_alert, 'Não'), COALESCE({registro}.email_sent, 0)"
+    return f"""
+        INSERT INTO agregados_relatorios_dia (dia, risk_alert, email_sent, relatorios) VALUES ({chave}, {delta})
+        ON CONFLICT (dia, risk_alert, email_sent) DO UPDATE SET relatorios = relatorios + ({delta});"""
+
+def _somar_agregado_feedback(registro, delta):
+    return f"""
+        INSERT INTO agregados_feedback_dia (dia, feedbacks) VALUES ({_dia_sql(registro + '.timestamp')}, {delta})
+        ON CONFLICT (dia) DO UPDATE SET feedbacks = feedbacks + ({delta});"""
+
+def _criar_agregados(cursor):
+    """Cria as tabelas de agregados e seus triggers; na primeira criação calcula tudo a partir do histórico."""
+    ja_existia = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agregados_relatorios_dia'").fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS agregados_relatorios_dia (
+        dia TEXT NOT NULL,
+        risk_alert TEXT NOT NULL,
+        email_sent INTEGER NOT NULL,
+        relatorios INTEGER NOT NULL,
+        PRIMARY KEY (dia, risk_alert, email_sent)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS agregados_feedback_dia (
+        dia TEXT PRIMARY KEY,
+        feedbacks INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reports_agregados_ai AFTER INSERT ON reports BEGIN{_somar_agregado_relatorios('NEW', 1)}
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reports_agregados_au AFTER UPDATE OF risk_alert, email_sent ON reports
+    WHEN OLD.risk_alert IS NOT NEW.risk_alert OR OLD.email_sent IS NOT NEW.email_sent BEGIN{_somar_agregado_relatorios('OLD', -1)}{_somar_agregado_relatorios('NEW', 1)}
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reports_agregados_ad AFTER DELETE ON reports BEGIN{_somar_agregado_relatorios('OLD', -1)}
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_agregados_ai AFTER INSERT ON feedback BEGIN{_somar_agregado_feedback('NEW', 1)}
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_agregados_ad AFTER DELETE ON feedback BEGIN{_somar_agregado_feedback('OLD', -1)}
+    END;
+    """)
+    if not ja_existia:
+        _reconstruir_agregados(cursor)
+
+def _reconstruir_agregados(cursor):
+    cursor.execute("DELETE FROM agregados_relatorios_dia")
+    cursor.execute("DELETE FROM agregados_feedback_dia")
+    cursor.execute(f"""
+    INSERT INTO agregados_relatorios_dia (dia, risk_alert, email_sent, relatorios)
+        SELECT {_dia_sql('timestamp')}, COALESCE(risk_alert, 'Não'), COALESCE(email_sent, 0), COUNT(*)
+        FROM reports GROUP BY 1, 2, 3
+    """)
+    cursor.execute(f"""
+    INSERT INTO agregados_feedback_dia (dia, feedbacks)
+        SELECT {_dia_sql('timestamp')}, COUNT(*) FROM feedback GROUP BY 1
+    """)
+
+def reconstruir_agregados():
+    """Recalcula do zero os agregados do painel (após importações ou correções feitas direto no banco)."""
+    get_db().escrever(_reconstruir_agregados)
+
+# Granularidades dos gráficos, da mais fina à mais grossa: (nome, dias por ponto, expressão SQL do início do período)
+_GRANULARIDADES = (
+    ("dia", 1, "dia"),
+    ("semana", 7, "date(dia, '-6 days', 'weekday 1')"),
+    ("mês", 31, "strftime('%Y-%m-01', dia)"),
+    ("trimestre", 92, "printf('%s-%02d-01', substr(dia, 1, 4), ((CAST(substr(dia, 6, 2) AS INTEGER) - 1) / 3) * 3 + 1)"),
+    ("ano", 366, "strftime('%Y-01-01', dia)"),
+)
+
+def series_painel(max_pontos=None):
+    """Séries dos gráficos, já agregadas por período e reduzidas a no máximo max_pontos pontos.
+
+    A granularidade (dia, semana, mês, ...) é a mais fina que cabe no intervalo do histórico.
+    Retorna (granularidade, [dict(periodo, relatorios, com_alerta, emails_enviados, feedbacks)]), em ordem.
+    """
+    max_pontos = max_pontos or GRAFICOS_MAX_PONTOS
+    db = get_db()
+    primeiro, ultimo = db.ler_um("""
+        SELECT MIN(dia), MAX(dia) FROM (SELECT dia FROM agregados_relatorios_dia UNION ALL SELECT dia FROM agregados_feedback_dia)
+    """)
+    if primeiro is None:
+        return None, []
+    dias = (datetime.date.fromisoformat(ultimo) - datetime.date.fromisoformat(primeiro)).days + 1
+    nome, _, periodo = next((g for g in _GRANULARIDADES if dias / g[1] <= max_pontos), _GRANULARIDADES[-1])
+    series = {}
+    for inicio, relatorios, com_alerta, emails_enviados in db.ler(f"""
+        SELECT {periodo} AS periodo, SUM(relatorios), SUM(CASE WHEN risk_alert = 'Sim' THEN relatorios ELSE 0 END),
+               SUM(CASE WHEN email_sent = 1 THEN relatorios ELSE 0 END)
+        FROM agregados_relatorios_dia GROUP BY periodo
+    """):
+        series[inicio] = {"periodo": inicio, "relatorios": relatorios, "com_alerta": com_alerta, "emails_enviados": emails_enviados, "feedbacks": 0}
+    for inicio, feedbacks in db.ler(f"SELECT {periodo} AS periodo, SUM(feedbacks) FROM agregados_feedback_dia GROUP BY periodo"):
+        series.setdefault(inicio, {"periodo": inicio, "relatorios": 0, "com_alerta": 0, "emails_enviados": 0, "feedbacks": 0})["feedbacks"] = feedbacks
+    return nome, [series[inicio] for inicio in sorted(series)]
 
-download_database()
-init_db()
+def graficos_painel(series):
+    """Gráficos altair do painel a partir das séries de series_painel: volume, taxas (%) e feedbacks por período."""
+    import altair as alt
+    volume, taxas, feedbacks = [], [], []
+    for ponto in series:
+        volume.append({"periodo": ponto["periodo"], "alerta": "Com alerta de risco", "relatorios": ponto["com_alerta"]})
+        volume.append({"periodo": ponto["periodo"], "alerta": "Sem alerta", "relatorios": ponto["relatorios"] - ponto["com_alerta"]})
+        if ponto["relatorios"]:
+            taxas.append({"periodo": ponto["periodo"], "taxa": "Alerta de risco", "percentual": 100 * ponto["com_alerta"] / ponto["relatorios"]})
+            taxas.append({"periodo": ponto["periodo"], "taxa": "E-mail enviado", "percentual": 100 * ponto["emails_enviados"] / ponto["relatorios"]})
+        feedbacks.append({"periodo": ponto["periodo"], "feedbacks": ponto["feedbacks"]})
+    eixo_x = alt.X("periodo:T", title="Período")
+    return [
+        alt.Chart(alt.Data(values=volume), title="Relatórios por período").mark_bar().encode(
+            x=eixo_x, y=alt.Y("relatorios:Q", title="Relatórios", stack=True), color=alt.Color("alerta:N", title=None),
+            tooltip=["periodo:T", "alerta:N", "relatorios:Q"],
+        ),
+        alt.Chart(alt.Data(values=taxas), title="Taxa de alerta de risco e de e-mails enviados").mark_line(point=True).encode(
+            x=eixo_x, y=alt.Y("percentual:Q", title="%", scale=alt.Scale(domain=[0, 100])), color=alt.Color("taxa:N", title=None),
+            tooltip=["periodo:T", "taxa:N", alt.Tooltip("percentual:Q", format=".1f")],
+        ),
+        alt.Chart(alt.Data(values=feedbacks), title="Feedbacks por período").mark_bar().encode(
+            x=eixo_x, y=alt.Y("feedbacks:Q", title="Feedbacks"), tooltip=["periodo:T", "feedbacks:Q"],
+        ),
+    ]
+
+# --- ARMAZENAMENTO COMPACTO DE RELATÓRIOS ---
+# As chaves "Pergunta N: <texto>" se repetiam em todo registro; agora cada lista de perguntas é gravada uma vez em
+# perguntas_triagem e o relatório guarda só as respostas, na ordem, comprimidas junto com o corpo do relatório
+_CHAVE_PERGUNTA = re.compile(r"Pergunta (\d+): (.*)", re.S)
+
+def _versao_perguntas(conn, perguntas):
+    """Versão da lista de perguntas, registrada na primeira vez que aparece (dentro da transação de escrita)."""
+    if perguntas == TRIAGEM_PERGUNTAS[:len(perguntas)]:
+        # Triagem incompleta do questionário atual: as respostas continuam posicionais na versão completa
+        perguntas = list(TRIAGEM_PERGUNTAS)
+    conteudo = json.dumps(perguntas, ensure_ascii=False)
+    impressao = hashlib.sha256(conteudo.encode("utf-8")).hexdigest()[:16]
+    linha = conn.execute("SELECT versao FROM perguntas_triagem WHERE impressao = ?", (impressao,)).fetchone()
+    if linha:
+        return linha[0]
+    return conn.execute(
+        "INSERT INTO perguntas_triagem (impressao, perguntas, criada_em) VALUES (?, ?, ?)",
+        (impressao, conteudo, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+    ).lastrowid
+
+@functools.lru_cache(maxsize=64)
+def perguntas_da_versao(versao):
+    linha = get_db().ler_um("SELECT perguntas FROM perguntas_triagem WHERE versao = ?", (versao,))
+    return tuple(json.loads(linha[0])) if linha else ()
+
+def compactar_dados_paciente(dados_paciente_temp):
+    """Separa dados_paciente em (perguntas, respostas na ordem, demais chaves).
+
+    O alerta de risco "Sim" não é repetido: já está na coluna risk_alert.
+    """
+    perguntas, respostas, extras = [], [], {}
+    for chave, valor in dados_paciente_temp.items():
+        correspondencia = _CHAVE_PERGUNTA.fullmatch(chave) if isinstance(chave, str) else None
+        if correspondencia and int(correspondencia.group(1)) == len(perguntas) + 1:
+            perguntas.append(correspondencia.group(2))
+            respostas.append(valor)
+        elif not (chave == "ALERTA_RISCO_IMEDIATO" and valor == "Sim"):
+            extras[chave] = valor
+    return perguntas, respostas, extras
+
+def expandir_dados_paciente(perguntas_versao, respostas_blob, risk_alert, perguntas=None):
+    """Reconstrói o dados_paciente original (chaves "Pergunta N: ...") a partir do registro compacto.
+
+    `perguntas` evita a consulta por get_db() para quem já leu a lista da versão (ex.: a regeneração em lote).
+    """
+    respostas, extras = descomprimir_respostas(respostas_blob)
+    if perguntas is None:
+        perguntas = perguntas_da_versao(perguntas_versao)
+    dados = {f"Pergunta {i + 1}: {perguntas[i]}": resposta for i, resposta in enumerate(respostas)}
+    dados.update(extras)
+    if risk_alert == "Sim":
+        dados["ALERTA_RISCO_IMEDIATO"] = "Sim"
+    return dados
+
+def _migrar_relatorios_compactos(conn):
+    """Converte reports do formato antigo (patient_data JSON + generated_report em texto) para o compacto, no lugar.
+
+    Retorna quantos registros foram convertidos; 0 se o banco já está no formato novo.
+    """
+    colunas = {linha[1] for linha in conn.execute("PRAGMA table_info(reports)")}
+    if "patient_data" not in colunas:
+        return 0
+    # Triggers antigos da busca leem patient_data e impediriam o DROP COLUMN; o índice é refeito por _criar_indice_busca
+    conn.execute("DROP TRIGGER IF EXISTS reports_busca_ai")
+    conn.execute("DROP TRIGGER IF EXISTS reports_busca_au")
+    for coluna, tipo in (("perguntas_versao", "INTEGER"), ("respostas", "BLOB"), ("relatorio", "BLOB")):
+        if coluna not in colunas:
+            conn.execute(f"ALTER TABLE reports ADD COLUMN {coluna} {tipo}")
+    convertidos = 0
+    ultimo_id = 0
+    while True:
+        linhas = conn.execute(
+            "SELECT id, patient_data, generated_report FROM reports WHERE id > ? ORDER BY id LIMIT 500", (ultimo_id,)
+        ).fetchall()
+        if not linhas: break
+        atualizacoes = []
+        for report_id, patient_data_json, generated_report in linhas:
+            try:
+                dados = json.loads(patient_data_json)
+            except ValueError:
+                dados = None
+            if not isinstance(dados, dict):
+                dados = {"patient_data": patient_data_json}
+            perguntas, respostas, extras = compactar_dados_paciente(dados)
+            atualizacoes.append((_versao_perguntas(conn, perguntas), comprimir_respostas(respostas, extras), comprimir(generated_report), report_id))
+        conn.executemany("UPDATE reports SET perguntas_versao = ?, respostas = ?, relatorio = ? WHERE id = ?", atualizacoes)
+        convertidos += len(atualizacoes)
+        ultimo_id = linhas[-1][0]
+    conn.execute("ALTER TABLE reports DROP COLUMN patient_data")
+    conn.execute("ALTER TABLE reports DROP COLUMN generated_report")
+    return convertidos
+
+def reconstruir_indice_busca():
+    """Reindexa do zero todos os relatórios e feedbacks (backfill manual)."""
+    get_db().escrever(_backfill_indice_busca)
+
+def init_db():
+    # Chamado pelo aquecimento antes de liberar get_db(), por isso usa o gerenciador diretamente
+    _get_db_manager().escrever(_criar_tabelas)
+    migrados = _get_db_manager().escrever(_migrar_relatorios_compactos)
+    _get_db_manager().escrever(_criar_indice_busca)
+    _get_db_manager().escrever(_criar_agregados)
+    if migrados:
+        # Colunas e índice antigos liberaram páginas; sem o VACUUM o arquivo (e o upload) não diminuiria
+        _get_db_manager().compactar()
+        print(f"{migrados} relatório(s) convertidos para o armazenamento compacto.")
+    purgar_checkpoints_expirados(_get_db_manager())
 
 SENDER_EMAIL = os.getenv("EMAIL_ADDRESS")
 SENDER_PASSWORD = os.getenv("EMAIL_PASSWORD")
 RECEIVER_EMAIL = os.getenv("RECEIVER_EMAIL", SENDER_EMAIL)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1") != "0"
+SMTP_KEEPALIVE_S = float(os.getenv("SMTP_KEEPALIVE_S", "240"))
+SMTP_MAX_TENTATIVAS = int(os.getenv("SMTP_MAX_TENTATIVAS", "3"))
+# Modo digest: relatórios sem alerta de risco são agrupados num único e-mail a cada intervalo (0 desativa)
+EMAIL_DIGEST_INTERVALO_S = float(os.getenv("EMAIL_DIGEST_INTERVALO_S", "0"))
 ADMIN_USERNAME_SECRET = os.getenv("ADMIN_USERNAME")
 ADMIN_PASSWORD_SECRET = os.getenv("ADMIN_PASSWORD")
 
@@ -135,46 +609,226 @@ Humor do paciente: normal? exaltado? baixa-de-humor? Quebra súbita de tonalidad
 Consciência do estado mental?
 """
 
-# --- FUNÇÕES AUXILIARES APRIMORADAS ---
-def get_intuitive_reflection(user_input, question_text):
-    user_input_lower = user_input.lower()
-    if any(phrase in user_input_lower for phrase in ["não entendi", "como assim", "nao sei", "explique melhor", "não compreendi"]):
-        try:
-            prompt = f"""
+# --- CACHE DE REFORMULAÇÕES DE PERGUNTAS ---
+# As variantes vêm de um arquivo versionado gerado offline; a versão do prompt invalida variantes antigas.
+REFORMULACAO_PROMPT_VERSION = "reformulacao-v1"
+REFORMULACOES_ARQUIVO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reformulacoes_perguntas.json")
+REFORMULACAO_VARIANTES = 3
+REFORMULACAO_CACHE_MAX = int(os.getenv("REFORMULACAO_CACHE_MAX", "256"))
+REFORMULACAO_CACHE_TTL_S = float(os.getenv("REFORMULACAO_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+def _prompt_reformulacao(question_text):
+    return f"""
             O paciente expressou dificuldade em compreender a pergunta. Sua tarefa é reformular a pergunta original de uma maneira mais aberta, simples e acolhedora, sem perder o objetivo clínico.
             NUNCA dê a sua opinião ou exemplos pessoais. Apenas facilite a compreensão.
             Pergunta Original: "{question_text}"
             Reformule a pergunta de maneira convidativa:
             """
-            response = client.chat.completions.create(
-                model="gpt-4o", messages=[{"role": "user", "content": prompt}], temperature=0.7, max_tokens=80
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"Erro ao reformular pergunta: {e}")
-            return f"Sem problemas. A pergunta é: '{question_text}'. Por favor, sinta-se à vontade para responder como for mais confortável para você."
 
-    if len(user_input.split()) <= 3 and len(user_input) < 15:
-        return "Recebido. Pode prosseguir."
+class ReformulacaoCache:
+    """Cache LRU com expiração (TTL) de variantes de reformulação, indexado por (versão do prompt, pergunta)."""
+    def __init__(self, max_entradas=REFORMULACAO_CACHE_MAX, ttl_s=REFORMULACAO_CACHE_TTL_S):
+        self.max_entradas = max_entradas
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entradas = collections.OrderedDict()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, question_text, version=REFORMULACAO_PROMPT_VERSION):
+        chave = (version, question_text)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or time.time() - entrada[0] > self.ttl_s:
+                self._entradas.pop(chave, None)
+                self.faltas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada[1]
 
+    def guardar(self, question_text, variantes, version=REFORMULACAO_PROMPT_VERSION):
+        with self._lock:
+            self._entradas[(version, question_text)] = (time.time(), list(variantes))
+            self._entradas.move_to_end((version, question_text))
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+@functools.lru_cache(maxsize=1)
+def carregar_reformulacoes_arquivo(path=REFORMULACOES_ARQUIVO):
+    """Lê o arquivo de variantes; é ignorado se foi gerado para outra versão do prompt."""
     try:
-        prompt = f"""
+        with open(path, "r", encoding="utf-8") as f:
+            conteudo = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Arquivo de reformulações indisponível: {e}")
+        return {}
+    if conteudo.get("prompt_version") != REFORMULACAO_PROMPT_VERSION:
+        print(f"Arquivo de reformulações é da versão '{conteudo.get('prompt_version')}', esperado '{REFORMULACAO_PROMPT_VERSION}'.")
+        return {}
+    return conteudo.get("variantes", {})
+
+@st.cache_resource
+def get_reformulacao_cache():
+    """Cache do processo, pré-aquecido com as variantes do arquivo versionado."""
+    cache = ReformulacaoCache()
+    for question_text, variantes in carregar_reformulacoes_arquivo().items():
+        cache.guardar(question_text, variantes)
+    return cache
+
+def gerar_variantes_reformulacao(question_text, n=REFORMULACAO_VARIANTES):
+    with rastreador.span("openai.reformulacao", modelo="gpt-4o") as span:
+        response = get_openai_gateway().completar(
+            PRIORIDADE_INTERATIVA, model="gpt-4o", messages=[{"role": "user", "content": _prompt_reformulacao(question_text)}],
+            temperature=0.7, max_tokens=80, n=n
+        )
+        span.registrar_uso(response.usage)
+    return [choice.message.content.strip() for choice in response.choices if choice.message.content]
+
+def reformular_pergunta(question_text):
+    """Devolve uma das variantes em cache; só chama a API se a pergunta não estiver no cache nem no arquivo."""
+    cache = get_reformulacao_cache()
+    variantes = cache.obter(question_text)
+    if not variantes:
+        variantes = carregar_reformulacoes_arquivo().get(question_text) or gerar_variantes_reformulacao(question_text)
+        if not variantes:
+            raise ValueError("Nenhuma variante de reformulação disponível.")
+        cache.guardar(question_text, variantes)
+    return random.choice(variantes)
+
+def construir_arquivo_reformulacoes(path=REFORMULACOES_ARQUIVO, n=REFORMULACAO_VARIANTES):
+    """Gera offline o arquivo versionado de variantes para todas as TRIAGEM_PERGUNTAS.
+    Uso: python -c "import app_streamlit; app_streamlit.construir_arquivo_reformulacoes()"
+    """
+    variantes = {question_text: gerar_variantes_reformulacao(question_text, n) for question_text in TRIAGEM_PERGUNTAS}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"prompt_version": REFORMULACAO_PROMPT_VERSION, "variantes": variantes}, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    carregar_reformulacoes_arquivo.cache_clear()
+
+# --- FUNÇÕES AUXILIARES APRIMORADAS ---
+# --- MOTOR DE REFLEXÃO EM CAMADAS ---
+# Camada local (modelos de frase a partir dos exemplos de tom) para os casos comuns; modelos só quando necessário.
+REFLEXAO_MODELO_LEVE = os.getenv("REFLEXAO_MODELO_LEVE", "gpt-4o-mini")
+REFLEXAO_MODELO_COMPLETO = os.getenv("REFLEXAO_MODELO_COMPLETO", "gpt-4o")
+REFLEXAO_LOCAL_MAX_PALAVRAS = int(os.getenv("REFLEXAO_LOCAL_MAX_PALAVRAS", "40"))
+REFLEXAO_COMPLETO_MIN_PALAVRAS = int(os.getenv("REFLEXAO_COMPLETO_MIN_PALAVRAS", "120"))
+# Espera máxima pela reflexão do modelo (fila do gateway incluída); depois disso vale a frase de fallback
+REFLEXAO_PRAZO_S = float(os.getenv("REFLEXAO_PRAZO_S", "8"))
+REFLEXAO_EXEMPLOS_TOM = ["Suas palavras encontram espaço aqui.", "Isso que você trouxe é significativo.", "A escuta se detém neste ponto.", "Uma memória importante se apresenta."]
+REFLEXAO_CATEGORIAS = {
+    "memoria": (
+        ("lembro", "lembrança", "infância", "criança", "quando era", "naquela época", "passado"),
+        ["Uma memória importante se apresenta.", "O passado que você traz encontra lugar aqui.", "Essas lembranças ganham espaço nesta escuta."]
+    ),
+    "vinculos": (
+        ("mãe", "pai", "irmão", "irmã", "filho", "filha", "marido", "esposa", "namorad", "família", "cônjuge", "companheir"),
+        ["Os vínculos que você descreve encontram espaço aqui.", "Essas relações trazidas por você são acolhidas.", "A história desses laços é recebida com atenção."]
+    ),
+    "sofrimento": (
+        ("dor", "triste", "ansiedade", "ansios", "medo", "angústia", "choro", "chorar", "sozinh", "cansad", "depress", "sofr"),
+        ["Isso que você trouxe é significativo.", "A escuta se detém neste ponto.", "O que pesa também encontra espaço aqui."]
+    ),
+    "cotidiano": (
+        ("trabalho", "rotina", "emprego", "hobby", "lazer", "dia a dia", "internet", "remédio", "medicação"),
+        ["Suas palavras encontram espaço aqui.", "Esse retrato do seu cotidiano é recebido com atenção.", "O seu dia a dia fica registrado nesta escuta."]
+    ),
+}
+
+class ReflexaoMetricas:
+    """Taxa de atendimento e latência por camada do motor de reflexão."""
+    def __init__(self, janela=1000):
+        self._lock = threading.Lock()
+        self._contagem = collections.Counter()
+        self._latencias = collections.defaultdict(lambda: collections.deque(maxlen=janela))
+
+    def registrar(self, camada, latencia_s):
+        with self._lock:
+            self._contagem[camada] += 1
+            self._latencias[camada].append(latencia_s)
+
+    def snapshot(self):
+        with self._lock:
+            total = sum(self._contagem.values())
+            resumo = {}
+            for camada, n in self._contagem.items():
+                latencias = sorted(self._latencias[camada])
+                resumo[camada] = {
+                    "respostas": n, "taxa": n / total if total else 0.0,
+                    "latencia_p50_ms": _percentil(latencias, 0.50) * 1000, "latencia_p95_ms": _percentil(latencias, 0.95) * 1000,
+                }
+            return resumo
+
+@st.cache_resource(show_spinner=False)
+def _get_reflexao_metricas():
+    return ReflexaoMetricas()
+
+reflexao_metricas = _get_reflexao_metricas()
+
+def _categorias_reflexao(user_input_lower):
+    return [nome for nome, (termos, _) in REFLEXAO_CATEGORIAS.items() if any(termo in user_input_lower for termo in termos)]
+
+def _reflexao_local(categorias):
+    if categorias:
+        return random.choice(REFLEXAO_CATEGORIAS[categorias[0]][1])
+    return random.choice(REFLEXAO_EXEMPLOS_TOM)
+
+def _escolher_camada_reflexao(user_input, categorias):
+    n_palavras = len(user_input.split())
+    if checar_risco_imediato(user_input) or n_palavras > REFLEXAO_COMPLETO_MIN_PALAVRAS:
+        return "modelo_completo"
+    if n_palavras <= REFLEXAO_LOCAL_MAX_PALAVRAS and len(categorias) <= 1:
+        return "local"
+    return "modelo_leve"
+
+def _reflexao_modelo(user_input, model):
+    prompt = f"""
         Você é uma IA de escuta psicanalítica, auxiliar da Psicanalista Carla Ferreira. Sua função é gerar uma frase curta (máximo 15 palavras), acolhedora e puramente reflexiva, que demonstre escuta ativa sobre a fala do paciente.
         REGRAS ABSOLUTAS: 1. NUNCA faça perguntas. 2. NUNCA dê conselhos. 3. NUNCA interprete. 4. NUNCA use "eu", "sinto", "entendo". 5. Foque em validar o ato da fala.
-        Exemplos de tom: "Suas palavras encontram espaço aqui.", "Isso que você trouxe é significativo.", "A escuta se detém neste ponto.", "Uma memória importante se apresenta."
+        Exemplos de tom: {", ".join(f'"{exemplo}"' for exemplo in REFLEXAO_EXEMPLOS_TOM)}
         A fala do paciente foi: "{user_input}"
         Gere uma única frase de acolhimento reflexivo:
         """
-        response = client.chat.completions.create(
-            model="gpt-4o", messages=[{"role": "user", "content": prompt}], temperature=0.8, max_tokens=50
+    with rastreador.span("openai.reflexao", modelo=model) as span:
+        response = get_openai_gateway().completar(
+            PRIORIDADE_INTERATIVA, prazo_s=REFLEXAO_PRAZO_S,
+            model=model, messages=[{"role": "user", "content": prompt}], temperature=0.8, max_tokens=50
         )
-        return response.choices[0].message.content.strip()
+        span.registrar_uso(response.usage)
+    return response.choices[0].message.content.strip()
+
+def get_intuitive_reflection(user_input, question_text):
+    inicio = time.perf_counter()
+    camada, reflexao = _reflexao_em_camadas(user_input, question_text)
+    reflexao_metricas.registrar(camada, time.perf_counter() - inicio)
+    return reflexao
+
+def _reflexao_em_camadas(user_input, question_text):
+    """Retorna (camada, texto): reformulação, resposta curta, modelo de frase local ou modelo leve/completo."""
+    user_input_lower = user_input.lower()
+    if any(phrase in user_input_lower for phrase in ["não entendi", "como assim", "nao sei", "explique melhor", "não compreendi"]):
+        try:
+            return "reformulacao", reformular_pergunta(question_text)
+        except Exception as e:
+            print(f"Erro ao reformular pergunta: {e}")
+            return "fallback", f"Sem problemas. A pergunta é: '{question_text}'. Por favor, sinta-se à vontade para responder como for mais confortável para você."
+
+    if len(user_input.split()) <= 3 and len(user_input) < 15:
+        return "curta", "Recebido. Pode prosseguir."
+
+    categorias = _categorias_reflexao(user_input_lower)
+    camada = _escolher_camada_reflexao(user_input, categorias)
+    if camada == "local":
+        return camada, _reflexao_local(categorias)
+    try:
+        modelo = REFLEXAO_MODELO_COMPLETO if camada == "modelo_completo" else REFLEXAO_MODELO_LEVE
+        return camada, _reflexao_modelo(user_input, modelo)
     except Exception as e:
         print(f"Erro na reflexão da IA: {e}")
-        return "Sua fala é recebida e acolhida."
+        return "fallback", "Sua fala é recebida e acolhida."
 
-def compile_full_report_text(patient_data, generated_report_content):
-    timestamp_for_report = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+def compile_full_report_text(patient_data, generated_report_content, timestamp_for_report=None):
+    timestamp_for_report = timestamp_for_report or datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     full_report_text = f"--- RELATÓRIO DE TRIAGEM REDE ELLe - {timestamp_for_report} ---\n\n"
     full_report_text += "## Dados Coletados na Triagem:\n"
     for question_key, response_value in patient_data.items():
@@ -190,11 +844,51 @@ def compile_full_report_text(patient_data, generated_report_content):
     full_report_text += "Sessão finalizada com sucesso.\n"
     return full_report_text
 
+@st.cache_resource(show_spinner=False)
+def get_lexico_risco():
+    """Léxico de risco compilado uma vez por processo a partir de lexico_risco.json."""
+    return LexicoRisco.carregar()
+
 def checar_risco_imediato(texto):
-    texto_lower = texto.lower()
-    if "suicídio" in texto_lower or "homicídio" in texto_lower or "matar" in texto_lower:
-        return True
-    return False
+    return get_lexico_risco().tem_risco(texto)
+
+def _textos_triagem_relatorios(lote=500):
+    """Percorre os relatórios salvos em lotes, sem carregar a tabela inteira em memória."""
+    # A conexão fica emprestada até o fim da varredura
+    with get_db().conexao() as conn:
+        cursor = conn.execute("SELECT id, respostas FROM reports ORDER BY id")
+        while True:
+            linhas = cursor.fetchmany(lote)
+            if not linhas: break
+            for report_id, respostas_blob in linhas:
+                respostas, _ = descomprimir_respostas(respostas_blob)
+                yield report_id, "\n".join(r for r in respostas if isinstance(r, str))
+
+def reavaliar_risco_relatorios(lote=500):
+    """Reavalia todo o histórico com o léxico atual numa única passada e registra o resultado em risk_screening."""
+    lexico = get_lexico_risco()
+    screened_at = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    get_db().executar("DELETE FROM risk_screening")
+    pendentes = []
+    total_sinalizados = 0
+    for report_id, ocorrencias in lexico.varrer(_textos_triagem_relatorios(lote)):
+        categorias = sorted({m.categoria for m in ocorrencias})
+        trechos = [{"inicio": m.inicio, "fim": m.fim, "trecho": m.trecho, "categoria": m.categoria} for m in ocorrencias]
+        pendentes.append((report_id, lexico.versao, json.dumps(categorias), json.dumps(trechos, ensure_ascii=False), screened_at))
+        if len(pendentes) >= lote:
+            _gravar_triagem_risco(pendentes)
+            total_sinalizados += len(pendentes)
+            pendentes = []
+    if pendentes:
+        _gravar_triagem_risco(pendentes)
+        total_sinalizados += len(pendentes)
+    return total_sinalizados
+
+def _gravar_triagem_risco(linhas):
+    get_db().escrever(lambda conn: conn.executemany(
+        "INSERT OR REPLACE INTO risk_screening (report_id, lexicon_version, categories, matches, screened_at) VALUES (?, ?, ?, ?, ?)",
+        linhas
+    ))
 
 def get_final_patient_summary(dados_paciente_temp):
     try:
@@ -216,49 +910,109 @@ def get_final_patient_summary(dados_paciente_temp):
         st.warning(f"Não foi possível gerar o resumo final para o paciente: {e}")
         return ("Agradeço imensamente pela sua disponibilidade em compartilhar suas vivências conosco. Sua sessão de escuta inicial foi concluída com sucesso e suas informações serão analisadas com o cuidado e a ética que lhe são devidos. Nossa equipe entrará em contato em breve para os próximos passos.")
 
-def gerar_relatorio_gpt(dados_paciente_temp):
-    historico_triagem = "Registro da Triagem:\n"
-    for pergunta, resposta in dados_paciente_temp.items():
-        if isinstance(pergunta, str) and isinstance(resposta, str):
-            historico_triagem += f"- {pergunta}: {resposta}\n"
-    prompt_para_relatorio = f"""
-    Você é uma Inteligência Artificial auxiliar da Psicanalista Clínica Carla Viviane Guedes Ferreira (REDE ELLe).
-    Sua tarefa é analisar as informações fornecidas por um paciente durante uma triagem inicial e gerar um 'EXAME PSÍQUICO com devolutiva Psicanalítica' conforme a estrutura fornecida.
-    É fundamental que você preencha CADA seção do relatório com base nas respostas do paciente. Faça inferências e observações pertinentes onde for possível e necessário, mas deixe claro se uma informação é uma inferência ou se está ausente.
-    Após o Exame Psíquico, inclua uma seção de "Perspectivas Teóricas Preliminares" aplicando brevemente lentes de Freud, Lacan, Winnicott e Ferenczi, onde pertinente, para sugerir possíveis dinâmicas. Contextualize a relevância do pensador à questão levantada, não apenas um resumo da teoria.
-    Finalize com uma seção de "Sugestões de Intervenção e Atendimento" com base nos dados.
-    ## Informações do Paciente e Respostas da Triagem:
-    {historico_triagem}
-    ## Estrutura do EXAME PSÍQUICO a ser preenchido:
-    {EXAME_PSIQUICO_INSTRUCOES}
-    Hipótese Diagnóstica final:
-    ## Perspectivas Teóricas Preliminares:
-    (Para cada teoria abaixo, analise as falas do paciente e ofereça uma breve perspectiva psicanalítica, conectando a teoria às experiências relatadas. Seja conciso e perspicaz. Se uma teoria não se aplicar ou exigir mais dados, mencione isso.)
-    - **Sigmund Freud:**
-    - **Jacques Lacan:**
-    - **Donald Winnicott:**
-    - **Sándor Ferenczi:**
-    ## Sugestões de Intervenção e Atendimento:
-    (Com base na triagem e nas perspectivas preliminares, aponte caminhos possíveis para a psicanalista Carla Viviane Guedes Ferreira, considerando focos terapêuticos e possíveis abordagens iniciais de acolhimento e elaboração.)
-    Por favor, gere o relatório preenchendo as seções acima com base nas informações fornecidas. Seja conciso, mas completo e analítico.
-    """
+RELATORIO_SYSTEM_PROMPT = "Você é uma IA assistente psicanalítica, auxiliar da Psicanalista Clínica Carla Viviane Guedes Ferreira (REDE ELLe). Seu objetivo é gerar relatórios de triagem detalhados e analíticos para uso profissional."
+# Modo streaming: o relatório é consumido incrementalmente, com o progresso parcial salvo em disco
+RELATORIO_STREAMING = os.getenv("RELATORIO_STREAMING", "1") != "0"
+RELATORIO_PARCIAL_INTERVALO_CHARS = 400
+
+# Prefixo estático do prompt do relatório: mudar este texto exige uma nova RELATORIO_PROMPT_VERSION
+RELATORIO_PROMPT_VERSION = "relatorio-v2"
+RELATORIO_ORCAMENTO_TOKENS = int(os.getenv("RELATORIO_ORCAMENTO_TOKENS", "6000"))
+RELATORIO_INSTRUCOES = f"""Sua tarefa é analisar as informações fornecidas por um paciente durante uma triagem inicial (enviadas na mensagem do usuário) e gerar um 'EXAME PSÍQUICO com devolutiva Psicanalítica' conforme a estrutura abaixo.
+É fundamental que você preencha CADA seção do relatório com base nas respostas do paciente. Faça inferências e observações pertinentes onde for possível e necessário, mas deixe claro se uma informação é uma inferência ou se está ausente.
+Após o Exame Psíquico, inclua uma seção de "Perspectivas Teóricas Preliminares" aplicando brevemente lentes de Freud, Lacan, Winnicott e Ferenczi, onde pertinente, para sugerir possíveis dinâmicas. Contextualize a relevância do pensador à questão levantada, não apenas um resumo da teoria.
+Finalize com uma seção de "Sugestões de Intervenção e Atendimento" com base nos dados.
+
+## Estrutura do EXAME PSÍQUICO a ser preenchido:
+{EXAME_PSIQUICO_INSTRUCOES.strip()}
+Hipótese Diagnóstica final:
+
+## Perspectivas Teóricas Preliminares:
+(Para cada teoria abaixo, analise as falas do paciente e ofereça uma breve perspectiva psicanalítica, conectando a teoria às experiências relatadas. Seja conciso e perspicaz. Se uma teoria não se aplicar ou exigir mais dados, mencione isso.)
+- **Sigmund Freud:**
+- **Jacques Lacan:**
+- **Donald Winnicott:**
+- **Sándor Ferenczi:**
+
+## Sugestões de Intervenção e Atendimento:
+(Com base na triagem e nas perspectivas preliminares, aponte caminhos possíveis para a psicanalista Carla Viviane Guedes Ferreira, considerando focos terapêuticos e possíveis abordagens iniciais de acolhimento e elaboração.)"""
+RELATORIO_PEDIDO_FINAL = "Por favor, gere o relatório preenchendo as seções da estrutura com base nas informações acima. Seja conciso, mas completo e analítico."
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_relatorio():
+    return PromptRelatorioBuilder(
+        RELATORIO_PROMPT_VERSION, RELATORIO_SYSTEM_PROMPT, RELATORIO_INSTRUCOES, RELATORIO_PEDIDO_FINAL,
+        modelo="gpt-4o", orcamento_respostas_tokens=RELATORIO_ORCAMENTO_TOKENS
+    )
+
+def versao_prompt_relatorio():
+    """Versão gravada com os relatórios regenerados: a RELATORIO_PROMPT_VERSION mais a impressão do prefixo, para que
+    uma mudança nas instruções (inclusive em EXAME_PSIQUICO_INSTRUCOES) vire uma versão nova mesmo sem o bump manual."""
+    return f"{RELATORIO_PROMPT_VERSION}-{get_prompt_relatorio().impressao_prefixo}"
+
+def montar_prompt_relatorio(dados_paciente_temp):
+    """Mensagens do relatório: instruções estáticas primeiro (prefixo estável), respostas do paciente por último."""
+    prompt = get_prompt_relatorio().montar(dados_paciente_temp)
+    if prompt.respostas_truncadas:
+        print(f"Prompt {prompt.versao}: {prompt.respostas_truncadas} resposta(s) truncada(s) para caber em {get_prompt_relatorio().orcamento_efetivo_tokens} tokens.")
+    return prompt.messages
+
+def _consumir_relatorio_stream(messages, on_partial=None):
+    """Consome a completion em streaming, repassando o texto parcial a cada intervalo."""
+    partes = []
+    chars_pendentes = 0
+    with rastreador.span("openai.relatorio", modelo="gpt-4o") as span:
+        resposta_stream = get_openai_gateway().completar(
+            PRIORIDADE_RELATORIO, model="gpt-4o", messages=messages, temperature=0.85, max_tokens=2200, stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in resposta_stream:
+            if not chunk.choices:
+                # O último chunk não tem choices e traz o uso de tokens da completion inteira
+                span.registrar_uso(getattr(chunk, "usage", None))
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            partes.append(delta)
+            chars_pendentes += len(delta)
+            if on_partial and chars_pendentes >= RELATORIO_PARCIAL_INTERVALO_CHARS:
+                on_partial("".join(partes))
+                chars_pendentes = 0
+    texto_final = "".join(partes)
+    if on_partial and texto_final:
+        on_partial(texto_final)
+    return texto_final or None
+
+def completar_relatorio(messages, prioridade=PRIORIDADE_RELATORIO, gateway=None):
+    """Relatório numa única chamada, sem streaming. A regeneração em lote passa o próprio gateway e PRIORIDADE_LOTE."""
+    with rastreador.span("openai.relatorio", modelo="gpt-4o") as span:
+        resposta_gpt = (gateway or get_openai_gateway()).completar(
+            prioridade, model="gpt-4o", messages=messages, temperature=0.85, max_tokens=2200
+        )
+        span.registrar_uso(resposta_gpt.usage)
+    return resposta_gpt.choices[0].message.content
+
+def gerar_relatorio_gpt(dados_paciente_temp, stream=False, on_partial=None):
+    """Gera o relatório da IA. Roda no worker do outbox, sem ScriptRunContext: nada de st.* aqui, os erros sobem para o
+    job, que os registra em outbox.last_error (exibido em run_relatorios)."""
+    messages = montar_prompt_relatorio(dados_paciente_temp)
+    if stream:
+        return _consumir_relatorio_stream(messages, on_partial)
+    return completar_relatorio(messages)
+
+def salvar_relatorio_parcial(filepath, texto_parcial):
+    """Grava o progresso parcial do relatório de forma atômica (tmp + rename)."""
     try:
-        with st.spinner("A IA está gerando o relatório interno..."):
-            resposta_gpt = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Você é uma IA assistente psicanalítica, auxiliar da Psicanalista Clínica Carla Viviane Guedes Ferreira (REDE ELLe). Seu objetivo é gerar relatórios de triagem detalhados e analíticos para uso profissional."},
-                    {"role": "user", "content": prompt_para_relatorio}
-                ],
-                temperature=0.85, max_tokens=2200
-            )
-        return resposta_gpt.choices[0].message.content
-    except Exception as e:
-        st.error(f"Ocorreu um erro ao gerar o relatório com a IA: {e}")
-        st.warning("Por favor, verifique se sua chave de API está correta e se você tem créditos na OpenAI.")
-        return None
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: f.write(texto_parcial)
+        os.replace(tmp_path, filepath)
+    except OSError as e:
+        print(f"ERRO ao salvar relatório parcial: {e}")
 
-def save_report_internally(patient_data, raw_generated_report_content, email_sent_status, compiled_report_text_for_file_and_email):
+def save_report_internally(patient_data, raw_generated_report_content, email_sent_status):
+    """Grava o relatório no formato compacto e o indexa para a busca. O .txt é gerado sob demanda (texto_relatorio_para_arquivo)."""
     timestamp_for_db = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     patient_name_for_file = "PacienteAnonimo"
     q1_data = patient_data.get(TRIAGEM_PERGUNTAS[0], "")
@@ -267,34 +1021,65 @@ def save_report_internally(patient_data, raw_generated_report_content, email_sen
         if name_parts:
             patient_name_for_file = "".join(c for c in name_parts if c.isalnum() or c == ' ').strip().replace(" ", "_").replace("__", "_")
             if not patient_name_for_file: patient_name_for_file = "PacienteAnonimo"
-    filename_full = f"relatorio_{patient_name_for_file}_{timestamp_for_db}.txt"
-    reports_dir = "relatorios_triagem"
-    if not os.path.exists(reports_dir): os.makedirs(reports_dir)
-    filepath = os.path.join(reports_dir, filename_full)
-    with open(filepath, "w", encoding="utf-8") as f: f.write(compiled_report_text_for_file_and_email)
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    patient_data_json = json.dumps(patient_data, ensure_ascii=False)
     risk_alert_status = "Sim" if patient_data.get("ALERTA_RISCO_IMEDIATO") == "Sim" else "Não"
     report_content_to_save = raw_generated_report_content if raw_generated_report_content else "ERRO: O relatório da IA não foi gerado."
-    cursor.execute("""
-        INSERT INTO reports (timestamp, patient_name_for_file, patient_data, generated_report, risk_alert, email_sent)
-        VALUES (?, ?, ?, ?, ?, ?);
-    """, (timestamp_for_db, patient_name_for_file, patient_data_json, report_content_to_save, risk_alert_status, 1 if email_sent_status else 0))
-    conn.commit()
-    conn.close()
-    upload_database()
-    return filepath, compiled_report_text_for_file_and_email
+    perguntas, respostas, extras = compactar_dados_paciente(patient_data)
+    respostas_blob = comprimir_respostas(respostas, extras)
+    relatorio_blob = comprimir(report_content_to_save)
 
-def send_report_email(subject, body, filepath=None):
+    def inserir(conn):
+        report_id = conn.execute("""
+            INSERT INTO reports (timestamp, patient_name_for_file, risk_alert, email_sent, perguntas_versao, respostas, relatorio)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+        """, (timestamp_for_db, patient_name_for_file, risk_alert_status, 1 if email_sent_status else 0,
+              _versao_perguntas(conn, perguntas), respostas_blob, relatorio_blob)).lastrowid
+        _indexar_relatorio_busca(conn, report_id, report_content_to_save, respostas)
+        return report_id
+    with rastreador.span("sqlite.salvar_relatorio"):
+        report_id = get_db().escrever(inserir)
+    enfileirar_upload()
+    return report_id
+
+def texto_relatorio_para_arquivo(report_id, prompt_versao=None):
+    """Monta sob demanda o .txt do relatório (antes gravado em relatorios_triagem/). Retorna (nome_arquivo, texto) ou None.
+
+    Com `prompt_versao`, usa o relatório regenerado nessa versão do prompt no lugar do original.
+    """
+    linha = get_db().ler_um(
+        "SELECT timestamp, patient_name_for_file, perguntas_versao, respostas, relatorio, risk_alert FROM reports WHERE id = ?", (report_id,)
+    )
+    if linha is None:
+        return None
+    timestamp, patient_name_for_file, perguntas_versao, respostas_blob, relatorio_blob, risk_alert = linha
+    sufixo = ""
+    if prompt_versao:
+        versao = get_db().ler_um("SELECT relatorio FROM relatorio_versoes WHERE report_id = ? AND prompt_versao = ?", (report_id, prompt_versao))
+        if versao is None:
+            return None
+        relatorio_blob, sufixo = versao[0], f"_{prompt_versao}"
+    texto = compile_full_report_text(expandir_dados_paciente(perguntas_versao, respostas_blob, risk_alert), descomprimir(relatorio_blob), timestamp)
+    return f"relatorio_{patient_name_for_file}_{timestamp}{sufixo}.txt", texto
+
+def versoes_relatorio(report_id):
+    """Versões do prompt em que o relatório foi regenerado, da mais antiga à mais recente."""
+    return [versao for (versao,) in get_db().ler("SELECT prompt_versao FROM relatorio_versoes WHERE report_id = ? ORDER BY id", (report_id,))]
+
+@st.cache_resource
+def get_smtp_pool():
+    """Sessão SMTP autenticada compartilhada pelo processo, reaproveitada entre e-mails."""
+    return SMTPConnectionManager(
+        SMTP_HOST, SMTP_PORT, SENDER_EMAIL, SENDER_PASSWORD, use_ssl=SMTP_SSL,
+        keepalive_s=SMTP_KEEPALIVE_S, max_tentativas=SMTP_MAX_TENTATIVAS
+    )
+
+def _enviar_email(subject, body, filepath=None):
+    """Envia o e-mail pelo pool SMTP; levanta a exceção com o motivo da falha (usado pelos jobs do outbox)."""
     if not SENDER_EMAIL or not SENDER_PASSWORD:
-        st.error("Credenciais de e-mail não configuradas. Envio de e-mail falhou.")
-        return False
+        raise RuntimeError("Credenciais de e-mail não configuradas.")
     msg = EmailMessage()
     body_as_string = str(body) if body is not None else ""
     if not body_as_string.strip():
-        st.error("O corpo do e-mail está vazio. O envio foi abortado.")
-        return False
+        raise ValueError("O corpo do e-mail está vazio.")
     msg['Subject'] = subject
     msg['From'] = SENDER_EMAIL
     msg['To'] = RECEIVER_EMAIL
@@ -308,54 +1093,491 @@ def send_report_email(subject, body, filepath=None):
             file_data = f.read()
             file_name = os.path.basename(filepath)
         msg.add_attachment(file_data, maintype=maintype, subtype=subtype, filename=file_name)
+    with rastreador.span("smtp.envio"):
+        try:
+            return get_smtp_pool().enviar(msg)
+        except smtplib.SMTPAuthenticationError as e:
+            raise RuntimeError(f"Erro de autenticação SMTP (credenciais incorretas ou falta de senha de aplicativo do Gmail): {e}") from e
+
+def send_report_email(subject, body, filepath=None):
+    """Envia o e-mail e devolve True/False, registrando o motivo da falha no log."""
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(SENDER_EMAIL, SENDER_PASSWORD)
-            smtp.send_message(msg)
-        return True
-    except smtplib.SMTPAuthenticationError as e:
-        st.error(f"Erro de autenticação SMTP: Suas credenciais de e-mail estão incorretas ou você precisa de uma senha de aplicativo para o Gmail. Erro: {e}")
-        return False
+        return _enviar_email(subject, body, filepath)
     except Exception as e:
-        st.error(f"Erro ao enviar o e-mail: {e}")
+        print(f"ERRO ao enviar o e-mail: {e}")
         return False
 
 def save_feedback_entry(report_id, feedback_text):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    cursor.execute("INSERT INTO feedback (report_id, feedback_text, timestamp) VALUES (?, ?, ?)", (report_id, feedback_text, timestamp))
-    conn.commit()
-    conn.close()
-    upload_database()
+    with rastreador.span("sqlite.salvar_feedback"):
+        get_db().executar("INSERT INTO feedback (report_id, feedback_text, timestamp) VALUES (?, ?, ?)", (report_id, feedback_text, timestamp))
+    enfileirar_upload()
 
 def get_feedback_for_report(report_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT feedback_text, timestamp FROM feedback WHERE report_id = ? ORDER BY timestamp DESC", (report_id,))
-    feedback_entries = cursor.fetchall()
-    conn.close()
+    feedback_entries = get_db().ler("SELECT feedback_text, timestamp FROM feedback WHERE report_id = ? ORDER BY timestamp DESC", (report_id,))
     return feedback_entries
 
-def get_reports_from_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, timestamp, patient_name_for_file, risk_alert, email_sent FROM reports ORDER BY timestamp DESC")
-    reports_data = cursor.fetchall()
-    conn.close()
-    return reports_data
+def get_feedback_for_reports(report_ids):
+    """Feedback de uma página inteira de relatórios numa única consulta: {report_id: [(texto, timestamp), ...]}."""
+    feedback_por_relatorio = {report_id: [] for report_id in report_ids}
+    if not report_ids: return feedback_por_relatorio
+    marcadores = ", ".join("?" for _ in report_ids)
+    linhas = get_db().ler(
+        f"SELECT report_id, feedback_text, timestamp FROM feedback WHERE report_id IN ({marcadores}) ORDER BY report_id, timestamp DESC",
+        tuple(report_ids)
+    )
+    for report_id, feedback_text, timestamp in linhas:
+        feedback_por_relatorio[report_id].append((feedback_text, timestamp))
+    return feedback_por_relatorio
+
+def get_metricas_por_etapa():
+    """Duração e tokens por etapa instrumentada, somando todos os atendimentos gravados em trace_spans."""
+    return get_db().ler("""
+        SELECT nome, COUNT(*), AVG(duracao_ms), MAX(duracao_ms), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0)
+        FROM trace_spans GROUP BY nome ORDER BY nome
+    """)
+
+def get_metricas_por_relatorio(limit=50):
+    """Tempo total e tokens de cada um dos últimos relatórios."""
+    return get_db().ler("""
+        SELECT report_id, SUM(duracao_ms) / 1000.0, COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0)
+        FROM trace_spans WHERE report_id IS NOT NULL GROUP BY report_id ORDER BY report_id DESC LIMIT ?
+    """, (limit,))
+
+def get_reports_page(limit=50, after=None, risk_alert=None, email_sent=None, data_inicio=None, data_fim=None):
+    """Página de relatórios por keyset em (timestamp, id), com os filtros aplicados no SQL.
+
+    `after` é o cursor (timestamp, id) devolvido pela página anterior. Retorna (linhas, proximo_cursor).
+    """
+    condicoes, params = [], []
+    if risk_alert is not None:
+        condicoes.append("risk_alert = ?"); params.append(risk_alert)
+    if email_sent is not None:
+        condicoes.append("email_sent = ?"); params.append(1 if email_sent else 0)
+    if data_inicio is not None:
+        condicoes.append("timestamp >= ?"); params.append(data_inicio.strftime("%Y%m%d_000000"))
+    if data_fim is not None:
+        condicoes.append("timestamp <= ?"); params.append(data_fim.strftime("%Y%m%d_235959"))
+    if after is not None:
+        condicoes.append("(timestamp, id) < (?, ?)"); params.extend(after)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    linhas = get_db().ler(
+        f"SELECT id, timestamp, patient_name_for_file, risk_alert, email_sent FROM reports {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+        (*params, limit + 1)
+    )
+    proximo_cursor = (linhas[limit - 1][1], linhas[limit - 1][0]) if len(linhas) > limit else None
+    return linhas[:limit], proximo_cursor
+
+BUSCA_STOPWORDS = {
+    "a", "o", "as", "os", "e", "de", "da", "do", "das", "dos", "em", "no", "na", "nos", "nas", "um", "uma", "uns", "umas",
+    "com", "por", "para", "pra", "que", "se", "ao", "aos", "meu", "minha", "seu", "sua", "ele", "ela", "eu", "mas", "ou",
+}
+BUSCA_SUFIXOS = ("amentos", "imentos", "amento", "imento", "mente", "idades", "idade", "edades", "edade", "coes", "cao", "ismos", "ismo",
+                 "istas", "ista", "ando", "endo", "indo", "ados", "adas", "idos", "idas", "ado", "ada", "ido", "ida", "es", "s")
+
+def _radical_busca(termo):
+    """Radical aproximado em português (remoção de sufixos comuns), usado como prefixo na consulta FTS."""
+    for sufixo in BUSCA_SUFIXOS:
+        if termo.endswith(sufixo) and len(termo) - len(sufixo) >= 4:
+            return termo[:-len(sufixo)]
+    return termo
+
+def montar_consulta_fts(texto_busca):
+    """Converte a busca livre numa expressão FTS5: trechos entre aspas viram frases, demais palavras viram prefixos do radical."""
+    frases = re.findall(r'"([^"]+)"', texto_busca)
+    restante = re.sub(r'"[^"]*"', " ", texto_busca)
+    partes = [f'"{normalizar_texto(frase)[0]}"' for frase in frases if frase.strip()]
+    for termo in re.findall(r"\w+", normalizar_texto(restante)[0]):
+        if termo in BUSCA_STOPWORDS: continue
+        partes.append(f'"{_radical_busca(termo)}"*')
+    return " AND ".join(partes)
+
+def buscar_relatorios(texto_busca, limit=20):
+    """Busca ranqueada (BM25) em relatórios, respostas da triagem e feedbacks, com um trecho destacado por relatório."""
+    expressao = montar_consulta_fts(texto_busca)
+    if not expressao: return []
+    # ORDER BY rank é resolvido pelo FTS5: o trecho (que descomprime o conteúdo) só é montado para as linhas devolvidas
+    linhas = get_db().ler("""
+        SELECT rowid, 'relatorio', snippet(busca_relatorios, -1, '**', '**', ' … ', 16), rank
+        FROM busca_relatorios WHERE busca_relatorios MATCH ? AND rank MATCH 'bm25(1.0, 2.0)' ORDER BY rank LIMIT ?
+    """, (expressao, limit * 3)) + get_db().ler("""
+        SELECT f.report_id, 'feedback', snippet(busca_feedback, 0, '**', '**', ' … ', 16), busca_feedback.rank * 1.5
+        FROM busca_feedback JOIN feedback f ON f.id = busca_feedback.rowid
+        WHERE busca_feedback MATCH ? ORDER BY busca_feedback.rank LIMIT ?
+    """, (expressao, limit * 3))
+    linhas.sort(key=lambda linha: linha[3])
+    resultados = {}
+    for report_id, origem, trecho, pontuacao in linhas:
+        if report_id not in resultados:
+            resultados[report_id] = {"report_id": report_id, "origem": origem, "trecho": trecho, "pontuacao": pontuacao}
+    melhores = list(resultados.values())[:limit]
+    if melhores:
+        marcadores = ", ".join("?" for _ in melhores)
+        metadados = dict((linha[0], linha[1:]) for linha in get_db().ler(
+            f"SELECT id, timestamp, patient_name_for_file FROM reports WHERE id IN ({marcadores})", tuple(r["report_id"] for r in melhores)
+        ))
+        for resultado in melhores:
+            resultado["timestamp"], resultado["patient_name_for_file"] = metadados.get(resultado["report_id"], (None, None))
+    return melhores
 
 def get_single_report_from_db(report_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT patient_data, generated_report FROM reports WHERE id = ?", (report_id,))
-    report_detail = cursor.fetchone()
-    conn.close()
-    if report_detail: return json.loads(report_detail[0]), report_detail[1]
+    report_detail = get_db().ler_um("SELECT perguntas_versao, respostas, relatorio, risk_alert FROM reports WHERE id = ?", (report_id,))
+    if report_detail:
+        perguntas_versao, respostas_blob, relatorio_blob, risk_alert = report_detail
+        return expandir_dados_paciente(perguntas_versao, respostas_blob, risk_alert), descomprimir(relatorio_blob)
     return {}, ""
 
+# --- OUTBOX PÓS-TRIAGEM (processamento em segundo plano com retentativas) ---
+OUTBOX_MAX_TENTATIVAS = int(os.getenv("OUTBOX_MAX_TENTATIVAS", "6"))
+OUTBOX_BACKOFF_BASE_S = float(os.getenv("OUTBOX_BACKOFF_BASE_S", "2"))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "300"))
+OUTBOX_INTERVALO_POLL_S = 5.0
+# Jobs são reservados por (prioridade, id): menor primeiro. Alertas de risco (e-mail urgente ou relatório com alerta)
+# ficam com prioridade 0 e passam à frente de tudo que estiver na fila
+OUTBOX_PRIORIDADES = {"email": 1, "digest": 1, "upload": 2, "relatorio": 3}
+OUTBOX_PRIORIDADE_URGENTE = 0
+# Relatórios rodam num pool próprio (por padrão, as vagas de lote do gateway): uma geração longa não segura e-mails,
+# digests e uploads, que seguem numa thread separada
+OUTBOX_WORKERS_RELATORIO = int(os.getenv("OUTBOX_WORKERS_RELATORIO", str(max(1, OPENAI_MAX_CONCORRENTES - OPENAI_VAGAS_INTERATIVAS))))
+@st.cache_resource(show_spinner=False)
+def _get_outbox_evento():
+    return threading.Event()
+
+_outbox_evento = _get_outbox_evento()
+
+class OutboxMetricas:
+    """Contadores em memória do worker: jobs enfileirados, concluídos, retentativas e latência de drenagem."""
+    def __init__(self, janela=500):
+        self._lock = threading.Lock()
+        self.enfileirados = 0
+        self.concluidos = 0
+        self.retentativas = 0
+        self.falhas_definitivas = 0
+        self._espera = collections.deque(maxlen=janela)
+        self._drenagem = collections.deque(maxlen=janela)
+
+    def registrar_enfileirado(self):
+        with self._lock: self.enfileirados += 1
+
+    def registrar_conclusao(self, espera_s, drenagem_s):
+        with self._lock:
+            self.concluidos += 1
+            self._espera.append(espera_s)
+            self._drenagem.append(drenagem_s)
+
+    def registrar_falha(self, definitiva):
+        with self._lock:
+            if definitiva: self.falhas_definitivas += 1
+            else: self.retentativas += 1
+
+    def snapshot(self):
+        with self._lock:
+            drenagem = sorted(self._drenagem)
+            espera = sorted(self._espera)
+            return {
+                "enfileirados": self.enfileirados, "concluidos": self.concluidos,
+                "retentativas": self.retentativas, "falhas_definitivas": self.falhas_definitivas,
+                "espera_p50_s": _percentil(espera, 0.50), "drenagem_p50_s": _percentil(drenagem, 0.50),
+                "drenagem_p95_s": _percentil(drenagem, 0.95),
+            }
+
+def _percentil(valores_ordenados, q):
+    if not valores_ordenados: return 0.0
+    return valores_ordenados[min(len(valores_ordenados) - 1, int(q * len(valores_ordenados)))]
+
+@st.cache_resource(show_spinner=False)
+def _get_outbox_metricas():
+    return OutboxMetricas()
+
+outbox_metricas = _get_outbox_metricas()
+
+def _prioridade_job(kind, payload):
+    urgente = payload.get("urgente") or payload.get("dados_paciente", {}).get("ALERTA_RISCO_IMEDIATO") == "Sim"
+    return OUTBOX_PRIORIDADE_URGENTE if urgente else OUTBOX_PRIORIDADES[kind]
+
+def _inserir_job(conn, kind, payload):
+    agora = time.time()
+    return conn.execute(
+        "INSERT INTO outbox (kind, payload, created_at, next_attempt_at, prioridade) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), agora, agora, _prioridade_job(kind, payload))
+    ).lastrowid
+
+def _job_enfileirado():
+    outbox_metricas.registrar_enfileirado()
+    _outbox_evento.set()
+
+def enfileirar_job(kind, payload):
+    """Insere um job no outbox. É a única escrita feita pela thread da interface."""
+    with rastreador.span("sqlite.enfileirar"):
+        job_id = get_db().escrever(lambda conn: _inserir_job(conn, kind, payload))
+    _job_enfileirado()
+    return job_id
+
+def chave_idempotencia_relatorio(dados_paciente_temp, sessao_id=None):
+    """Hash estável do conteúdo da triagem e da sessão que a produziu."""
+    conteudo = json.dumps(dados_paciente_temp, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{sessao_id or ''}\n{conteudo}".encode("utf-8")).hexdigest()
+
+def enfileirar_relatorio_triagem(dados_paciente_temp, trace_id=None, sessao_id=None):
+    """Reserva a triagem e enfileira o job na mesma transação; repetições devolvem o job já reservado.
+
+    A thread escritora serializa as reservas, então reruns simultâneos da mesma triagem (reconexão, refresh, duas abas)
+    resultam num único job, e portanto numa única completion, num único relatório e num único e-mail.
+    """
+    chave = chave_idempotencia_relatorio(dados_paciente_temp, sessao_id)
+
+    def reservar(conn):
+        existente = conn.execute("SELECT job_id FROM relatorio_idempotencia WHERE chave = ?", (chave,)).fetchone()
+        if existente:
+            return existente[0], False
+        job_id = _inserir_job(conn, "relatorio", {"dados_paciente": dados_paciente_temp, "trace_id": trace_id, "chave": chave})
+        agora = time.time()
+        conn.execute(
+            "INSERT INTO relatorio_idempotencia (chave, sessao_id, job_id, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?)",
+            (chave, sessao_id, job_id, agora, agora)
+        )
+        return job_id, True
+    with rastreador.span("sqlite.enfileirar"):
+        job_id, novo = get_db().escrever(reservar)
+    if novo:
+        _job_enfileirado()
+    return job_id
+
+def _enfileirar_job_coalescido(kind, atraso_s):
+    """Agenda um job sem payload para daqui a `atraso_s`, a menos que já exista um pendente do mesmo tipo."""
+    agora = time.time()
+    _, inseridos = get_db().executar("""
+        INSERT INTO outbox (kind, payload, created_at, next_attempt_at, prioridade)
+        SELECT ?, '{}', ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM outbox WHERE kind = ? AND status = 'pendente')
+    """, (kind, agora, agora + atraso_s, OUTBOX_PRIORIDADES[kind], kind))
+    if inseridos > 0:
+        outbox_metricas.registrar_enfileirado()
+        _outbox_evento.set()
+
+def enfileirar_upload():
+    """Agenda um sync do banco ao fim da janela SYNC_JANELA_S; escritas dentro da janela são coalescidas num único job."""
+    sync_engine.registrar_escrita()
+    _enfileirar_job_coalescido("upload", SYNC_JANELA_S)
+
+def outbox_erros_recentes(limite=20):
+    """Jobs com erro registrado (em retentativa, falha definitiva ou concluídos com aviso), dos mais recentes aos antigos."""
+    return get_db().ler(
+        "SELECT id, kind, status, attempts, last_error FROM outbox WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT ?", (limite,)
+    )
+
+def outbox_profundidade():
+    """Quantidade de jobs ainda não concluídos, por tipo."""
+    return dict(get_db().ler("SELECT kind, COUNT(*) FROM outbox WHERE status IN ('pendente', 'processando') GROUP BY kind"))
+
+def _atualizar_payload_job(job_id, payload):
+    get_db().executar("UPDATE outbox SET payload = ? WHERE id = ?", (json.dumps(payload, ensure_ascii=False), job_id))
+
+def _processar_job_relatorio(job_id, payload):
+    dados_paciente_temp = payload["dados_paciente"]
+    chave = payload.get("chave")
+    if chave and get_db().ler_um("SELECT 1 FROM relatorio_idempotencia WHERE chave = ? AND status = 'concluido'", (chave,)):
+        # Job retomado depois de já ter entregue o e-mail ao outbox (ex.: restart antes de marcar o job como concluído)
+        return
+    if "report_id" not in payload:
+        parcial_path = os.path.join("relatorios_triagem", f"parcial_outbox_{job_id}.txt")
+        try:
+            relatorio_gerado = gerar_relatorio_gpt(
+                dados_paciente_temp, stream=RELATORIO_STREAMING,
+                on_partial=lambda texto: salvar_relatorio_parcial(parcial_path, texto)
+            )
+            erro_geracao = None if relatorio_gerado else "a IA devolveu um relatório vazio"
+        except Exception as e:
+            print(f"ERRO ao gerar o relatório (job {job_id}): {e}")
+            relatorio_gerado, erro_geracao = None, str(e)
+        if relatorio_gerado is None and payload.get("tentativas_geracao", 0) + 1 < OUTBOX_MAX_TENTATIVAS:
+            payload["tentativas_geracao"] = payload.get("tentativas_geracao", 0) + 1
+            _atualizar_payload_job(job_id, payload)
+            raise RuntimeError(f"O relatório da IA não foi gerado: {erro_geracao}")
+        if erro_geracao:
+            # Última tentativa: o relatório segue com o texto de erro, e o motivo fica no job (ver _executar_job)
+            payload["erro_geracao"] = erro_geracao
+        compiled_report_text = compile_full_report_text(dados_paciente_temp, relatorio_gerado)
+        report_id = save_report_internally(dados_paciente_temp, relatorio_gerado, False)
+        payload.update({"report_id": report_id, "compiled_report_text": compiled_report_text})
+        # Progresso salvo no próprio job: uma retentativa não duplica o relatório
+        _atualizar_payload_job(job_id, payload)
+        if chave:
+            get_db().executar(
+                "UPDATE relatorio_idempotencia SET report_id = ?, status = 'gerado', atualizado_em = ? WHERE chave = ?",
+                (report_id, time.time(), chave)
+            )
+        if os.path.exists(parcial_path): os.remove(parcial_path)
+    email_subject = f"Relatório de Triagem REDE ELLe - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    urgente = dados_paciente_temp.get("ALERTA_RISCO_IMEDIATO") == "Sim"
+    if urgente:
+        email_subject = f"[ALERTA DE RISCO] {email_subject}"
+    email_payload = {
+        "report_id": payload["report_id"], "subject": email_subject, "body": payload["compiled_report_text"], "urgente": urgente,
+        "trace_id": payload.get("trace_id")
+    }
+
+    def enfileirar_email(conn):
+        # E-mail e marcação da triagem como concluída na mesma transação: uma retentativa deste job não reenvia o relatório
+        _inserir_job(conn, "email", email_payload)
+        if chave:
+            conn.execute(
+                "UPDATE relatorio_idempotencia SET status = 'concluido', atualizado_em = ? WHERE chave = ?", (time.time(), chave)
+            )
+    get_db().escrever(enfileirar_email)
+    _job_enfileirado()
+    if payload.get("erro_geracao"):
+        return f"Relatório salvo sem o texto da IA: {payload['erro_geracao']}"
+
+def _processar_job_email(job_id, payload):
+    if EMAIL_DIGEST_INTERVALO_S > 0 and not payload.get("urgente", True):
+        # Sem alerta de risco: entra no próximo digest em vez de gerar um e-mail próprio
+        get_db().executar(
+            "INSERT OR IGNORE INTO email_digest (report_id, subject, body, created_at) VALUES (?, ?, ?, ?)",
+            (payload["report_id"], payload["subject"], payload["body"], time.time())
+        )
+        _enfileirar_job_coalescido("digest", EMAIL_DIGEST_INTERVALO_S)
+        return
+    if not _enviar_email(payload["subject"], payload["body"]):
+        raise RuntimeError("Falha no envio do e-mail do relatório.")
+    get_db().executar("UPDATE reports SET email_sent = 1 WHERE id = ?", (payload["report_id"],))
+    enfileirar_upload()
+
+def _processar_job_digest(job_id, payload):
+    itens = get_db().ler("SELECT report_id, subject, body FROM email_digest WHERE sent_at IS NULL ORDER BY report_id")
+    if not itens:
+        return
+    separador = "\n\n" + "=" * 60 + "\n\n"
+    corpo = separador.join(f"{subject} (relatório #{report_id})\n\n{body}" for report_id, subject, body in itens)
+    assunto = f"Digest REDE ELLe - {len(itens)} relatório(s) - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    if not _enviar_email(assunto, corpo):
+        raise RuntimeError("Falha no envio do digest de relatórios.")
+    ids = [report_id for report_id, _, _ in itens]
+    agora = time.time()
+
+    def marcar_enviados(conn):
+        conn.executemany("UPDATE email_digest SET sent_at = ? WHERE report_id = ?", ((agora, i) for i in ids))
+        conn.executemany("UPDATE reports SET email_sent = 1 WHERE id = ?", ((i,) for i in ids))
+    get_db().escrever(marcar_enviados)
+    enfileirar_upload()
+
+def _processar_job_upload(job_id, payload):
+    if not upload_database():
+        raise RuntimeError("Falha no upload do banco de dados.")
+
+OUTBOX_HANDLERS = {
+    "relatorio": _processar_job_relatorio,
+    "email": _processar_job_email,
+    "digest": _processar_job_digest,
+    "upload": _processar_job_upload,
+}
+
+def _reservar_proximo_job(relatorios):
+    """Reserva o próximo job vencido da faixa: só relatórios (`relatorios=True`) ou só os demais tipos."""
+    def reservar(conn):
+        job = conn.execute(
+            f"SELECT id, kind, payload, attempts, created_at FROM outbox WHERE status = 'pendente' AND next_attempt_at <= ? "
+            f"AND kind {'=' if relatorios else '!='} 'relatorio' ORDER BY prioridade, id LIMIT 1",
+            (time.time(),)
+        ).fetchone()
+        if job:
+            conn.execute("UPDATE outbox SET status = 'processando' WHERE id = ?", (job[0],))
+        return job
+    return get_db().escrever(reservar)
+
+def _segundos_ate_proximo_job():
+    """Tempo de espera ocioso: até a próxima retentativa agendada, limitado ao intervalo de polling."""
+    try:
+        proximo = get_db().ler_um("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pendente'")[0]
+    except sqlite3.Error:
+        return OUTBOX_INTERVALO_POLL_S
+    if proximo is None: return OUTBOX_INTERVALO_POLL_S
+    return min(max(proximo - time.time(), 0.0), OUTBOX_INTERVALO_POLL_S)
+
+def gravar_spans_do_trace(trace_id, report_id):
+    """Grava numa única transação os spans pendentes do atendimento, já vinculados ao relatório."""
+    spans = rastreador.descarregar(trace_id)
+    if not spans:
+        return
+    get_db().escrever(lambda conn: conn.executemany(
+        "INSERT INTO trace_spans (report_id, trace_id, nome, inicio, duracao_ms, modelo, prompt_tokens, completion_tokens, erro) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((report_id,) + tuple(span) for span in spans)
+    ))
+
+def _executar_job(job):
+    """Roda o handler do job. A falha (ou o aviso que o handler devolver ao concluir) fica em last_error, que é como
+    erros do worker, sem ScriptRunContext para st.error, chegam ao painel (ver outbox_erros_recentes)."""
+    job_id, kind, payload_json, attempts, created_at = job
+    inicio = time.time()
+    payload = json.loads(payload_json)
+    try:
+        with rastreador.contexto(payload.get("trace_id")):
+            aviso = OUTBOX_HANDLERS[kind](job_id, payload)
+        status, next_attempt_at, erro = "concluido", inicio, aviso
+        outbox_metricas.registrar_conclusao(inicio - created_at, time.time() - created_at)
+    except Exception as e:
+        attempts += 1
+        erro = str(e)
+        definitiva = attempts >= OUTBOX_MAX_TENTATIVAS
+        atraso = min(OUTBOX_BACKOFF_BASE_S * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX_S)
+        status = "falhou" if definitiva else "pendente"
+        next_attempt_at = time.time() + atraso + random.uniform(0, atraso * 0.2)
+        outbox_metricas.registrar_falha(definitiva)
+        print(f"ERRO no job {job_id} ({kind}), tentativa {attempts}: {e}")
+    get_db().executar(
+        "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+        (status, attempts, next_attempt_at, erro, job_id)
+    )
+    if payload.get("trace_id") and payload.get("report_id"):
+        gravar_spans_do_trace(payload["trace_id"], payload["report_id"])
+
+def _loop_outbox(relatorios=False):
+    proxima_purga = time.monotonic() + SESSAO_PURGA_INTERVALO_S
+    while True:
+        if not relatorios and time.monotonic() >= proxima_purga:
+            # Sem isso, checkpoints abandonados só sairiam do banco (e do bucket) no próximo restart
+            try:
+                if purgar_checkpoints_expirados():
+                    enfileirar_upload()
+            except sqlite3.Error as e:
+                print(f"ERRO ao purgar checkpoints expirados: {e}")
+            proxima_purga = time.monotonic() + SESSAO_PURGA_INTERVALO_S
+        # Limpa o evento antes de consultar a fila: com várias threads esperando, um job enfileirado depois da consulta
+        # sempre acorda quem ficou sem trabalho
+        _outbox_evento.clear()
+        try:
+            job = _reservar_proximo_job(relatorios)
+        except sqlite3.Error as e:
+            print(f"ERRO ao ler o outbox: {e}")
+            job = None
+        if job is None:
+            _outbox_evento.wait(timeout=_segundos_ate_proximo_job())
+            continue
+        _executar_job(job)
+
+@st.cache_resource
+def iniciar_worker_outbox():
+    """Sobe as threads de drenagem do processo, retomando jobs interrompidos por um restart.
+
+    Uma thread para e-mails, digests e uploads e OUTBOX_WORKERS_RELATORIO para a geração de relatórios.
+    """
+    get_db().executar("UPDATE outbox SET status = 'pendente' WHERE status = 'processando'")
+    workers = [threading.Thread(target=_loop_outbox, name="outbox-worker", daemon=True)] + [
+        threading.Thread(target=_loop_outbox, args=(True,), name=f"outbox-relatorio-{i}", daemon=True)
+        for i in range(OUTBOX_WORKERS_RELATORIO)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
 # --- LÓGICA DO STREAMLIT APP (Refatorada para Estabilidade) ---
 def main():
+    aquecimento = iniciar_aquecimento_banco()
+    get_reformulacao_cache()
+    if aquecimento.erro is not None:
+        st.error("O sistema está temporariamente indisponível. Por favor, tente novamente mais tarde.")
+        print(f"ERRO: aquecimento do banco falhou, páginas bloqueadas: {aquecimento.erro}")
+        st.stop()
     st.title("Psicanálise Digital com Escuta Ampliada – REDE ELLe")
     st.subheader("Seu espaço de acolhimento e escuta inicial")
 
@@ -394,133 +1616,343 @@ def main():
 
     # Renderização da página selecionada
     if st.session_state.current_page == "Triagem Inicial":
-        run_triagem()
+        with rastreador.contexto(st.session_state.get("trace_id")):
+            run_triagem()
     elif st.session_state.current_page == "Visualizar Relatórios" and st.session_state.logged_in:
         run_relatorios()
     else:
         # Se não estiver logado, mas tentar acessar relatórios, força a triagem
-        run_triagem()
+        with rastreador.contexto(st.session_state.get("trace_id")):
+            run_triagem()
+
+# --- SESSÃO DE TRIAGEM: ESTADO COMPACTO E CHECKPOINT ---
+# Sessões em andamento ficam em sessoes_triagem (sincronizada com o bucket) e são retomadas pelo ?sessao=<id> da URL,
+# mas só no navegador que tem o segredo de retomada: ele vai num cookie (fora da URL e do histórico) e o banco guarda
+# apenas o hash. Quem tiver só o link começa uma triagem nova.
+SESSAO_CHECKPOINT_TTL_H = float(os.getenv("SESSAO_CHECKPOINT_TTL_H", "24"))
+SESSAO_PURGA_INTERVALO_S = float(os.getenv("SESSAO_PURGA_INTERVALO_S", "3600"))
+SESSAO_COOKIE_RETOMADA = "redeelle_retomada"
+MENSAGEM_INICIAL_TRIAGEM = """Olá. Sou a assistente de triagem da REDE ELLe. Como você leu no termo, nossa conversa inicial será registrada para que a Psicanalista Carla Ferreira possa dar continuidade ao seu atendimento da forma mais acolhedora possível.\n\nVamos começar? Para isso, preciso de alguns dados básicos.\nQual seu nome, idade, whatsapp e cidade?"""
+AVISO_RISCO_IMEDIATO = "!!! ATENÇÃO !!! Foi detectada uma fala relacionada a risco de suicídio ou homicídio. Lembre-se do item 4 do Termo de Consentimento. É crucial que você procure ajuda profissional imediata."
+
+def dados_paciente_da_sessao(respostas, alerta):
+    """Monta o dados_paciente usado no relatório a partir das respostas posicionais da sessão."""
+    dados = {f"Pergunta {i + 1}: {TRIAGEM_PERGUNTAS[i]}": resposta for i, resposta in enumerate(respostas)}
+    if alerta:
+        dados["ALERTA_RISCO_IMEDIATO"] = "Sim"
+    return dados
+
+def historico_da_sessao(respostas, reflexoes, mensagem_final=None):
+    """Reconstrói o chat exibido ao paciente como (falante, texto); as perguntas vêm de TRIAGEM_PERGUNTAS."""
+    historico = [("IA", MENSAGEM_INICIAL_TRIAGEM)]
+    for i, resposta in enumerate(respostas):
+        historico.append(("Paciente", resposta))
+        if i < len(reflexoes):
+            historico.append(("IA", reflexoes[i]))
+        if i + 1 < len(TRIAGEM_PERGUNTAS):
+            historico.append(("IA", TRIAGEM_PERGUNTAS[i + 1]))
+    if mensagem_final:
+        historico.append(("IA", mensagem_final))
+    return historico
+
+def _hash_segredo_retomada(segredo):
+    return hashlib.sha256(segredo.encode("utf-8")).hexdigest()
+
+def _gravar_cookie_retomada(segredo):
+    """Grava o segredo de retomada num cookie do app; o st.context.cookies o devolve nas sessões seguintes do navegador."""
+    import streamlit.components.v1 as components
+    max_age = int(SESSAO_CHECKPOINT_TTL_H * 3600)
+    components.html(
+        f"<script>window.parent.document.cookie = '{SESSAO_COOKIE_RETOMADA}={segredo}; max-age={max_age}; path=/; SameSite=Strict';</script>",
+        height=0
+    )
+
+def salvar_checkpoint_sessao(sessao_id, respostas, reflexoes, alerta, trace_id, segredo):
+    get_db().executar("""
+        INSERT INTO sessoes_triagem (sessao_id, respostas, reflexoes, alerta, trace_id, atualizado_em, segredo_hash) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(sessao_id) DO UPDATE SET
+            respostas = excluded.respostas, reflexoes = excluded.reflexoes, alerta = excluded.alerta, atualizado_em = excluded.atualizado_em
+    """, (sessao_id, json.dumps(respostas, ensure_ascii=False), json.dumps(reflexoes, ensure_ascii=False), int(alerta), trace_id,
+          time.time(), _hash_segredo_retomada(segredo)))
+    enfileirar_upload()
+
+def carregar_checkpoint_sessao(sessao_id, segredo):
+    """Checkpoint da sessão, ou None se não existir, tiver expirado ou o segredo de retomada não conferir."""
+    if not segredo:
+        return None
+    linha = get_db().ler_um(
+        "SELECT respostas, reflexoes, alerta, trace_id, segredo_hash FROM sessoes_triagem WHERE sessao_id = ? AND atualizado_em >= ?",
+        (sessao_id, time.time() - SESSAO_CHECKPOINT_TTL_H * 3600)
+    )
+    if linha is None or not linha[4] or not hmac.compare_digest(linha[4], _hash_segredo_retomada(segredo)):
+        return None
+    respostas, reflexoes, alerta, trace_id, _ = linha
+    return {"respostas": json.loads(respostas), "reflexoes": json.loads(reflexoes), "alerta": bool(alerta), "trace_id": trace_id}
+
+def remover_checkpoint_sessao(sessao_id):
+    if sessao_id:
+        get_db().executar("DELETE FROM sessoes_triagem WHERE sessao_id = ?", (sessao_id,))
+
+def purgar_checkpoints_expirados(db=None):
+    """Apaga checkpoints de sessões abandonadas há mais de SESSAO_CHECKPOINT_TTL_H; chamado no init_db e pelo worker do outbox.
+
+    Retorna quantos foram apagados.
+    """
+    return (db or get_db()).escrever(lambda conn: conn.execute(
+        "DELETE FROM sessoes_triagem WHERE atualizado_em < ?", (time.time() - SESSAO_CHECKPOINT_TTL_H * 3600,)
+    ).rowcount)
+
+def _iniciar_sessao_triagem():
+    st.session_state.triagem_flow_state = 'consent'
+    st.session_state.triagem_respostas = []
+    st.session_state.triagem_reflexoes = []
+    st.session_state.triagem_alerta = False
+    st.session_state.triagem_mensagem_final = None
+    st.session_state.triagem_sessao_id = None
+    st.session_state.triagem_segredo = None
+    st.session_state.trace_id = uuid.uuid4().hex
+    sessao_id = st.query_params.get("sessao")
+    segredo = st.context.cookies.get(SESSAO_COOKIE_RETOMADA)
+    try:
+        checkpoint = carregar_checkpoint_sessao(sessao_id, segredo) if sessao_id else None
+    except BancoIndisponivel as e:
+        print(f"ERRO ao carregar o checkpoint da sessão: {e}")
+        checkpoint = None
+    if checkpoint:
+        # Sessão interrompida (ex.: restart do dyno): retoma da última resposta gravada
+        st.session_state.triagem_respostas = checkpoint["respostas"]
+        st.session_state.triagem_reflexoes = checkpoint["reflexoes"]
+        st.session_state.triagem_alerta = checkpoint["alerta"]
+        st.session_state.trace_id = checkpoint["trace_id"] or st.session_state.trace_id
+        st.session_state.triagem_sessao_id = sessao_id
+        st.session_state.triagem_segredo = segredo
+        # Refresh durante a geração: todas as respostas já estão gravadas, e o enfileiramento idempotente reaproveita o job
+        completa = len(checkpoint["respostas"]) >= len(TRIAGEM_PERGUNTAS)
+        st.session_state.triagem_flow_state = 'generating_report' if completa else 'asking'
+
+def _registrar_resposta_triagem():
+    """Callback do chat_input: processa a resposta antes do redesenho, para que ele já mostre a reflexão."""
+    resposta = st.session_state.get("resposta_triagem")
+    respostas = st.session_state.triagem_respostas
+    if not resposta or st.session_state.triagem_flow_state != 'asking' or len(respostas) >= len(TRIAGEM_PERGUNTAS):
+        return
+    question_text = TRIAGEM_PERGUNTAS[len(respostas)]
+    respostas.append(resposta)
+    st.session_state.triagem_aviso_risco = checar_risco_imediato(resposta)
+    if st.session_state.triagem_aviso_risco:
+        st.session_state.triagem_alerta = True
+    # Callbacks rodam antes de main(), fora do contexto de rastreamento da página
+    with rastreador.contexto(st.session_state.get("trace_id")):
+        st.session_state.triagem_reflexoes.append(get_intuitive_reflection(resposta, question_text))
+    if len(respostas) >= len(TRIAGEM_PERGUNTAS):
+        st.session_state.triagem_flow_state = 'generating_report'
+    try:
+        salvar_checkpoint_sessao(
+            st.session_state.triagem_sessao_id, respostas, st.session_state.triagem_reflexoes,
+            st.session_state.triagem_alerta, st.session_state.get("trace_id"), st.session_state.triagem_segredo
+        )
+    except BancoIndisponivel as e:
+        # O checkpoint só serve para retomar depois de um restart: a triagem segue com as respostas em memória
+        print(f"ERRO ao salvar o checkpoint da sessão: {e}")
+
+def _exibir_mensagens(mensagens):
+    for speaker, texto in mensagens:
+        with st.chat_message(name="user" if speaker == 'Paciente' else 'assistant'):
+            st.write(texto)
+
+@st.fragment
+def _conversa_triagem():
+    """Parte redesenhada a cada resposta: só as mensagens novas desde a última execução completa e o campo de resposta."""
+    historico = historico_da_sessao(st.session_state.triagem_respostas, st.session_state.triagem_reflexoes)
+    _exibir_mensagens(historico[st.session_state.triagem_renderizadas:])
+    if st.session_state.get("triagem_aviso_risco"):
+        st.warning(AVISO_RISCO_IMEDIATO)
+    if st.session_state.triagem_flow_state != 'asking':
+        st.rerun()
+    st.chat_input("Sua resposta:", key="resposta_triagem", on_submit=_registrar_resposta_triagem)
 
 def run_triagem():
-    if 'triagem_flow_state' not in st.session_state or st.session_state.triagem_flow_state == 'finished':
-        st.session_state.triagem_flow_state = 'consent'
-        st.session_state.dados_paciente = {}
-        st.session_state.current_question_index = 0
-        st.session_state.chat_history = []
-        st.session_state.patient_first_name = None
+    # Uma nova sessão começa ao atualizar a página; 'finished' precisa sobreviver ao rerun para exibir o encerramento
+    if 'triagem_flow_state' not in st.session_state:
+        _iniciar_sessao_triagem()
 
     if st.session_state.triagem_flow_state == 'consent':
         st.markdown("### Por favor, leia o Termo de Consentimento Informado abaixo:")
         st.markdown(TERMO_CONSENTIMENTO)
         if st.button("Eu concordo e quero iniciar a triagem"):
+            st.session_state.triagem_sessao_id = uuid.uuid4().hex
+            st.session_state.triagem_segredo = secrets.token_urlsafe(32)
+            st.query_params["sessao"] = st.session_state.triagem_sessao_id
             st.session_state.triagem_flow_state = 'asking'
-            initial_ia_message = """Olá. Sou a assistente de triagem da REDE ELLe. Como você leu no termo, nossa conversa inicial será registrada para que a Psicanalista Carla Ferreira possa dar continuidade ao seu atendimento da forma mais acolhedora possível.\n\nVamos começar? Para isso, preciso de alguns dados básicos.\nQual seu nome, idade, whatsapp e cidade?"""
-            st.session_state.chat_history.append({"speaker": "IA", "text": initial_ia_message})
             st.rerun()
-    
+
     elif st.session_state.triagem_flow_state == 'asking':
-        # Exibe o histórico do chat
-        for chat in st.session_state.chat_history:
-            with st.chat_message(name="user" if chat['speaker'] == 'Paciente' else 'assistant'):
-                st.write(chat['text'])
-        
-        # Lógica principal de perguntas e respostas
-        if st.session_state.current_question_index < len(TRIAGEM_PERGUNTAS):
-            question_text = TRIAGEM_PERGUNTAS[st.session_state.current_question_index]
-            
-            # O input do usuário é gerenciado pelo session state para evitar bugs de rerender
-            if f"response_{st.session_state.current_question_index}" not in st.session_state:
-                st.session_state[f"response_{st.session_state.current_question_index}"] = ""
-
-            user_response = st.chat_input("Sua resposta:")
-
-            if user_response:
-                st.session_state.chat_history.append({"speaker": "Paciente", "text": user_response})
-                question_key_str = f"Pergunta {st.session_state.current_question_index + 1}: {question_text}"
-                st.session_state.dados_paciente[question_key_str] = user_response
-
-                if st.session_state.current_question_index == 0:
-                    try:
-                        first_name_match = user_response.split(',')[0].strip().split(' ')[0]
-                        if first_name_match and first_name_match.isalpha(): st.session_state.patient_first_name = first_name_match
-                    except: pass
-                
-                if checar_risco_imediato(user_response):
-                    st.warning("!!! ATENÇÃO !!! Foi detectada uma fala relacionada a risco de suicídio ou homicídio. Lembre-se do item 4 do Termo de Consentimento. É crucial que você procure ajuda profissional imediata.")
-                    st.session_state.dados_paciente["ALERTA_RISCO_IMEDIATO"] = "Sim"
-
-                reflection_text_ia = get_intuitive_reflection(user_response, question_text)
-                st.session_state.chat_history.append({"speaker": "IA", "text": reflection_text_ia})
-                
-                st.session_state.current_question_index += 1
-                
-                if st.session_state.current_question_index < len(TRIAGEM_PERGUNTAS):
-                    next_question_from_list = TRIAGEM_PERGUNTAS[st.session_state.current_question_index]
-                    st.session_state.chat_history.append({"speaker": "IA", "text": next_question_from_list})
-                else: # Se esta foi a última pergunta, muda o estado
-                    st.session_state.triagem_flow_state = 'generating_report'
-                st.rerun()
-        else: # Se já respondeu tudo, mas ainda está no estado 'asking'
-            st.session_state.triagem_flow_state = 'generating_report'
-            st.rerun()
+        # Execução completa: desenha o histórico até aqui; as respostas seguintes só redesenham o fragmento
+        _gravar_cookie_retomada(st.session_state.triagem_segredo)
+        historico = historico_da_sessao(st.session_state.triagem_respostas, st.session_state.triagem_reflexoes)
+        _exibir_mensagens(historico)
+        st.session_state.triagem_renderizadas = len(historico)
+        _conversa_triagem()
 
     elif st.session_state.triagem_flow_state == 'generating_report':
-        for chat in st.session_state.chat_history:
-             with st.chat_message(name="user" if chat['speaker'] == 'Paciente' else 'assistant'):
-                st.write(chat['text'])
-        
-        with st.spinner("Agradeço por compartilhar suas respostas. Elas são muito importantes. Estou preparando um resumo para a Psicanalista Carla Ferreira. Por favor, aguarde..."):
-            relatorio_gerado = gerar_relatorio_gpt(st.session_state.dados_paciente)
-            email_to_send_body = compile_full_report_text(st.session_state.dados_paciente, relatorio_gerado)
-            email_subject = f"Relatório de Triagem REDE ELLe - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            email_successfully_sent = send_report_email(email_subject, email_to_send_body)
-            
-            save_report_internally(st.session_state.dados_paciente, relatorio_gerado, email_successfully_sent)
-            
-            patient_summary_final = get_final_patient_summary(st.session_state.dados_paciente)
-            st.session_state.chat_history.append({"speaker": "IA", "text": patient_summary_final})
-
-            if email_successfully_sent: st.success("Relatório gerado e enviado para a análise da Psicanalista!")
-            else: st.warning("Relatório gerado, mas houve um problema ao enviar o e-mail.")
+        _exibir_mensagens(historico_da_sessao(st.session_state.triagem_respostas, st.session_state.triagem_reflexoes))
+
+        # A mensagem final aparece assim que a última resposta chega; geração, e-mail e upload seguem pelo outbox
+        dados_paciente = dados_paciente_da_sessao(st.session_state.triagem_respostas, st.session_state.triagem_alerta)
+        try:
+            enfileirar_relatorio_triagem(dados_paciente, st.session_state.get("trace_id"), st.session_state.triagem_sessao_id)
+        except BancoIndisponivel as e:
+            # As respostas continuam na sessão; o enfileiramento é idempotente, então tentar de novo não duplica o relatório
+            print(f"ERRO ao enfileirar o relatório da triagem: {e}")
+            st.error("Não conseguimos registrar sua triagem agora. Suas respostas continuam guardadas nesta página.")
+            if st.button("Tentar novamente"):
+                st.rerun()
+            st.stop()
+        st.session_state.triagem_mensagem_final = get_final_patient_summary(dados_paciente)
+        remover_checkpoint_sessao(st.session_state.triagem_sessao_id)
+        st.query_params.pop("sessao", None)
 
         st.session_state.triagem_flow_state = 'finished'
         st.rerun()
 
     elif st.session_state.triagem_flow_state == 'finished':
-        for chat in st.session_state.chat_history:
-            with st.chat_message(name="user" if chat['speaker'] == 'Paciente' else 'assistant'):
-                st.write(chat['text'])
+        _exibir_mensagens(historico_da_sessao(
+            st.session_state.triagem_respostas, st.session_state.triagem_reflexoes, st.session_state.triagem_mensagem_final
+        ))
         st.markdown("---")
         st.info("Sessão de triagem encerrada. Obrigado(a) por sua participação. Para iniciar uma nova sessão, atualize a página.")
 
 def run_relatorios():
+    import pandas as pd  # dependência usada só no painel administrativo
     st.header("Relatórios de Triagem da REDE ELLe (Acesso Restrito)")
     st.write("Aqui você pode visualizar e gerenciar todos os relatórios de triagem salvos.")
-    reports_list = get_reports_from_db()
-    if not reports_list:
-        st.info("Nenhum relatório de triagem encontrado até o momento.")
-        return
 
-    # O restante do código da página de relatórios (DataFrame, filtros, gráficos) permanece aqui
-    display_data = []
-    for report_id, timestamp, patient_name, risk_alert, email_sent in reports_list:
-        display_data.append({
-            "ID": report_id, "Data/Hora": datetime.datetime.strptime(timestamp, "%Y%m%d_%H%M%S").strftime("%d/%m/%Y %H:%M:%S"),
-            "Paciente (Nome-Arquivo)": patient_name, "Alerta de Risco": risk_alert, "Email Enviado": "Sim" if email_sent == 1 else "Não"
-        })
-    df = pd.DataFrame(display_data)
-    
+    st.subheader("Fila de Processamento (Outbox)")
+    metricas_outbox = outbox_metricas.snapshot()
+    col_fila, col_concluidos, col_falhas, col_latencia = st.columns(4)
+    col_fila.metric("Jobs na fila", sum(outbox_profundidade().values()))
+    col_concluidos.metric("Concluídos", metricas_outbox["concluidos"])
+    col_falhas.metric("Retentativas / Falhas", f"{metricas_outbox['retentativas']} / {metricas_outbox['falhas_definitivas']}")
+    col_latencia.metric("Drenagem p95 (s)", f"{metricas_outbox['drenagem_p95_s']:.1f}")
+    erros_outbox = outbox_erros_recentes()
+    if erros_outbox:
+        with st.expander(f"Jobs com erro ({len(erros_outbox)} mais recentes)"):
+            st.dataframe(pd.DataFrame(erros_outbox, columns=["Job", "Tipo", "Status", "Tentativas", "Erro"]), hide_index=True)
+    metricas_smtp = get_smtp_pool().snapshot()
+    col_envios, col_conexoes, col_falhas_smtp, col_latencia_smtp = st.columns(4)
+    col_envios.metric("E-mails enviados", metricas_smtp["envios"])
+    col_conexoes.metric("Conexões SMTP abertas", metricas_smtp["conexoes"])
+    col_falhas_smtp.metric("Retentativas / Falhas SMTP", f"{metricas_smtp['retentativas']} / {metricas_smtp['falhas']}")
+    col_latencia_smtp.metric("Envio p95 (ms)", f"{metricas_smtp['latencia_p95_ms']:.0f}")
+    metricas_openai = get_openai_gateway().snapshot()
+    col_fila_openai, col_espera_interativa, col_espera_relatorio, col_429 = st.columns(4)
+    col_fila_openai.metric("Chamadas OpenAI em voo", metricas_openai["em_voo"])
+    col_espera_interativa.metric("Fila reflexão p95 (ms)", f"{metricas_openai.get('espera_fila_0_p95_ms', 0.0):.0f}")
+    col_espera_relatorio.metric("Fila relatório p95 (ms)", f"{metricas_openai.get('espera_fila_1_p95_ms', 0.0):.0f}")
+    col_429.metric("429 / Retentativas / Falhas", f"{metricas_openai['respostas_429']} / {metricas_openai['retentativas']} / {metricas_openai['falhas']}")
+
+    st.subheader("Motor de Reflexão (por camada)")
+    metricas_reflexao = reflexao_metricas.snapshot()
+    if metricas_reflexao:
+        st.dataframe(pd.DataFrame.from_dict(metricas_reflexao, orient="index"))
+    else:
+        st.caption("Nenhuma resposta processada neste processo ainda.")
+
+    st.subheader("Tempo e Tokens por Etapa")
+    metricas_etapas = get_metricas_por_etapa()
+    if metricas_etapas:
+        df_etapas = pd.DataFrame(metricas_etapas, columns=["Etapa", "Chamadas", "Média (ms)", "Máximo (ms)", "Tokens de prompt", "Tokens de resposta"])
+        st.dataframe(df_etapas.set_index("Etapa"))
+        df_relatorios = pd.DataFrame(
+            get_metricas_por_relatorio(), columns=["Relatório", "Tempo total (s)", "Tokens de prompt", "Tokens de resposta"]
+        ).set_index("Relatório")
+        st.bar_chart(df_relatorios[["Tokens de prompt", "Tokens de resposta"]])
+    else:
+        st.caption("Nenhuma etapa registrada ainda.")
+    with st.expander("Métricas deste processo (formato Prometheus)"):
+        texto_prometheus = rastreador.prometheus()
+        st.code(texto_prometheus, language="text")
+        st.download_button("Baixar métricas", texto_prometheus, file_name="metricas_redeelle.prom", mime="text/plain")
+
     st.subheader("Ferramentas de Busca e Filtro")
-    # ... (código dos filtros)
+    texto_busca = st.text_input("Buscar nos relatórios, respostas da triagem e feedbacks", key="texto_busca")
+    if texto_busca.strip():
+        resultados_busca = buscar_relatorios(texto_busca)
+        if not resultados_busca:
+            st.caption("Nenhum resultado para a busca.")
+        for resultado in resultados_busca:
+            st.markdown(f"**#{resultado['report_id']}** · {resultado['patient_name_for_file']} · {resultado['origem']} — {resultado['trecho']}")
+    opcoes_sim_nao = {"Todos": None, "Sim": True, "Não": False}
+    col_risco, col_email, col_tamanho = st.columns(3)
+    filtro_risco = opcoes_sim_nao[col_risco.selectbox("Alerta de Risco", list(opcoes_sim_nao), key="filtro_risco")]
+    filtro_email = opcoes_sim_nao[col_email.selectbox("Email Enviado", list(opcoes_sim_nao), key="filtro_email")]
+    tamanho_pagina = col_tamanho.selectbox("Relatórios por página", [25, 50, 100], index=1, key="tamanho_pagina")
+    col_inicio, col_fim = st.columns(2)
+    filtro_inicio = col_inicio.date_input("De", value=None, format="DD/MM/YYYY", key="filtro_data_inicio")
+    filtro_fim = col_fim.date_input("Até", value=None, format="DD/MM/YYYY", key="filtro_data_fim")
+    filtros = {
+        "risk_alert": None if filtro_risco is None else ("Sim" if filtro_risco else "Não"),
+        "email_sent": filtro_email,
+        "data_inicio": filtro_inicio,
+        "data_fim": filtro_fim,
+    }
+    # A pilha de cursores permite voltar páginas; é reiniciada quando qualquer filtro (ou o tamanho da página) muda
+    assinatura_filtros = (*filtros.values(), tamanho_pagina)
+    if st.session_state.get("relatorios_filtros") != assinatura_filtros:
+        st.session_state.relatorios_filtros = assinatura_filtros
+        st.session_state.relatorios_cursores = [None]
+    cursores = st.session_state.relatorios_cursores
+
+    reports_list, proximo_cursor = get_reports_page(limit=tamanho_pagina, after=cursores[-1], **filtros)
+    if not reports_list and len(cursores) == 1:
+        st.info("Nenhum relatório de triagem encontrado até o momento.")
+        return
 
     st.subheader("Relatórios Filtrados")
-    # ... (código do dataframe)
+    feedback_por_relatorio = get_feedback_for_reports([linha[0] for linha in reports_list])
+    df = pd.DataFrame([{
+        "ID": report_id, "Data/Hora": datetime.datetime.strptime(timestamp, "%Y%m%d_%H%M%S").strftime("%d/%m/%Y %H:%M:%S"),
+        "Paciente (Nome-Arquivo)": patient_name, "Alerta de Risco": risk_alert, "Email Enviado": "Sim" if email_sent == 1 else "Não",
+        "Feedbacks": len(feedback_por_relatorio[report_id])
+    } for report_id, timestamp, patient_name, risk_alert, email_sent in reports_list])
+    st.dataframe(df, hide_index=True)
+    col_anterior, col_pagina, col_proxima = st.columns([1, 2, 1])
+    if col_anterior.button("Página anterior", key="pagina_anterior", disabled=len(cursores) == 1):
+        cursores.pop()
+        st.rerun()
+    col_pagina.caption(f"Página {len(cursores)}")
+    if col_proxima.button("Próxima página", key="pagina_proxima", disabled=proximo_cursor is None):
+        cursores.append(proximo_cursor)
+        st.rerun()
 
     st.subheader("Visualizações Gráficas")
-    # ... (código dos gráficos)
+    granularidade, series = series_painel()
+    if series:
+        st.caption(f"Histórico completo, agregado por {granularidade} ({len(series)} pontos).")
+        for grafico in graficos_painel(series):
+            st.altair_chart(grafico, use_container_width=True)
+    if st.button("Recalcular agregados dos gráficos", key="reconstruir_agregados_button"):
+        with st.spinner("Recalculando agregados..."):
+            reconstruir_agregados()
+        st.rerun()
+
+    st.subheader("Reavaliação de Risco no Histórico")
+    st.caption(f"Léxico de risco em uso: versão {get_lexico_risco().versao}")
+    if st.button("Reavaliar todos os relatórios com o léxico atual", key="reavaliar_risco_button"):
+        with st.spinner("Reavaliando relatórios..."):
+            total_sinalizados = reavaliar_risco_relatorios()
+        st.success(f"Reavaliação concluída: {total_sinalizados} relatório(s) com falas de risco.")
 
     st.subheader("Visualizar Detalhes do Relatório Individual")
     # ... (código para visualizar um relatório)
+    report_id_arquivo = st.number_input("ID do relatório para baixar em .txt", min_value=1, step=1, key="report_id_arquivo")
+    versoes = versoes_relatorio(int(report_id_arquivo))
+    versao_arquivo = st.selectbox("Versão", ["Original"] + versoes, key="versao_arquivo") if versoes else "Original"
+    arquivo_relatorio = texto_relatorio_para_arquivo(int(report_id_arquivo), None if versao_arquivo == "Original" else versao_arquivo)
+    if arquivo_relatorio:
+        st.download_button("Baixar relatório (.txt)", arquivo_relatorio[1], file_name=arquivo_relatorio[0], mime="text/plain")
+    else:
+        st.caption("Relatório não encontrado.")
     
     st.subheader("Fornecer Feedback para um Relatório")
     # ... (código para fornecer feedback)
@@ -0,0 +1,144 @@
+# Benchmark: armazenamento antigo (patient_data JSON + generated_report em texto + .txt por relatório) vs. compacto
+# Mede o tamanho do banco e dos .txt, o tempo da migração e o volume enviado ao bucket (base comprimida e delta por
+# relatório novo, via DeltaSyncEngine).
+# Uso: python benchmarks/bench_armazenamento_relatorios.py [n_relatorios] [n_relatorios_novos]
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+
+from common import RAIZ_REPO, carregar_app, dados_paciente_sinteticos
+
+sys.path.insert(0, RAIZ_REPO)
+from sync_gcs import DeltaSyncEngine, LocalBucket  # noqa: E402
+
+VOCABULARIO = (
+    "paciente relata sofrimento angústia relação mãe pai infância lembranças sonhos trabalho sentimento culpa desejo "
+    "medo perda luto ansiedade sono apetite humor afeto pensamento discurso coerente orientado consciência vínculo "
+    "transferência defesa repetição sintoma queixa demanda escuta acolhimento possível hipótese sugere indica observa "
+    "de da do que em com para uma um os as não se na no mais como ao sua seu pela pelo entre sobre quando ainda"
+).split()
+
+
+def relatorio_sintetico(rnd, n_palavras=1500):
+    """Texto com a estrutura do relatório real e vocabulário clínico, para uma razão de compressão realista."""
+    secoes = ["Identificação:", "Queixa principal:", "Consciência:", "Humor e afeto:", "Pensamento:", "Hipótese Diagnóstica final:",
+              "## Perspectivas Teóricas Preliminares:", "- **Sigmund Freud:**", "- **Jacques Lacan:**", "## Sugestões de Intervenção e Atendimento:"]
+    partes = []
+    for secao in secoes:
+        palavras = [rnd.choice(VOCABULARIO) for _ in range(n_palavras // len(secoes))]
+        partes.append(f"{secao}\n" + " ".join(palavras).capitalize() + ".")
+    return "\n\n".join(partes)
+
+
+def criar_banco_legado(db_path, dir_txt, app, n):
+    """Schema, busca e gravação exatamente como antes: JSON com as perguntas por extenso, texto puro e um .txt por relatório."""
+    rnd = random.Random(7)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""CREATE TABLE reports (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, patient_name_for_file TEXT,
+        patient_data TEXT NOT NULL, generated_report TEXT NOT NULL, risk_alert TEXT, email_sent INTEGER)""")
+    conn.execute("CREATE INDEX idx_reports_timestamp ON reports (timestamp DESC, id DESC)")
+    conn.execute("CREATE INDEX idx_reports_risk ON reports (risk_alert, timestamp DESC, id DESC)")
+    conn.execute("CREATE INDEX idx_reports_email ON reports (email_sent, timestamp DESC, id DESC)")
+    conn.execute("""CREATE VIRTUAL TABLE busca_fts USING fts5(origem UNINDEXED, report_id UNINDEXED, relatorio, respostas, feedback,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '3 4 5')""")
+    respostas_sql = "(SELECT group_concat(value, char(10)) FROM json_each(NEW.patient_data) WHERE key LIKE 'Pergunta%')"
+    conn.execute(f"""CREATE TRIGGER reports_busca_ai AFTER INSERT ON reports BEGIN
+        INSERT INTO busca_fts (origem, report_id, relatorio, respostas) VALUES ('relatorio', NEW.id, NEW.generated_report, {respostas_sql});
+    END""")
+    os.makedirs(dir_txt, exist_ok=True)
+    for i in range(n):
+        inserir_legado(conn, dir_txt, app, dados_paciente_sinteticos(app, i), relatorio_sintetico(rnd), f"20250101_{i:06d}")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def inserir_legado(conn, dir_txt, app, dados, relatorio, timestamp):
+    texto = app.compile_full_report_text(dados, relatorio, timestamp)
+    with open(os.path.join(dir_txt, f"relatorio_PacienteAnonimo_{timestamp}.txt"), "w", encoding="utf-8") as f:
+        f.write(texto)
+    conn.execute(
+        "INSERT INTO reports (timestamp, patient_name_for_file, patient_data, generated_report, risk_alert, email_sent) VALUES (?, ?, ?, ?, ?, ?)",
+        (timestamp, "PacienteAnonimo", json.dumps(dados, ensure_ascii=False), relatorio, "Não", 1)
+    )
+
+
+def tamanho_dir(caminho):
+    return sum(os.path.getsize(os.path.join(caminho, nome)) for nome in os.listdir(caminho)) if os.path.isdir(caminho) else 0
+
+
+def tamanho_tabela_reports(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'reports'").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None  # SQLite sem a tabela virtual dbstat
+    finally:
+        conn.close()
+
+
+def upload_por_relatorio(db_path, inserir, n_novos):
+    """Bytes da base inicial (o que uma compactação envia) e média de bytes de delta por relatório gravado."""
+    engine = DeltaSyncEngine(LocalBucket(tempfile.mkdtemp(prefix="redeelle_bucket_")), db_path)
+    base = engine.sync()["bytes"]
+    for i in range(n_novos):
+        inserir(i)
+        engine.sync()
+    return base, (engine.metricas["bytes_enviados"] - base) / n_novos
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_novos = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    app = carregar_app()
+    rnd = random.Random(11)
+    workdir = os.getcwd()  # diretório temporário criado por carregar_app
+
+    legado_path = os.path.join(workdir, "legado.db")
+    dir_txt = os.path.join(workdir, "relatorios_legado")
+    criar_banco_legado(legado_path, dir_txt, app, n)
+    antes = {"banco": os.path.getsize(legado_path), "reports": tamanho_tabela_reports(legado_path), "txt": tamanho_dir(dir_txt)}
+    shutil.copy(legado_path, app.DB_NAME)
+
+    t0 = time.perf_counter()
+    app.get_db()  # aquecimento: schema + migração + VACUUM
+    duracao_migracao = time.perf_counter() - t0
+    depois = {"banco": os.path.getsize(app.DB_NAME), "reports": tamanho_tabela_reports(app.DB_NAME), "txt": tamanho_dir("relatorios_triagem")}
+    # A migração preserva o conteúdo: o relatório reconstruído é o mesmo do banco antigo
+    conn = sqlite3.connect(legado_path)
+    for report_id in (1, n // 2, n):
+        patient_data, generated_report = conn.execute("SELECT patient_data, generated_report FROM reports WHERE id = ?", (report_id,)).fetchone()
+        assert app.get_single_report_from_db(report_id) == (json.loads(patient_data), generated_report), f"relatório {report_id} divergente"
+
+    conn_legado = sqlite3.connect(legado_path)
+
+    def inserir_antigo(i):
+        inserir_legado(conn_legado, dir_txt, app, dados_paciente_sinteticos(app, n + i), relatorio_sintetico(rnd), f"20250102_{i:06d}")
+        conn_legado.commit()
+
+    base_antes, delta_antes = upload_por_relatorio(legado_path, inserir_antigo, n_novos)
+    base_depois, delta_depois = upload_por_relatorio(
+        app.DB_NAME, lambda i: app.save_report_internally(dados_paciente_sinteticos(app, n + i), relatorio_sintetico(rnd), True), n_novos
+    )
+
+    kb = lambda b: f"{b / 1024:,.0f} KB" if b is not None else "n/d"
+    print(f"{n} relatórios; migração em {duracao_migracao:.2f} s; compressão: {'zstd' if app.descomprimir.__globals__['zstandard'] else 'zlib'}")
+    print(f"{'':<34} | {'antes':>12} | {'depois':>12}")
+    print(f"{'arquivo do banco':<34} | {kb(antes['banco']):>12} | {kb(depois['banco']):>12}")
+    print(f"{'tabela reports':<34} | {kb(antes['reports']):>12} | {kb(depois['reports']):>12}")
+    print(f"{'arquivos .txt':<34} | {kb(antes['txt']):>12} | {kb(depois['txt']):>12}")
+    print(f"{'upload da base (zlib)':<34} | {kb(base_antes):>12} | {kb(base_depois):>12}")
+    print(f"{'upload de delta por relatório novo':<34} | {kb(delta_antes):>12} | {kb(delta_depois):>12}")
+    # Referência: o corpo do relatório comprimido isoladamente
+    amostra = relatorio_sintetico(random.Random(3)).encode("utf-8")
+    print(f"relatório de amostra: {len(amostra):,} B em texto, {len(zlib.compress(amostra, 9)):,} B com zlib")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# Teste de carga ponta a ponta do fluxo run_triagem: consentimento -> 16 perguntas -> generating_report -> finished
+# Cada sessão simulada é um AppTest do Streamlit; todas compartilham o mesmo processo, como num dyno.
+# OpenAI, SMTP e bucket são substituídos por stand-ins locais com latência configurável.
+# Requer: pip install aiosmtpd
+# Uso: python benchmarks/bench_carga_triagem.py --sessoes 100 --concorrencia 20 \
+#          [--max-p95 resposta=2.5] [--min-sessoes-por-minuto 30] [--json resultado.json] [--app outra/app_streamlit.py]
+# Sai com código 1 se algum limite for violado, para uso como gate de regressão.
+import argparse
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import RAIZ_REPO, BucketComLatencia, percentil
+from fake_openai import iniciar_fake_openai
+from fake_smtp import iniciar_fake_smtp
+
+sys.path.insert(0, RAIZ_REPO)
+import sync_gcs  # noqa: E402
+from compressao import descomprimir_respostas, registrar_funcoes_sql  # noqa: E402
+
+APP_PATH = os.path.join(RAIZ_REPO, "app_streamlit.py")
+ESTAGIOS = ["primeira_renderizacao", "consentimento", "resposta", "encerramento", "relatorio_entregue"]
+PALAVRAS = "eu sinto que a minha mãe sempre esteve distante e isso ainda me deixa ansiosa no trabalho e em casa".split()
+
+
+def resposta_sintetica(indice, pergunta):
+    """Mistura respostas curtas, médias e longas para exercitar todas as camadas da reflexão."""
+    if pergunta == 0:
+        return f"Paciente{indice}, 34, 11999990000, São Paulo"
+    n_palavras = (6, 30, 80, 150)[(indice + pergunta) % 4]
+    return " ".join(PALAVRAS[j % len(PALAVRAS)] for j in range(n_palavras))
+
+
+class Coletor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.amostras = {estagio: [] for estagio in ESTAGIOS}
+        self.fim_sessao = {}
+        self.estado_sessao_bytes = []
+        self.erros = []
+
+    def registrar(self, estagio, duracao):
+        with self._lock:
+            self.amostras[estagio].append(duracao)
+
+
+def preparar_apptest_concorrente():
+    """Permite vários AppTest em paralelo no mesmo processo.
+
+    O AppTest troca Runtime._instance a cada run; com sessões em paralelo, todas passam a usar um runtime falso fixo.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test
+
+    # Compilar o script em várias threads ao mesmo tempo quebra o parser do CPython 3.11; compila uma vez só
+    get_bytecode = ScriptCache.get_bytecode
+    lock_compilacao = threading.Lock()
+    bytecode = {}
+
+    def get_bytecode_compartilhado(self, script_path):
+        with lock_compilacao:
+            if script_path not in bytecode:
+                bytecode[script_path] = get_bytecode(self, script_path)
+            return bytecode[script_path]
+    ScriptCache.get_bytecode = get_bytecode_compartilhado
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = type("RuntimeDoAppTest", (Runtime,), {})
+    config.set_option("global.appTest", True)
+
+
+def tamanho_estado_sessao(at):
+    """Bytes serializados do session_state da sessão (exclui as chaves internas do AppTest)."""
+    estado = {k: v for k, v in at.session_state.filtered_state.items() if not k.startswith("$$")}
+    return len(pickle.dumps(estado))
+
+
+def executar_sessao(app_path, indice, coletor, timeout):
+    from streamlit.testing.v1 import AppTest
+    try:
+        at = AppTest.from_file(app_path, default_timeout=timeout)
+        t0 = time.perf_counter()
+        at.run()
+        coletor.registrar("primeira_renderizacao", time.perf_counter() - t0)
+
+        consentimento = next(b for b in at.button if b.label.startswith("Eu concordo"))
+        t0 = time.perf_counter()
+        consentimento.click().run()
+        coletor.registrar("consentimento", time.perf_counter() - t0)
+
+        pergunta = 0
+        while at.session_state["triagem_flow_state"] == "asking":
+            t0 = time.perf_counter()
+            at.chat_input[0].set_value(resposta_sintetica(indice, pergunta)).run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            # A última resposta também gera a mensagem final e enfileira o relatório
+            estagio = "resposta" if at.session_state["triagem_flow_state"] == "asking" else "encerramento"
+            coletor.registrar(estagio, time.perf_counter() - t0)
+            pergunta += 1
+        if at.session_state["triagem_flow_state"] != "finished":
+            raise RuntimeError(f"sessão terminou no estado {at.session_state['triagem_flow_state']}")
+        with coletor._lock:
+            coletor.fim_sessao[f"Paciente{indice},"] = time.perf_counter()
+            coletor.estado_sessao_bytes.append(tamanho_estado_sessao(at))
+    except Exception as e:
+        with coletor._lock:
+            coletor.erros.append(f"sessão {indice}: {e}")
+
+
+def acompanhar_entregas(db_path, coletor, n_sessoes, timeout):
+    """Mede, por sessão, o tempo entre o fim da conversa e o relatório marcado como enviado por e-mail."""
+    entregues = set()
+    limite = time.perf_counter() + timeout
+    while len(entregues) < n_sessoes and time.perf_counter() < limite:
+        if os.path.exists(db_path):
+            conn = registrar_funcoes_sql(sqlite3.connect(db_path))
+            try:
+                linhas = conn.execute("SELECT id, respostas FROM reports WHERE email_sent = 1").fetchall()
+            except sqlite3.OperationalError:
+                linhas = []  # schema ainda não criado pelo aquecimento
+            conn.close()
+            agora = time.perf_counter()
+            for report_id, respostas_blob in linhas:
+                if report_id in entregues:
+                    continue
+                respostas, _ = descomprimir_respostas(respostas_blob)
+                primeira_resposta = respostas[0] if respostas else ""
+                chave = primeira_resposta.split(" ")[0]
+                with coletor._lock:
+                    fim = coletor.fim_sessao.get(chave)
+                if fim is not None:
+                    entregues.add(report_id)
+                    coletor.registrar("relatorio_entregue", agora - fim)
+        time.sleep(0.05)
+    return len(entregues)
+
+
+def avaliar_limites(resumo, args):
+    violacoes = []
+    for regra, percentil_nome in [(r, "p95") for r in args.max_p95] + [(r, "p99") for r in args.max_p99]:
+        estagio, limite = regra.split("=")
+        valor = resumo["estagios"][estagio][percentil_nome]
+        if valor > float(limite):
+            violacoes.append(f"{estagio} {percentil_nome} = {valor:.3f}s > {float(limite):.3f}s")
+    if resumo["sessoes_por_minuto"] < args.min_sessoes_por_minuto:
+        violacoes.append(f"sessões/min = {resumo['sessoes_por_minuto']:.1f} < {args.min_sessoes_por_minuto:.1f}")
+    if resumo["erros"]:
+        violacoes.append(f"{len(resumo['erros'])} sessões com erro")
+    # Relatório que não chegou por e-mail dentro do prazo é falha do fluxo, não só latência alta
+    if resumo["relatorios_entregues"] < resumo["sessoes"]:
+        violacoes.append(f"{resumo['sessoes'] - resumo['relatorios_entregues']} relatório(s) não entregues "
+                         f"({resumo['relatorios_entregues']}/{resumo['sessoes']})")
+    return violacoes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessoes", type=int, default=50)
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument("--openai-latencia-inicial", type=float, default=0.3)
+    parser.add_argument("--openai-latencia-token", type=float, default=0.003)
+    parser.add_argument("--openai-tokens", type=int, default=2200)
+    parser.add_argument("--smtp-latencia-handshake", type=float, default=0.15)
+    parser.add_argument("--smtp-latencia-envio", type=float, default=0.05)
+    parser.add_argument("--bucket-latencia", type=float, default=0.08)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--max-p95", action="append", default=[], metavar="ESTAGIO=SEGUNDOS")
+    parser.add_argument("--max-p99", action="append", default=[], metavar="ESTAGIO=SEGUNDOS")
+    parser.add_argument("--min-sessoes-por-minuto", type=float, default=0.0)
+    parser.add_argument("--json", help="grava o resumo neste arquivo")
+    parser.add_argument("--app", default=APP_PATH, help="script a testar (ex.: uma revisão anterior extraída com git archive)")
+    args = parser.parse_args()
+    args.app = os.path.abspath(args.app)
+
+    servidor_openai, base_url = iniciar_fake_openai(args.openai_tokens, args.openai_latencia_inicial, args.openai_latencia_token)
+    controller_smtp, handler_smtp, porta_smtp = iniciar_fake_smtp(args.smtp_latencia_handshake, args.smtp_latencia_envio)
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark", "OPENAI_BASE_URL": base_url,
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(porta_smtp), "SMTP_SSL": "0",
+        "EMAIL_ADDRESS": "triagem@example.org", "EMAIL_PASSWORD": "benchmark", "RECEIVER_EMAIL": "clinica@example.org",
+    })
+    os.chdir(tempfile.mkdtemp(prefix="redeelle_carga_"))
+    # O app instancia o bucket por nome a cada execução do script; aqui ele vira um diretório local com latência
+    raiz_bucket = os.path.abspath("bucket")
+    sync_gcs.GCSBucket = lambda name: BucketComLatencia(sync_gcs.LocalBucket(raiz_bucket), args.bucket_latencia)
+
+    preparar_apptest_concorrente()
+    coletor = Coletor()
+    db_path = os.path.abspath("redeelle_relatorios.db")
+    monitor = ThreadPoolExecutor(max_workers=1).submit(
+        acompanhar_entregas, db_path, coletor, args.sessoes, args.timeout * 4
+    )
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as pool:
+        for indice in range(args.sessoes):
+            pool.submit(executar_sessao, args.app, indice, coletor, args.timeout)
+    duracao_sessoes = time.perf_counter() - inicio
+    entregues = monitor.result()
+    duracao_total = time.perf_counter() - inicio
+
+    concluidas = len(coletor.fim_sessao)
+    resumo = {
+        "sessoes": args.sessoes, "concorrencia": args.concorrencia, "concluidas": concluidas, "relatorios_entregues": entregues,
+        "sessoes_por_minuto": concluidas / duracao_sessoes * 60, "duracao_sessoes_s": duracao_sessoes,
+        "duracao_total_s": duracao_total, "emails_recebidos": handler_smtp.recebidos, "erros": coletor.erros,
+        "estado_sessao_bytes_p50": percentil(coletor.estado_sessao_bytes, 50),
+        "estado_sessao_bytes_max": max(coletor.estado_sessao_bytes, default=0),
+        "estagios": {
+            estagio: {
+                "n": len(amostras), "p50": percentil(amostras, 50), "p95": percentil(amostras, 95), "p99": percentil(amostras, 99)
+            } for estagio, amostras in coletor.amostras.items()
+        },
+    }
+    print(f"{args.sessoes} sessões, concorrência {args.concorrencia}: {concluidas} concluídas, {entregues} relatórios entregues, "
+          f"{resumo['sessoes_por_minuto']:.1f} sessões/min")
+    print(f"session_state ao fim da sessão: p50 {resumo['estado_sessao_bytes_p50'] / 1024:.1f} KB, "
+          f"máx. {resumo['estado_sessao_bytes_max'] / 1024:.1f} KB")
+    print(f"{'estágio':<22} | {'n':>5} | {'p50 (s)':>8} | {'p95 (s)':>8} | {'p99 (s)':>8}")
+    for estagio, valores in resumo["estagios"].items():
+        print(f"{estagio:<22} | {valores['n']:>5} | {valores['p50']:>8.3f} | {valores['p95']:>8.3f} | {valores['p99']:>8.3f}")
+    for erro in coletor.erros[:10]:
+        print(f"ERRO {erro}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resumo, f, indent=2, ensure_ascii=False)
+
+    controller_smtp.stop()
+    servidor_openai.shutdown()
+    violacoes = avaliar_limites(resumo, args)
+    for violacao in violacoes:
+        print(f"LIMITE VIOLADO: {violacao}")
+    sys.exit(1 if violacoes else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Benchmark: tempo de import do app e tempo até a primeira renderização da página de triagem
+# Compara a árvore atual com uma revisão anterior (padrão: HEAD~1), cada medição num interpretador novo.
+# Uso: python benchmarks/bench_cold_start.py [--antes REV] [--repeticoes N]
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEDICAO = r"""
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+t0 = time.perf_counter()
+import app_streamlit
+t_import = time.perf_counter() - t0
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(os.path.join(os.getcwd(), "app_streamlit.py"), default_timeout=120)
+t0 = time.perf_counter()
+at.run()
+t_render = time.perf_counter() - t0
+print(json.dumps({"import_s": t_import, "primeira_renderizacao_s": t_render, "consentimento": "Termo de Consentimento" in "".join(m.value for m in at.markdown)}))
+"""
+
+
+def extrair_revisao(rev):
+    destino = tempfile.mkdtemp(prefix="redeelle_coldstart_")
+    arquivo = subprocess.run(["git", "-C", RAIZ_REPO, "archive", rev], check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(arquivo)) as tar:
+        tar.extractall(destino)
+    return destino
+
+
+def medir(diretorio):
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark"))
+    saida = subprocess.run([sys.executable, "-c", MEDICAO], cwd=diretorio, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--antes", default="HEAD~1")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+    alvos = [("antes", extrair_revisao(args.antes)), ("depois", extrair_revisao("HEAD"))]
+    print(f"{'versão':<7} | {'import (s)':>10} | {'1ª renderização (s)':>19}")
+    for nome, diretorio in alvos:
+        medicoes = [medir(diretorio) for _ in range(args.repeticoes)]
+        t_import = min(m["import_s"] for m in medicoes)
+        t_render = min(m["primeira_renderizacao_s"] for m in medicoes)
+        print(f"{nome:<7} | {t_import:>10.3f} | {t_render:>19.3f}")
+
+
+if __name__ == "__main__":
+    main()
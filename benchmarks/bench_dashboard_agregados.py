@@ -0,0 +1,114 @@
+# Benchmark: gráficos do painel a partir do DataFrame completo de reports vs. das tabelas de agregados
+# O banco cresce como na produção (cerca de 90 relatórios por dia, em ordem cronológica) e, a cada tamanho, mede o
+# tempo de montar os gráficos até o spec do altair (to_dict), que é o que o st.altair_chart serializa a cada rerun,
+# e só o da leitura das séries (series_painel).
+# Confere também que os agregados mantidos pelos triggers (inclusive nos UPDATE de email_sent do outbox) batem com
+# um recálculo do zero, e quanto os triggers acrescentam a save_report_internally.
+# Uso: python benchmarks/bench_dashboard_agregados.py [tamanhos ...]
+import datetime
+import random
+import sys
+import time
+
+from common import carregar_app, conectar, dados_paciente_sinteticos, percentil
+
+RELATORIOS_POR_DIA = 90
+INICIO = datetime.datetime(2023, 1, 1, 8)
+
+
+def crescer_banco(app, de, ate):
+    """Acrescenta relatórios de..ate-1 (e um feedback a cada cinco) direto no SQLite; os triggers mantêm os agregados."""
+    rnd = random.Random(de)
+    versao = app.get_db().escrever(lambda conn: app._versao_perguntas(conn, list(app.TRIAGEM_PERGUNTAS)))
+    respostas = app.comprimir_respostas(["Paciente, 30, 11999990000, São Paulo"])
+    relatorio = app.comprimir("Relatório sintético.")
+    conn = conectar(app.DB_NAME)
+    for inicio_lote in range(de, ate, 5000):
+        lote, feedbacks = [], []
+        for i in range(inicio_lote, min(ate, inicio_lote + 5000)):
+            instante = INICIO + datetime.timedelta(seconds=i * 86400 // RELATORIOS_POR_DIA)
+            timestamp = instante.strftime("%Y%m%d_%H%M%S")
+            lote.append((timestamp, f"Paciente_{i}", "Sim" if rnd.random() < 0.12 else "Não", int(rnd.random() < 0.9), versao, respostas, relatorio))
+            if i % 5 == 0:
+                feedbacks.append((i + 1, timestamp))
+        conn.executemany("""INSERT INTO reports (timestamp, patient_name_for_file, risk_alert, email_sent, perguntas_versao, respostas, relatorio)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""", lote)
+        conn.executemany("INSERT INTO feedback (report_id, feedback_text, timestamp) VALUES (?, 'Feedback sintético.', ?)", feedbacks)
+        conn.commit()
+    # Reenvios do outbox marcam parte dos relatórios como enviados depois da gravação
+    conn.execute("UPDATE reports SET email_sent = 1 WHERE id BETWEEN ? AND ? AND email_sent = 0 AND id % 2 = 0", (de + 1, ate))
+    conn.commit()
+    conn.close()
+
+
+def graficos_dataframe_completo(app):
+    """Como seria sem os agregados: todo o histórico num DataFrame, agrupado por dia a cada rerun."""
+    import pandas as pd
+    df = pd.DataFrame(app.get_db().ler("SELECT timestamp, risk_alert, email_sent FROM reports"), columns=["timestamp", "risk_alert", "email_sent"])
+    df["periodo"] = pd.to_datetime(df["timestamp"].str[:8], format="%Y%m%d").dt.strftime("%Y-%m-%d")
+    df["com_alerta"] = df["risk_alert"] == "Sim"
+    por_dia = df.groupby("periodo").agg(relatorios=("timestamp", "size"), com_alerta=("com_alerta", "sum"), emails_enviados=("email_sent", "sum"))
+    feedback = pd.DataFrame(app.get_db().ler("SELECT timestamp FROM feedback"), columns=["timestamp"])
+    feedback["periodo"] = pd.to_datetime(feedback["timestamp"].str[:8], format="%Y%m%d").dt.strftime("%Y-%m-%d")
+    por_dia["feedbacks"] = feedback.groupby("periodo").size()
+    series = por_dia.fillna(0).astype(int).reset_index().to_dict("records")
+    return [grafico.to_dict() for grafico in app.graficos_painel(series)]
+
+
+def graficos_agregados(app):
+    _, series = app.series_painel()
+    return [grafico.to_dict() for grafico in app.graficos_painel(series)]
+
+
+def medir(funcao, app, repeticoes=5):
+    funcao(app)  # aquece imports do pandas/altair
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(app)
+        tempos.append(time.perf_counter() - inicio)
+    return percentil(tempos, 50)
+
+
+def conferir_agregados(app):
+    """Os agregados incrementais são idênticos a um recálculo do zero."""
+    consulta = "SELECT * FROM agregados_relatorios_dia WHERE relatorios != 0 ORDER BY 1, 2, 3"
+    consulta_feedback = "SELECT * FROM agregados_feedback_dia WHERE feedbacks != 0 ORDER BY 1"
+    incrementais = (app.get_db().ler(consulta), app.get_db().ler(consulta_feedback))
+    app.reconstruir_agregados()
+    return incrementais == (app.get_db().ler(consulta), app.get_db().ler(consulta_feedback))
+
+
+def custo_gravacao(app, n=200):
+    tempos = []
+    for i in range(n):
+        inicio = time.perf_counter()
+        app.save_report_internally(dados_paciente_sinteticos(app, i), "Relatório sintético.", True)
+        tempos.append(time.perf_counter() - inicio)
+    return percentil(tempos, 50)
+
+
+def main():
+    tamanhos = [int(t) for t in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    app = carregar_app()
+    app.enfileirar_upload = lambda *args, **kwargs: None
+    print(f"{'relatórios':>10} | {'dias':>5} | {'pontos':>15} | {'DataFrame completo':>18} | {'agregados':>9} | {'só a consulta':>13} | {'agregados = recálculo':>21}")
+    atual = 0
+    for tamanho in sorted(tamanhos):
+        crescer_banco(app, atual, tamanho)
+        atual = tamanho
+        antes = medir(graficos_dataframe_completo, app)
+        depois = medir(graficos_agregados, app)
+        consulta = medir(lambda app: app.series_painel(), app)
+        granularidade, series = app.series_painel()
+        dias = app.get_db().ler_um("SELECT COUNT(DISTINCT dia) FROM agregados_relatorios_dia")[0]
+        print(f"{tamanho:>10,} | {dias:>5} | {len(series):>4} por {granularidade:<7} | {antes * 1000:>15.0f} ms | "
+              f"{depois * 1000:>6.0f} ms | {consulta * 1000:>10.1f} ms | {str(conferir_agregados(app)):>21}")
+    com_triggers = custo_gravacao(app)
+    app.get_db().escrever(lambda conn: [conn.execute(f"DROP TRIGGER {nome}") for nome in ("reports_agregados_ai", "feedback_agregados_ai")])
+    sem_triggers = custo_gravacao(app)
+    print(f"save_report_internally p50: {com_triggers * 1000:.2f} ms com os triggers de agregados, {sem_triggers * 1000:.2f} ms sem")
+
+
+if __name__ == "__main__":
+    main()
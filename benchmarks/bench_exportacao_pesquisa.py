@@ -0,0 +1,166 @@
+# Benchmark: exportação anonimizada para pesquisa (exportacao_pesquisa.py) num banco sintético de 100 mil relatórios
+# Mede linhas/s e pico de memória (RSS) por formato e número de processos, e confere que nome, telefone e cidade
+# da primeira resposta não aparecem no registro do próprio paciente. Cada exportação roda num subprocesso; o pico de
+# memória é o VmHWM dele (ru_maxrss herdaria o do benchmark através do fork) somado ao do maior processo do pool.
+# Uso: python benchmarks/bench_exportacao_pesquisa.py [n_relatorios] [processos ...]
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+from bench_armazenamento_relatorios import relatorio_sintetico
+from common import RAIZ_REPO, carregar_app, conectar
+
+NOMES = "Ana Beatriz Carla Débora Élida Fernanda Gabriela Helena Íris Joana Lúcia Marília Natália Otávia Patrícia Rosângela".split()
+SOBRENOMES = "Souza Araújo Conceição Gonçalves Magalhães Simões Tavares Rebouças Brandão Falcão Quintela Assunção".split()
+CIDADES = ["São Paulo", "Ribeirão Preto", "Belo Horizonte", "Florianópolis", "Maceió", "Petrópolis", "Juazeiro do Norte", "Niterói/RJ"]
+
+# Primeiras respostas fora do formato "nome, idade, telefone, cidade": (primeira resposta, texto posterior, termos que
+# não podem sobrar no texto anonimizado)
+CASOS_IDENTIFICACAO = [
+    ("Ana 40 Curitiba 41988887777", "Ana mora em Curitiba e em curitiba ninguém chama ANA assim.", ["ana", "curitiba"]),
+    ("Meu nome é Ana Souza, tenho 40 anos, moro em Recife e meu whats é (41) 98888-7777",
+     "Recife é onde cresci; a Souza da família sou eu.", ["recife", "souza", "ana"]),
+    ("Sou a Joana, 52 anos, de Juazeiro do Norte, joana@example.org", "Saí de Juazeiro do Norte cedo, Joana.", ["juazeiro", "joana"]),
+    ("Lúcia Brandão 29 São Paulo", "Em São Paulo a Lúcia se sente só.", ["sao paulo", "lucia", "brandao"]),
+    ("me chamo Helena, 33, moro em Petrópolis", "Petrópolis é fria, Helena sabe.", ["petropolis", "helena"]),
+]
+
+EXPORTAR = """
+import json, resource, sys
+sys.path.insert(0, sys.argv[1])
+from exportacao_pesquisa import exportar
+resultado = exportar(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+with open("/proc/self/status") as f:
+    rss = int(next(linha for linha in f if linha.startswith("VmHWM:")).split()[1])
+if int(sys.argv[5]) > 1:
+    rss += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+print(json.dumps(dict(resultado, rss_kb=rss)))
+"""
+
+
+def paciente_sintetico(rnd):
+    nome = f"{rnd.choice(NOMES)} {rnd.choice(SOBRENOMES)}"
+    telefone = f"({rnd.randint(11, 99)}) 9{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}"
+    return nome, rnd.randint(18, 79), telefone, rnd.choice(CIDADES)
+
+
+def primeira_resposta(i, nome, idade, telefone, cidade):
+    """Alterna o formato pedido na pergunta, o mesmo sem vírgulas e em linguagem natural."""
+    if i % 3 == 1:
+        return f"{nome} {idade} {cidade} {''.join(c for c in telefone if c.isdigit())}"
+    if i % 3 == 2:
+        return f"Meu nome é {nome}, tenho {idade} anos, moro em {cidade} e meu whats é {telefone}"
+    return f"{nome}, {idade}, {telefone}, {cidade}"
+
+
+def conferir_casos_identificacao():
+    from exportacao_pesquisa import anonimizar_texto, identificacao
+    from lexico_risco import normalizar_texto
+    falhas = []
+    for resposta, texto, termos in CASOS_IDENTIFICACAO:
+        anonimizado = normalizar_texto(anonimizar_texto(texto, identificacao(resposta)[0]))[0]
+        vazados = [termo for termo in termos if re.search(rf"\b{termo}\b", anonimizado)]
+        if vazados:
+            falhas.append(f"{vazados} em {anonimizado!r} (primeira resposta {resposta!r})")
+    print(f"casos de identificação: {len(CASOS_IDENTIFICACAO) - len(falhas)}/{len(CASOS_IDENTIFICACAO)} sem vazamento")
+    for falha in falhas:
+        print(f"  VAZOU {falha}")
+    assert not falhas
+
+
+def criar_banco(app, n, n_corpos=50):
+    """Schema do app; relatórios gravados em massa (sem passar pelo índice de busca, que a exportação não usa)."""
+    rnd = random.Random(5)
+    versao = app.get_db().escrever(lambda conn: app._versao_perguntas(conn, list(app.TRIAGEM_PERGUNTAS)))
+    corpos = [relatorio_sintetico(rnd, 400) for _ in range(n_corpos)]
+    conn = conectar(app.DB_NAME)
+    amostras = {}
+    lote = []
+    for i in range(n):
+        nome, idade, telefone, cidade = paciente_sintetico(rnd)
+        respostas = [primeira_resposta(i, nome, idade, telefone, cidade)] + [
+            f"Resposta {i}-{j}: moro em {cidade.lower()} e minha mãe me chama de {nome.split()[0].upper()}, "
+            f"meu contato é {telefone} e o e-mail paciente{i}@example.org. {cidade.split('/')[0]} é onde cresci."
+            for j in range(1, len(app.TRIAGEM_PERGUNTAS))
+        ]
+        relatorio = f"Identificação: {nome}, {idade} anos, residente em {cidade}. CPF 123.456.789-0{i % 10}.\n\n" + corpos[i % n_corpos]
+        lote.append((f"2025{1 + i % 12:02d}{1 + i % 28:02d}_{i:06d}", nome.replace(" ", "_"), "Sim" if i % 7 == 0 else "Não", 1,
+                     versao, app.comprimir_respostas(respostas), app.comprimir(relatorio)))
+        if i % 97 == 0:
+            amostras[i + 1] = (nome, telefone, cidade)
+        if len(lote) == 5000 or i == n - 1:
+            conn.executemany("""INSERT INTO reports (timestamp, patient_name_for_file, risk_alert, email_sent, perguntas_versao, respostas, relatorio)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", lote)
+            conn.commit()
+            lote.clear()
+    # Um feedback a cada cinco relatórios, citando a paciente pelo primeiro nome
+    conn.execute("""INSERT INTO feedback (report_id, timestamp, feedback_text)
+        SELECT id, timestamp, 'Relatório de ' || substr(patient_name_for_file, 1, instr(patient_name_for_file, '_') - 1)
+            || ' ajudou no acolhimento; retornar no telefone informado.' FROM reports WHERE id % 5 = 0""")
+    conn.commit()
+    conn.close()
+    return amostras
+
+
+def registros_exportados(saida, formato, tipo):
+    if formato == "jsonl":
+        with open(os.path.join(saida, f"{tipo}.jsonl"), encoding="utf-8") as f:
+            for linha in f:
+                yield json.loads(linha)
+    else:
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(os.path.join(saida, f"{tipo}.parquet")).iter_batches():
+            yield from lote.to_pylist()
+
+
+def vazamentos(saida, formato, amostras):
+    """Nome, sobrenome, telefone ou cidade das amostras que aparecem no registro exportado do próprio paciente.
+
+    A exportação preserva a ordem: o i-ésimo relatório é o id i, e o k-ésimo feedback é o do relatório 5k.
+    """
+    total = 0
+    for posicao, registro in enumerate(registros_exportados(saida, formato, "relatorios"), start=1):
+        if posicao in amostras:
+            nome, telefone, cidade = amostras[posicao]
+            texto = json.dumps(registro, ensure_ascii=False).casefold()
+            total += sum(re.search(rf"(?<!\w){re.escape(termo.casefold())}(?!\w)", texto) is not None
+                         for termo in (*nome.split(), telefone, cidade.split("/")[0]))
+    for posicao, registro in enumerate(registros_exportados(saida, formato, "feedbacks"), start=1):
+        if posicao * 5 in amostras:
+            total += amostras[posicao * 5][0].split()[0].casefold() in registro["feedback"].casefold()
+    return total
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lista_processos = [int(p) for p in sys.argv[2:]] or sorted({1, 2, os.cpu_count() or 1})
+    app = carregar_app()
+    conferir_casos_identificacao()
+    t0 = time.perf_counter()
+    amostras = criar_banco(app, n)
+    feedbacks = app.get_db().ler_um("SELECT COUNT(*) FROM feedback")[0]
+    print(f"banco sintético: {n:,} relatórios e {feedbacks:,} feedbacks, {os.path.getsize(app.DB_NAME) / 2**20:,.0f} MB "
+          f"(gerado em {time.perf_counter() - t0:.0f} s); CPUs: {os.cpu_count()}")
+    print(f"{'formato':<8} | {'processos':>9} | {'segundos':>8} | {'linhas/s':>9} | {'pico RSS':>9} | {'saída':>8} | {'vazamentos':>10}")
+    for formato in ("jsonl", "parquet"):
+        for processos in lista_processos:
+            saida = os.path.abspath(f"exportacao_{formato}_{processos}")
+            execucao = subprocess.run(
+                [sys.executable, "-c", EXPORTAR, RAIZ_REPO, os.path.abspath(app.DB_NAME), saida, formato, str(processos)],
+                check=True, capture_output=True, text=True,
+            )
+            resultado = json.loads(execucao.stdout.strip().splitlines()[-1])
+            linhas = resultado["relatorios"] + resultado["feedbacks"]
+            tamanho = sum(os.path.getsize(os.path.join(saida, nome)) for nome in os.listdir(saida))
+            print(f"{formato:<8} | {processos:>9} | {resultado['segundos']:>8.1f} | {linhas / resultado['segundos']:>9,.0f} | "
+                  f"{resultado['rss_kb'] / 1024:>6.0f} MB | {tamanho / 2**20:>5.0f} MB | {vazamentos(saida, formato, amostras):>10}")
+            # Ordem e contagem preservadas com qualquer número de processos
+            assert resultado["relatorios"] == n and resultado["feedbacks"] == feedbacks
+
+
+if __name__ == "__main__":
+    main()
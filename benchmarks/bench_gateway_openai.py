@@ -0,0 +1,103 @@
+# Benchmark: chamadas diretas ao cliente OpenAI síncrono vs. OpenAIGateway sob limite de taxa
+# O fake_openai impõe um limite de requisições por minuto (cabeçalhos x-ratelimit-* e 429 com retry-after-ms).
+# Carga: sessões ao vivo pedindo reflexões curtas e, no meio delas, uma rajada de relatórios em segundo plano.
+# Mede a latência das reflexões, quanto os relatórios levam, falhas, 429 recebidos e a espera na fila por prioridade.
+# Reflexões têm o prazo do app (REFLEXAO_PRAZO_S): estouradas ou com erro, a sessão usaria a frase de fallback.
+# Uso: python benchmarks/bench_gateway_openai.py [relatorios] [sessoes] [reflexoes_por_sessao] [limite_rpm] [prazo_reflexao_s]
+import os
+import random
+import sys
+import threading
+import time
+
+from common import RAIZ_REPO, percentil
+from fake_openai import iniciar_fake_openai
+
+sys.path.insert(0, RAIZ_REPO)
+from gateway_openai import PRIORIDADE_INTERATIVA, PRIORIDADE_RELATORIO, OpenAIGateway  # noqa: E402
+
+MENSAGENS_RELATORIO = [{"role": "system", "content": "Instruções do relatório. " * 200}, {"role": "user", "content": "Respostas. " * 300}]
+
+
+def mensagens_reflexao(i):
+    return [{"role": "user", "content": f"Gere uma frase de acolhimento reflexivo para a fala {i}."}]
+
+
+def chamada_direta(cliente):
+    def chamar(prioridade, prazo_s=None, **kwargs):
+        # O mais próximo do prazo sem o gateway: timeout de cada tentativa do SDK
+        return cliente.chat.completions.create(**kwargs, **({"timeout": prazo_s} if prazo_s else {}))
+    return chamar
+
+
+def executar_carga(chamar, n_relatorios, n_sessoes, reflexoes_por_sessao, prazo_reflexao_s):
+    """Sessões pedem reflexões com um intervalo de leitura entre elas; os relatórios chegam juntos 1 s depois."""
+    resultados = {"reflexoes": [], "relatorios": [], "falhas_reflexao": 0, "falhas_relatorio": 0}
+    lock = threading.Lock()
+
+    def relatorio():
+        time.sleep(1.0)
+        inicio = time.perf_counter()
+        try:
+            chamar(PRIORIDADE_RELATORIO, model="gpt-4o", messages=MENSAGENS_RELATORIO, max_tokens=2200)
+            with lock: resultados["relatorios"].append(time.perf_counter() - inicio)
+        except Exception:
+            with lock: resultados["falhas_relatorio"] += 1
+
+    def sessao(indice):
+        rnd = random.Random(indice)
+        time.sleep(rnd.uniform(0, 1.0))
+        for i in range(reflexoes_por_sessao):
+            inicio = time.perf_counter()
+            try:
+                chamar(PRIORIDADE_INTERATIVA, prazo_s=prazo_reflexao_s, model="gpt-4o-mini", messages=mensagens_reflexao(i), max_tokens=50)
+                with lock: resultados["reflexoes"].append(time.perf_counter() - inicio)
+            except Exception:
+                with lock: resultados["falhas_reflexao"] += 1
+            time.sleep(rnd.uniform(0.5, 1.5))  # paciente lendo e digitando a próxima resposta
+
+    threads = [threading.Thread(target=relatorio) for _ in range(n_relatorios)]
+    threads += [threading.Thread(target=sessao, args=(i,)) for i in range(n_sessoes)]
+    inicio = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    resultados["duracao_s"] = time.perf_counter() - inicio
+    return resultados
+
+
+def main():
+    n_relatorios = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    n_sessoes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    reflexoes_por_sessao = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    limite_rpm = int(sys.argv[4]) if len(sys.argv) > 4 else 600
+    prazo_reflexao_s = float(sys.argv[5]) if len(sys.argv) > 5 else 5.0
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from openai import OpenAI
+    print(f"{n_relatorios} relatórios em rajada + {n_sessoes} sessões x {reflexoes_por_sessao} reflexões; limite {limite_rpm} RPM; prazo da reflexão {prazo_reflexao_s} s")
+    print(f"{'modo':<8} | {'reflexão p50':>12} | {'p95':>7} | {'máx':>7} | {'relatório p50':>13} | {'máx':>6} | "
+          f"{'falhas (refl/rel)':>17} | {'429':>4} | {'conexões':>8} | {'duração':>7}")
+    for modo in ("direto", "gateway"):
+        servidor, base_url = iniciar_fake_openai(tokens=2200, latencia_inicial=0.05, latencia_por_token=0.0003, limite_rpm=limite_rpm)
+        gateway = None
+        if modo == "direto":
+            # Como antes: um cliente síncrono compartilhado, com as 2 retentativas padrão do SDK
+            chamar = chamada_direta(OpenAI(base_url=base_url))
+        else:
+            gateway = OpenAIGateway(base_url=base_url)
+            chamar = gateway.completar
+        r = executar_carga(chamar, n_relatorios, n_sessoes, reflexoes_por_sessao, prazo_reflexao_s)
+        print(f"{modo:<8} | {percentil(r['reflexoes'], 50) * 1000:>9.0f} ms | {percentil(r['reflexoes'], 95) * 1000:>4.0f} ms | "
+              f"{max(r['reflexoes'], default=0) * 1000:>4.0f} ms | {percentil(r['relatorios'], 50):>11.1f} s | "
+              f"{max(r['relatorios'], default=0):>4.1f} s | {r['falhas_reflexao']:>8} / {r['falhas_relatorio']:<6} | "
+              f"{servidor.respostas_429:>4} | {servidor.conexoes:>8} | {r['duracao_s']:>5.1f} s")
+        if gateway is not None:
+            metricas = gateway.snapshot()
+            print(f"         espera na fila p50/p95: interativa {metricas['espera_fila_0_p50_ms']:.0f}/{metricas['espera_fila_0_p95_ms']:.0f} ms, "
+                  f"relatório {metricas['espera_fila_1_p50_ms']:.0f}/{metricas['espera_fila_1_p95_ms']:.0f} ms; "
+                  f"retentativas {metricas['retentativas']}, expiradas na fila {metricas['expiradas']}, limite aprendido {metricas['limite_requisicoes']} RPM")
+            gateway.fechar()
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
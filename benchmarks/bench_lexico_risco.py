@@ -0,0 +1,89 @@
+# Microbenchmark do léxico de risco em modo lote: ocorrências/s, textos/s e MB/s
+# Antes de medir, confere as categorias de frases com termos sobrepostos (fala autodirigida não vira homicídio)
+# Uso: python benchmarks/bench_lexico_risco.py [n_textos]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lexico_risco import LexicoRisco, normalizar_texto  # noqa: E402
+
+FRASES_NEUTRAS = [
+    "Minha infância foi no interior, com muitos primos por perto.",
+    "A relação com minha mãe é de muito carinho, mas às vezes difícil.",
+    "Trabalho como vendedora há oito anos e a rotina é cansativa.",
+    "Tenho dificuldade para dormir e acordo várias vezes durante a noite.",
+    "Gosto de caminhar no parque e de ouvir música no fim de semana.",
+    # Passa pelo pré-filtro ("vida") sem ser fala de risco: mede o caminho completo em texto neutro
+    "Minha vida mudou bastante depois que troquei de cidade.",
+]
+FRASES_RISCO = [
+    "Às vezes penso em suicidio quando fico sozinha.",
+    "Já pensei em tirar minha vida no ano passado.",
+    "Tenho vontade de me matar quando tudo dá errado.",
+    "Não quero mais viver desse jeito.",
+]
+
+# (frase, categorias esperadas, ocorrências esperadas)
+CASOS_SOBREPOSICAO = [
+    ("Tenho vontade de me matar.", ["suicidio"], 1),
+    ("Ele disse que ia se matar.", ["suicidio"], 1),
+    ("Às vezes eu me mato de tanto pensar nisso.", ["suicidio"], 1),
+    ("Quando tudo dá errado me mato por dentro.", ["suicidio"], 1),
+    ("Quero matar alguém quando me provocam.", ["homicidio"], 1),
+    ("Tenho vontade de matar meu chefe.", ["homicidio"], 1),
+    ("Penso em suicídio e em me cortar.", ["autolesao", "suicidio"], 2),
+]
+
+
+def conferir_sobreposicao(lexico):
+    erros = []
+    for frase, categorias, n in CASOS_SOBREPOSICAO:
+        encontrados = lexico.buscar(frase)
+        if sorted({m.categoria for m in encontrados}) != categorias or len(encontrados) != n:
+            erros.append(f"{frase!r}: {[(m.trecho, m.categoria) for m in encontrados]}")
+    print(f"sobreposição: {len(CASOS_SOBREPOSICAO) - len(erros)}/{len(CASOS_SOBREPOSICAO)} frases com as categorias esperadas")
+    for erro in erros:
+        print(f"  ERRO {erro}")
+    assert not erros
+
+
+def gerar_textos(n, taxa_risco=0.05, seed=7):
+    rnd = random.Random(seed)
+    for i in range(n):
+        frases = rnd.sample(FRASES_NEUTRAS, 3)
+        if rnd.random() < taxa_risco:
+            frases.append(rnd.choice(FRASES_RISCO))
+        yield i, " ".join(frases)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lexico = LexicoRisco.carregar()
+    conferir_sobreposicao(lexico)
+    textos = list(gerar_textos(n))
+    total_chars = sum(len(t) for _, t in textos)
+
+    t0 = time.perf_counter()
+    ocorrencias = sum(len(encontrados) for _, encontrados in lexico.varrer(textos))
+    duracao = time.perf_counter() - t0
+
+    # Referência: mesma normalização, um teste de substring por termo
+    termos = [normalizar_texto(t.rstrip("*"))[0] for ts in lexico.categorias.values() for t in ts]
+    t0 = time.perf_counter()
+    sinalizados_ingenuo = 0
+    for _, texto in textos:
+        normalizado = normalizar_texto(texto)[0]
+        sinalizados_ingenuo += any(termo in normalizado for termo in termos)
+    duracao_ingenuo = time.perf_counter() - t0
+
+    print(f"{n:,} textos, {total_chars / 1e6:.1f} MB, versão do léxico {lexico.versao}")
+    print(f"Aho-Corasick: {ocorrencias:,} ocorrências em {duracao:.2f}s -> {ocorrencias / duracao:,.0f} ocorrências/s, "
+          f"{n / duracao:,.0f} textos/s, {total_chars / 1e6 / duracao:.2f} MB/s")
+    print(f"Substring por termo (referência): {sinalizados_ingenuo:,} textos sinalizados em {duracao_ingenuo:.2f}s -> "
+          f"{n / duracao_ingenuo:,.0f} textos/s")
+
+
+if __name__ == "__main__":
+    main()
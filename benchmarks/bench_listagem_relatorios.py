@@ -0,0 +1,69 @@
+# Benchmark: listagem do painel administrativo com 100k relatórios sintéticos
+# Antes: SELECT completo + uma consulta de feedback por relatório. Depois: página por keyset + feedback em lote.
+# Uso: python benchmarks/bench_listagem_relatorios.py [n_relatorios]
+import sys
+import time
+
+from common import carregar_app, dados_paciente_sinteticos
+
+TAMANHO_PAGINA = 50
+
+
+def semear(app, n, inicio=0):
+    """Relatórios gravados por save_report_internally (formato compacto + índice de busca) e um feedback a cada três."""
+    for i in range(inicio, inicio + n):
+        dados = dados_paciente_sinteticos(app, i)
+        if i % 40 == 0:
+            dados["ALERTA_RISCO_IMEDIATO"] = "Sim"
+        app.save_report_internally(dados, "Relatório sintético " * 50, i % 15 != 0)
+    app.get_db().escrever(lambda conn: conn.executemany(
+        "INSERT INTO feedback (report_id, feedback_text, timestamp) VALUES (?, ?, ?)",
+        ((i, f"Feedback {i}", "20250101_000000") for i in range(inicio + 1, inicio + n + 1) if i % 3 == 1)
+    ))
+
+
+def listagem_antiga(app):
+    with app.get_db().conexao() as conn:
+        linhas = conn.execute("SELECT id, timestamp, patient_name_for_file, risk_alert, email_sent FROM reports ORDER BY timestamp DESC").fetchall()
+        linhas_exibicao = []
+        for report_id, timestamp, nome, risco, email in linhas:
+            feedback = conn.execute("SELECT feedback_text, timestamp FROM feedback WHERE report_id = ? ORDER BY timestamp DESC", (report_id,)).fetchall()
+            linhas_exibicao.append((report_id, timestamp, nome, risco, email, len(feedback)))
+    return len(linhas_exibicao)
+
+
+def listagem_paginada(app, paginas=3, **filtros):
+    cursor = None
+    for _ in range(paginas):
+        linhas, cursor = app.get_reports_page(limit=TAMANHO_PAGINA, after=cursor, **filtros)
+        app.get_feedback_for_reports([linha[0] for linha in linhas])
+        if cursor is None:
+            break
+
+
+def cronometrar(fn, repeticoes=5):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        fn()
+    return (time.perf_counter() - inicio) / repeticoes * 1000
+
+
+def main():
+    n_total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    app = carregar_app()
+    app.init_db()
+    # O sync com o bucket não faz parte do que é medido aqui
+    app.enfileirar_upload = lambda *args, **kwargs: None
+    print(f"{'relatórios':>10} | {'antes (ms)':>10} | {'3 páginas (ms)':>14} | {'3 páginas, risco=Sim (ms)':>25}")
+    semeados = 0
+    for alvo in (1_000, 10_000, n_total):
+        semear(app, alvo - semeados, semeados)
+        semeados = alvo
+        antes = cronometrar(lambda: listagem_antiga(app), repeticoes=1)
+        depois = cronometrar(lambda: listagem_paginada(app))
+        depois_risco = cronometrar(lambda: listagem_paginada(app, risk_alert="Sim"))
+        print(f"{alvo:>10,} | {antes:>10.1f} | {depois:>14.2f} | {depois_risco:>25.2f}")
+
+
+if __name__ == "__main__":
+    main()
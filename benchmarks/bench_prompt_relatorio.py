@@ -0,0 +1,75 @@
+# Benchmark: prompt do relatório antigo (respostas no meio do texto, sem limite) vs. PromptRelatorioBuilder
+# Mede tokens do prompt, tokens servidos do cache de prefixo e latência até o relatório contra o fake_openai com
+# cache de prefixo simulado (regras da OpenAI: prefixo idêntico de 1024+ tokens, em blocos de 128).
+# Uso: python benchmarks/bench_prompt_relatorio.py [relatorios_por_cenario] [latencia_por_token_prompt_ms]
+import sys
+import time
+
+from common import carregar_app, dados_paciente_sinteticos, percentil
+from fake_openai import iniciar_fake_openai
+
+
+def montar_prompt_antigo(app, dados_paciente_temp):
+    """Cópia do layout anterior: respostas no meio do prompt do usuário, texto indentado, sem orçamento."""
+    historico_triagem = "Registro da Triagem:\n"
+    for pergunta, resposta in dados_paciente_temp.items():
+        if isinstance(pergunta, str) and isinstance(resposta, str):
+            historico_triagem += f"- {pergunta}: {resposta}\n"
+    instrucoes = app.RELATORIO_INSTRUCOES.split("## Estrutura do EXAME PSÍQUICO a ser preenchido:")
+    prompt_para_relatorio = "\n    ".join([
+        "", instrucoes[0].strip().replace("\n", "\n    "), "## Informações do Paciente e Respostas da Triagem:",
+        historico_triagem, "## Estrutura do EXAME PSÍQUICO a ser preenchido:" + instrucoes[1].replace("\n", "\n    "),
+        app.RELATORIO_PEDIDO_FINAL, "",
+    ])
+    return [
+        {"role": "system", "content": app.RELATORIO_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_para_relatorio}
+    ]
+
+
+def dados_com_respostas_longas(app, indice):
+    """Paciente que escreve muito: algumas respostas com milhares de palavras."""
+    dados = dados_paciente_sinteticos(app, indice)
+    for i, pergunta in enumerate(list(dados)[3:6]):
+        dados[pergunta] = f"Relato longo {indice}-{i}: " + "lembro de situações da infância e de como me sentia sozinha " * 400
+    return dados
+
+
+def medir(app, cenario, montar, n):
+    contador = app.get_prompt_relatorio().contador
+    tokens, em_cache, latencias = [], [], []
+    for i in range(n):
+        messages = montar(cenario(app, i))
+        tokens.append(sum(contador.contar(m["content"]) for m in messages))
+        t0 = time.perf_counter()
+        resposta = app.get_openai_gateway().completar(app.PRIORIDADE_RELATORIO, model="gpt-4o", messages=messages, max_tokens=200)
+        latencias.append(time.perf_counter() - t0)
+        em_cache.append(resposta.usage.prompt_tokens_details.cached_tokens)
+    return tokens, em_cache, latencias
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latencia_por_token_prompt_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.05) / 1000
+    servidor, base_url = iniciar_fake_openai(
+        tokens=200, latencia_inicial=0.1, latencia_por_token=0.0, latencia_por_token_prompt=latencia_por_token_prompt_s,
+        cache_prefixo=True,
+    )
+    app = carregar_app(base_url)
+    builder = app.get_prompt_relatorio()
+    print(f"prompt {builder.versao} ({builder.impressao_prefixo}): prefixo estático de {builder.tokens_prefixo} tokens "
+          f"({'tiktoken' if builder.contador.exato else 'estimativa por caracteres'}), "
+          f"orçamento de respostas {builder.orcamento_efetivo_tokens} de {builder.orcamento_respostas_tokens} tokens")
+    print(f"{'cenário':<17} | {'layout':<7} | {'tokens prompt':>13} | {'em cache (méd)':>14} | {'p50 (ms)':>8} | {'p95 (ms)':>8}")
+    layouts = (("antigo", lambda dados: montar_prompt_antigo(app, dados)), ("novo", app.montar_prompt_relatorio))
+    for nome_cenario, cenario in (("respostas típicas", dados_paciente_sinteticos), ("respostas longas", dados_com_respostas_longas)):
+        for nome_layout, montar in layouts:
+            servidor.prompts_vistos.clear()
+            tokens, em_cache, latencias = medir(app, cenario, montar, n)
+            print(f"{nome_cenario:<17} | {nome_layout:<7} | {sum(tokens) / n:>13.0f} | {sum(em_cache) / n:>14.0f} | "
+                  f"{percentil(latencias, 50) * 1000:>8.1f} | {percentil(latencias, 95) * 1000:>8.1f}")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Benchmark: regeneração em lote (regeneracao_relatorios.py) contra o endpoint falso da OpenAI
+# Mede relatórios/min por concorrência; concorrência 1 equivale a refazer um relatório por vez dentro do Streamlit.
+# Depois simula uma queda: a CLI roda num subprocesso, é morta com SIGKILL no meio e executada de novo. Confere que
+# todos os relatórios terminam com exatamente uma versão e quantas chamadas à IA foram refeitas pela retomada.
+# Uso: python benchmarks/bench_regeneracao_relatorios.py [n_relatorios] [concorrências ...]
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from common import RAIZ_REPO, carregar_app
+from fake_openai import iniciar_fake_openai
+
+
+def criar_relatorios(app, n):
+    """n relatórios gravados no formato compacto, com respostas para todas as perguntas da triagem."""
+    db = app._get_db_manager()
+    versao = db.escrever(lambda conn: app._versao_perguntas(conn, list(app.TRIAGEM_PERGUNTAS)))
+    linhas = []
+    for i in range(n):
+        respostas = [f"Paciente{i}, 34, 11999990000, São Paulo"] + [
+            f"Resposta sintética {i}-{j} " + "sobre a minha história e meus sentimentos " * 6 for j in range(1, len(app.TRIAGEM_PERGUNTAS))
+        ]
+        linhas.append((f"2025{1 + i % 12:02d}{1 + i % 28:02d}_120000", f"Paciente{i}", "Sim" if i % 7 == 0 else "Não", 1, versao,
+                       app.comprimir_respostas(respostas), app.comprimir("Relatório original.")))
+    db.escrever(lambda conn: conn.executemany("""INSERT INTO reports
+        (timestamp, patient_name_for_file, risk_alert, email_sent, perguntas_versao, respostas, relatorio) VALUES (?, ?, ?, ?, ?, ?, ?)""", linhas))
+
+
+def versoes(app):
+    return app._get_db_manager().ler_um("SELECT COUNT(*), COUNT(DISTINCT report_id) FROM relatorio_versoes WHERE prompt_versao = ?",
+                                        (app.versao_prompt_relatorio(),))
+
+
+def queda_e_retomada(app, servidor, base_url, n, concorrencia):
+    app._get_db_manager().executar("DELETE FROM relatorio_versoes")
+    comando = [sys.executable, os.path.join(RAIZ_REPO, "regeneracao_relatorios.py"), "--concorrencia", str(concorrencia)]
+    ambiente = dict(os.environ, OPENAI_BASE_URL=base_url, PYTHONPATH=RAIZ_REPO)
+    requisicoes_antes = servidor.requisicoes
+    processo = subprocess.Popen(comando, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while versoes(app)[0] < n * 0.4:
+        time.sleep(0.05)
+    processo.send_signal(signal.SIGKILL)
+    processo.wait()
+    antes_da_queda = versoes(app)[0]
+    inicio = time.perf_counter()
+    subprocess.run(comando, env=ambiente, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    total, distintos = versoes(app)
+    print(f"queda com {antes_da_queda}/{n} gravados; retomada concluiu o resto em {time.perf_counter() - inicio:.1f} s: "
+          f"{total} versões para {distintos} relatórios, {servidor.requisicoes - requisicoes_antes - n} chamada(s) refeita(s)")
+    assert total == distintos == n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    concorrencias = [int(c) for c in sys.argv[2:]] or [1, 4, 8, 16, 32]
+    # ~0,5 s por relatório (2200 tokens), o suficiente para a concorrência dominar o tempo total
+    servidor, base_url = iniciar_fake_openai(tokens=2200, latencia_inicial=0.05, latencia_por_token=0.0002)
+    app = carregar_app(base_url)
+    app.init_db()
+    criar_relatorios(app, n)
+    from regeneracao_relatorios import criar_gateway, regenerar
+    print(f"{n} relatórios; prompt {app.versao_prompt_relatorio()}")
+    print(f"{'concorrência':>12} | {'segundos':>8} | {'relatórios/min':>14} | {'ganho':>6} | {'falhas':>6}")
+    base = None
+    for concorrencia in concorrencias:
+        app._get_db_manager().executar("DELETE FROM relatorio_versoes")
+        gateway = criar_gateway(concorrencia)
+        r = regenerar(gateway, concorrencia)
+        gateway.fechar()
+        por_minuto = r["regenerados"] / r["segundos"] * 60
+        base = base or por_minuto
+        print(f"{concorrencia:>12} | {r['segundos']:>8.1f} | {por_minuto:>14.0f} | {por_minuto / base:>5.1f}x | {r['falhas']:>6}")
+        assert versoes(app) == (n, n)
+    queda_e_retomada(app, servidor, base_url, n, max(concorrencias))
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
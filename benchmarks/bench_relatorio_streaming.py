@@ -0,0 +1,57 @@
+# Benchmark: tempo até a mensagem final do paciente, modo bloqueante vs streaming
+# Uso: python benchmarks/bench_relatorio_streaming.py
+import time
+
+from common import carregar_app, conectar, dados_paciente_sinteticos
+from fake_openai import iniciar_fake_openai
+
+TAMANHOS_RELATORIO = [200, 800, 2200]
+
+
+def medir_bloqueante(app, dados):
+    """Fluxo antigo: a mensagem final só aparece depois da geração, do e-mail e do salvamento."""
+    t0 = time.perf_counter()
+    relatorio = app.gerar_relatorio_gpt(dados, stream=False)
+    texto = app.compile_full_report_text(dados, relatorio)
+    email_ok = app.send_report_email("Relatório de Triagem REDE ELLe", texto)
+    app.save_report_internally(dados, relatorio, email_ok)
+    app.get_final_patient_summary(dados)
+    t_final = time.perf_counter() - t0
+    return t_final, t_final
+
+
+def medir_streaming(app, dados):
+    """Fluxo novo: uma inserção no outbox e a mensagem final; o worker gera o relatório em streaming."""
+    t0 = time.perf_counter()
+    job_id = app.enfileirar_relatorio_triagem(dados)
+    app.get_final_patient_summary(dados)
+    t_final = time.perf_counter() - t0
+    while status_job(app, job_id) != "concluido":
+        time.sleep(0.01)
+    return t_final, time.perf_counter() - t0
+
+
+def status_job(app, job_id):
+    conn = conectar(app.DB_NAME)
+    status = conn.execute("SELECT status FROM outbox WHERE id = ?", (job_id,)).fetchone()[0]
+    conn.close()
+    return status
+
+
+def main():
+    servidor, base_url = iniciar_fake_openai()
+    app = carregar_app(base_url)
+    app.RELATORIO_STREAMING = True
+    app.iniciar_worker_outbox()
+    dados = dados_paciente_sinteticos(app)
+    print(f"{'tokens':>7} | {'modo':<11} | {'msg final (s)':>13} | {'relatório pronto (s)':>20}")
+    for n_tokens in TAMANHOS_RELATORIO:
+        servidor.config["tokens"] = n_tokens
+        for modo, medir in (("bloqueante", medir_bloqueante), ("streaming", medir_streaming)):
+            t_final, t_pronto = medir(app, dados)
+            print(f"{n_tokens:>7} | {modo:<11} | {t_final:>13.3f} | {t_pronto:>20.3f}")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Verificação: reruns rápidos do estado 'generating_report' (reconexão, refresh, duas abas) geram um único relatório
+# Compara o enfileiramento antigo (um job por execução) com o idempotente, contando completions no fake_openai,
+# linhas em reports e e-mails entregues ao fake_smtp. Sai com código 1 se o modo idempotente duplicar algo.
+# Uso: python benchmarks/bench_reruns_relatorio.py [reruns]
+import os
+import sys
+import threading
+import time
+
+from common import carregar_app, dados_paciente_sinteticos
+from fake_openai import iniciar_fake_openai
+from fake_smtp import iniciar_fake_smtp
+
+
+def aguardar_outbox(app, timeout_s=60):
+    limite = time.time() + timeout_s
+    while time.time() < limite:
+        pendentes = app.outbox_profundidade()
+        if not pendentes.get("relatorio") and not pendentes.get("email"):
+            return
+        time.sleep(0.05)
+    raise TimeoutError("O outbox não drenou a tempo.")
+
+
+def contar(app, servidor, handler_smtp):
+    relatorios = app.get_db().ler_um("SELECT COUNT(*) FROM reports")[0]
+    return servidor.requisicoes, relatorios, handler_smtp.recebidos
+
+
+def rerun_antigo(app, dados, sessao_id):
+    app.get_final_patient_summary(dados)
+    app.enfileirar_job("relatorio", {"dados_paciente": dados})
+
+
+def rerun_idempotente(app, dados, sessao_id):
+    app.get_final_patient_summary(dados)
+    app.enfileirar_relatorio_triagem(dados, None, sessao_id)
+
+
+def medir(app, servidor, handler_smtp, rerun, dados, sessao_id, reruns):
+    """Metade dos reruns chega ao mesmo tempo (enquanto o job está na fila), a outra metade depois da entrega."""
+    antes = contar(app, servidor, handler_smtp)
+    barreira = threading.Barrier(reruns // 2)
+    threads = [threading.Thread(target=lambda: (barreira.wait(), rerun(app, dados, sessao_id))) for _ in range(reruns // 2)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    aguardar_outbox(app)
+    for _ in range(reruns - reruns // 2):
+        rerun(app, dados, sessao_id)
+    aguardar_outbox(app)
+    depois = contar(app, servidor, handler_smtp)
+    return tuple(d - a for a, d in zip(antes, depois))
+
+
+def main():
+    reruns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    servidor, base_url = iniciar_fake_openai(tokens=200, latencia_inicial=0.05, latencia_por_token=0.0)
+    controller_smtp, handler_smtp, porta_smtp = iniciar_fake_smtp(latencia_handshake_s=0.01)
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(porta_smtp), "SMTP_SSL": "0", "EMAIL_DIGEST_INTERVALO_S": "0",
+        "EMAIL_ADDRESS": "triagem@example.org", "EMAIL_PASSWORD": "benchmark", "RECEIVER_EMAIL": "clinica@example.org",
+    })
+    app = carregar_app(base_url)
+    app.iniciar_worker_outbox()
+    print(f"{reruns} execuções do estado 'generating_report' para a mesma triagem")
+    print(f"{'modo':<12} | {'completions':>11} | {'relatórios':>10} | {'e-mails':>7}")
+    resultados = {}
+    for indice, (modo, rerun) in enumerate((("antigo", rerun_antigo), ("idempotente", rerun_idempotente))):
+        dados = dados_paciente_sinteticos(app, indice)
+        resultados[modo] = medir(app, servidor, handler_smtp, rerun, dados, f"sessao-{indice}", reruns)
+        print(f"{modo:<12} | {resultados[modo][0]:>11} | {resultados[modo][1]:>10} | {resultados[modo][2]:>7}")
+    servidor.shutdown()
+    controller_smtp.stop()
+    if resultados["idempotente"] != (1, 1, 1):
+        print("FALHA: a triagem repetida gerou trabalho duplicado.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
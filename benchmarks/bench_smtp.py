@@ -0,0 +1,74 @@
+# Benchmark: uma conexão SMTP por e-mail (comportamento antigo) vs. sessão persistente do SMTPConnectionManager
+# Servidor local aiosmtpd (fake_smtp.py) com latência de handshake simulada, falhas transitórias e timeout de ociosidade.
+# Uso: python benchmarks/bench_smtp.py [n_emails] [latencia_handshake_ms] [taxa_falha]
+import os
+import smtplib
+import sys
+import time
+from email.message import EmailMessage
+
+from common import percentil
+from fake_smtp import iniciar_fake_smtp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from smtp_pool import SMTPConnectionManager  # noqa: E402
+
+TIMEOUT_OCIOSO_S = 1.0
+
+
+def mensagem(i):
+    msg = EmailMessage()
+    msg["Subject"] = f"Relatório de Triagem {i}"
+    msg["From"] = "triagem@example.org"
+    msg["To"] = "clinica@example.org"
+    msg.set_content("Relatório sintético " * 400)
+    return msg
+
+
+def enviar_conexao_por_email(porta, msg):
+    with smtplib.SMTP("127.0.0.1", porta) as smtp:
+        smtp.send_message(msg)
+
+
+def medir(enviar, n):
+    latencias, falhas = [], 0
+    inicio = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        try:
+            enviar(mensagem(i))
+        except smtplib.SMTPException:
+            falhas += 1
+        latencias.append(time.perf_counter() - t0)
+    return latencias, falhas, time.perf_counter() - inicio
+
+
+def imprimir(nome, latencias, falhas, duracao):
+    print(f"{nome:<28} | {len(latencias) / duracao:>9.1f} | {percentil(latencias, 50) * 1000:>8.1f} | "
+          f"{percentil(latencias, 95) * 1000:>8.1f} | {falhas:>6}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latencia_handshake_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 150) / 1000
+    taxa_falha = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    controller, _, porta = iniciar_fake_smtp(latencia_handshake_s, taxa_falha=taxa_falha, timeout_ocioso_s=TIMEOUT_OCIOSO_S)
+    try:
+        print(f"{n} e-mails, handshake {latencia_handshake_s * 1000:.0f} ms, {taxa_falha:.0%} de falhas transitórias")
+        print(f"{'modo':<28} | {'e-mails/s':>9} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'falhas':>6}")
+        imprimir("conexão por e-mail (antes)", *medir(lambda msg: enviar_conexao_por_email(porta, msg), n))
+
+        pool = SMTPConnectionManager("127.0.0.1", porta, use_ssl=False, backoff_base_s=0.05)
+        imprimir("sessão persistente", *medir(pool.enviar, n))
+
+        # O servidor derruba a sessão ociosa; o próximo envio precisa reconectar sozinho
+        time.sleep(TIMEOUT_OCIOSO_S * 1.5)
+        imprimir("após timeout do servidor", *medir(pool.enviar, 5))
+        print(f"métricas do pool: {pool.snapshot()}")
+        pool.fechar()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Benchmark: salvamentos de triagem concorrentes + leituras do painel administrativo
+# Compara conexão nova por chamada (journal padrão) com o SQLiteConnectionManager (WAL + fila de escrita).
+# Uso: python benchmarks/bench_sqlite_concorrencia.py [escritores] [leitores] [segundos]
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_pool import SQLiteConnectionManager  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, patient_name_for_file TEXT,
+    patient_data TEXT NOT NULL, generated_report TEXT NOT NULL, risk_alert TEXT, email_sent INTEGER
+);
+"""
+INSERT_REPORT = """INSERT INTO reports (timestamp, patient_name_for_file, patient_data, generated_report, risk_alert, email_sent)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+SELECT_LISTA = "SELECT id, timestamp, patient_name_for_file, risk_alert, email_sent FROM reports ORDER BY timestamp DESC LIMIT 50"
+SELECT_DETALHE = "SELECT patient_data, generated_report FROM reports WHERE id = ?"
+
+
+def linha_relatorio(i):
+    patient_data = json.dumps({f"Pergunta {n}": "resposta " * 20 for n in range(16)}, ensure_ascii=False)
+    return (time.strftime("%Y%m%d_%H%M%S"), f"Paciente_{i}", patient_data, "Relatório " * 400, "Não", 1)
+
+
+class ModoAntigo:
+    """Réplica dos helpers originais: sqlite3.connect/close a cada chamada."""
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def salvar(self, i):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(INSERT_REPORT, linha_relatorio(i))
+        conn.commit()
+        conn.close()
+
+    def ler(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(SELECT_LISTA).fetchall()
+        conn.execute(SELECT_DETALHE, (1,)).fetchone()
+        conn.close()
+
+
+class ModoPool:
+    def __init__(self, db_path):
+        self.db = SQLiteConnectionManager(db_path)
+
+    def salvar(self, i):
+        self.db.executar(INSERT_REPORT, linha_relatorio(i))
+
+    def ler(self):
+        self.db.ler(SELECT_LISTA)
+        self.db.ler_um(SELECT_DETALHE, (1,))
+
+
+def rodar(modo_cls, n_escritores, n_leitores, duracao_s):
+    db_path = os.path.join(tempfile.mkdtemp(prefix="redeelle_pool_"), "bench.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.execute(INSERT_REPORT, linha_relatorio(0))
+    conn.commit()
+    conn.close()
+    modo = modo_cls(db_path)
+    contadores = {"escritas": 0, "leituras": 0, "erros": 0}
+    lock = threading.Lock()
+    fim = time.perf_counter() + duracao_s
+
+    def trabalhador(operacao, chave):
+        i = 0
+        while time.perf_counter() < fim:
+            try:
+                operacao(i) if chave == "escritas" else operacao()
+                with lock:
+                    contadores[chave] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    contadores["erros"] += 1
+            i += 1
+
+    threads = [threading.Thread(target=trabalhador, args=(modo.salvar, "escritas")) for _ in range(n_escritores)]
+    threads += [threading.Thread(target=trabalhador, args=(modo.ler, "leituras")) for _ in range(n_leitores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {k: v / duracao_s if k != "erros" else v for k, v in contadores.items()}
+
+
+def main():
+    n_escritores = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_leitores = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    duracao_s = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"{n_escritores} escritores, {n_leitores} leitores, {duracao_s:.0f}s por modo")
+    print(f"{'modo':<8} | {'salvamentos/s':>13} | {'leituras/s':>10} | {'erros (locked)':>14}")
+    for nome, modo_cls in (("antes", ModoAntigo), ("depois", ModoPool)):
+        r = rodar(modo_cls, n_escritores, n_leitores, duracao_s)
+        print(f"{nome:<8} | {r['escritas']:>13,.0f} | {r['leituras']:>10,.0f} | {r['erros']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Benchmark: bytes transferidos por escrita, upload do arquivo inteiro vs sync incremental por páginas
+# Uso: python benchmarks/bench_sync_gcs.py [n_relatorios_iniciais] [n_escritas]
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_gcs import DeltaSyncEngine, LocalBucket  # noqa: E402
+
+
+def criar_banco(db_path, n_relatorios):
+    conn = sqlite3.connect(db_path)
+    conn.execute("""CREATE TABLE reports (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, patient_name_for_file TEXT,
+        patient_data TEXT NOT NULL, generated_report TEXT NOT NULL, risk_alert TEXT, email_sent INTEGER)""")
+    conn.execute("""CREATE TABLE feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER NOT NULL, feedback_text TEXT NOT NULL,
+        timestamp TEXT NOT NULL)""")
+    conn.executemany(
+        "INSERT INTO reports (timestamp, patient_name_for_file, patient_data, generated_report, risk_alert, email_sent) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"20250101_{i:06d}", f"Paciente_{i}", "{}" + "resposta " * 300, f"Relatório {i} " + os.urandom(1500).hex(), "Não", 1)
+         for i in range(n_relatorios))
+    )
+    conn.commit()
+    conn.close()
+
+
+def escrever_feedback(db_path, i):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO feedback (report_id, feedback_text, timestamp) VALUES (?, ?, ?)", (i + 1, f"Feedback {i}", f"20250102_{i:06d}"))
+    conn.commit()
+    conn.close()
+
+
+def cenario(n_relatorios, n_escritas, escritas_por_janela):
+    workdir = tempfile.mkdtemp(prefix="redeelle_sync_")
+    db_path = os.path.join(workdir, "redeelle_relatorios.db")
+    criar_banco(db_path, n_relatorios)
+    engine = DeltaSyncEngine(LocalBucket(os.path.join(workdir, "bucket")), db_path)
+    engine.sync()  # base inicial, fora da medição
+    enviados_antes = engine.metricas["bytes_enviados"]
+    for i in range(n_escritas):
+        escrever_feedback(db_path, i)
+        engine.registrar_escrita()
+        if (i + 1) % escritas_por_janela == 0:
+            engine.sync()
+    engine.sync()
+    bytes_incremental = (engine.metricas["bytes_enviados"] - enviados_antes) / n_escritas
+    bytes_completo = os.path.getsize(db_path)
+    # Confere que o bucket reconstrói exatamente o banco local
+    restore_path = os.path.join(workdir, "restaurado.db")
+    DeltaSyncEngine(engine.bucket, restore_path, prefix=engine.prefix).restore()
+    conn = sqlite3.connect(restore_path)
+    n_feedback = conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+    conn.close()
+    assert n_feedback == n_escritas, "restore divergente"
+    return bytes_completo, bytes_incremental, engine.metricas["compactacoes"]
+
+
+def main():
+    n_relatorios = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_escritas = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{n_relatorios} relatórios, {n_escritas} escritas de feedback")
+    print(f"{'escritas/janela':>15} | {'upload completo (B/escrita)':>27} | {'incremental (B/escrita)':>23} | {'compactações':>12}")
+    for escritas_por_janela in (1, 10, 50):
+        completo, incremental, compactacoes = cenario(n_relatorios, n_escritas, escritas_por_janela)
+        print(f"{escritas_por_janela:>15} | {completo / escritas_por_janela:>27,.0f} | {incremental:>23,.0f} | {compactacoes:>12}")
+
+
+if __name__ == "__main__":
+    main()
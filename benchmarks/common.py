@@ -0,0 +1,68 @@
+# Utilitários compartilhados pelos benchmarks
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def carregar_app(base_url="http://127.0.0.1:9/v1"):
+    """Importa app_streamlit isolado num diretório temporário, apontando a OpenAI para o endpoint local."""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.chdir(tempfile.mkdtemp(prefix="redeelle_bench_"))
+    if RAIZ_REPO not in sys.path:
+        sys.path.insert(0, RAIZ_REPO)
+    app = importlib.import_module("app_streamlit")
+    # Benchmarks nunca tocam o bucket real
+    app.upload_database = lambda *args, **kwargs: None
+    app.download_database = lambda *args, **kwargs: False
+    return app
+
+
+def conectar(db_path):
+    """sqlite3.connect com as funções SQL que o schema do app exige (ver compressao.registrar_funcoes_sql)."""
+    if RAIZ_REPO not in sys.path:
+        sys.path.insert(0, RAIZ_REPO)
+    from compressao import registrar_funcoes_sql
+    return registrar_funcoes_sql(sqlite3.connect(db_path))
+
+
+class BucketComLatencia:
+    """Envolve um LocalBucket e adiciona a latência de rede de cada chamada ao GCS."""
+    def __init__(self, bucket, latencia_s=0.05):
+        self.bucket = bucket
+        self.latencia_s = latencia_s
+
+    def get(self, name):
+        time.sleep(self.latencia_s)
+        return self.bucket.get(name)
+
+    def put(self, name, data):
+        time.sleep(self.latencia_s)
+        self.bucket.put(name, data)
+
+    def delete(self, name):
+        time.sleep(self.latencia_s)
+        self.bucket.delete(name)
+
+
+def dados_paciente_sinteticos(app, indice=0):
+    dados = {}
+    for i, pergunta in enumerate(app.TRIAGEM_PERGUNTAS):
+        resposta = f"Resposta sintética {indice}-{i} " + "sobre a minha história e meus sentimentos " * 3
+        if i == 0:
+            resposta = f"Paciente{indice}, 34, 11999990000, São Paulo"
+        dados[f"Pergunta {i + 1}: {pergunta}"] = resposta
+    return dados
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[k]
@@ -0,0 +1,171 @@
+# Servidor local que imita o endpoint /v1/chat/completions da OpenAI para benchmarks
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Como no cache de prompt da OpenAI: só prefixos de 1024+ tokens, reaproveitados em blocos de 128
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCO_TOKENS = 128
+CHARS_POR_TOKEN = 4
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.conexoes += 1
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(tamanho) or b"{}")
+        config = self.server.config
+        with self.server.lock:
+            self.server.requisicoes += 1
+        self._cabecalhos_limite = self._consumir_limite()
+        if self._cabecalhos_limite is not None and "retry-after-ms" in self._cabecalhos_limite:
+            with self.server.lock:
+                self.server.respostas_429 += 1
+            self._responder_json({"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                            "code": "rate_limit_exceeded"}}, status=429)
+            return
+        n_tokens = min(payload.get("max_tokens") or config["tokens"], config["tokens"])
+        tokens = [f"tok{i} " for i in range(n_tokens)]
+        prompt_tokens, cached_tokens = self._processar_prompt(payload.get("messages") or [])
+        time.sleep(config["latencia_inicial"] + config["latencia_por_token_prompt"] * (prompt_tokens - cached_tokens))
+        uso = _uso(prompt_tokens, cached_tokens, n_tokens)
+        if payload.get("stream"):
+            incluir_uso = (payload.get("stream_options") or {}).get("include_usage", False)
+            self._responder_stream(tokens, config["latencia_por_token"], uso if incluir_uso else None)
+        else:
+            time.sleep(config["latencia_por_token"] * n_tokens)
+            self._responder_json(_completion("".join(tokens), uso))
+
+    def _consumir_limite(self):
+        """Com limite_rpm configurado, cobra uma requisição do balde do servidor; devolve os cabeçalhos x-ratelimit-*
+        (com retry-after-ms quando o balde está vazio e a requisição deve ser recusada com 429)."""
+        limite = self.server.config["limite_rpm"]
+        if not limite:
+            return None
+        por_segundo = limite / 60.0
+        with self.server.lock:
+            agora = time.monotonic()
+            self.server.balde = min(limite, self.server.balde + (agora - self.server.balde_atualizado) * por_segundo)
+            self.server.balde_atualizado = agora
+            falta = 1 - self.server.balde
+            if falta <= 0:
+                self.server.balde -= 1
+            restante = int(self.server.balde)
+        cabecalhos = {
+            "x-ratelimit-limit-requests": str(limite), "x-ratelimit-remaining-requests": str(restante),
+            "x-ratelimit-reset-requests": f"{(limite - restante) / por_segundo:.3f}s",
+        }
+        if falta > 0:
+            cabecalhos["retry-after-ms"] = str(math.ceil(falta / por_segundo * 1000))
+        return cabecalhos
+
+    def _processar_prompt(self, messages):
+        """Estima os tokens do prompt e, com cache_prefixo ativo, quantos vêm do maior prefixo já visto."""
+        texto = "".join(f"{m.get('role')}:{m.get('content')}" for m in messages)
+        prompt_tokens = math.ceil(len(texto) / CHARS_POR_TOKEN)
+        if not self.server.config["cache_prefixo"]:
+            return prompt_tokens, 0
+        with self.server.lock:
+            vistos = self.server.prompts_vistos
+            comum = max((len(os.path.commonprefix([texto, anterior])) for anterior in vistos), default=0)
+            vistos.append(texto)
+            del vistos[:-256]
+        comum_tokens = comum // CHARS_POR_TOKEN
+        if comum_tokens < CACHE_MIN_TOKENS:
+            return prompt_tokens, 0
+        return prompt_tokens, comum_tokens // CACHE_BLOCO_TOKENS * CACHE_BLOCO_TOKENS
+
+    def _enviar_cabecalhos_limite(self):
+        for nome, valor in (getattr(self, "_cabecalhos_limite", None) or {}).items():
+            self.send_header(nome, valor)
+
+    def _responder_json(self, corpo, status=200):
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self._enviar_cabecalhos_limite()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _responder_stream(self, tokens, latencia_por_token, uso=None):
+        self.send_response(200)
+        self._enviar_cabecalhos_limite()
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(latencia_por_token)
+            self.wfile.write(f"data: {json.dumps(_chunk(token))}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if uso is not None:
+            self.wfile.write(f"data: {json.dumps(_chunk_uso(uso))}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def _uso(prompt_tokens, cached_tokens, n_tokens):
+    return {
+        "prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _completion(conteudo, uso):
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": conteudo}, "finish_reason": "stop"}],
+        "usage": uso,
+    }
+
+
+def _chunk(conteudo):
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "gpt-4o",
+        "choices": [{"index": 0, "delta": {"content": conteudo}, "finish_reason": None}],
+    }
+
+
+def _chunk_uso(uso):
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "gpt-4o",
+        "choices": [], "usage": uso,
+    }
+
+
+def iniciar_fake_openai(tokens=2200, latencia_inicial=0.3, latencia_por_token=0.002, latencia_por_token_prompt=0.0,
+                       cache_prefixo=False, limite_rpm=None):
+    """Sobe o servidor falso numa porta livre e retorna (servidor, base_url).
+
+    `latencia_por_token_prompt` cobra o processamento de cada token do prompt que não veio do cache de prefixo.
+    `limite_rpm` impõe um limite de requisições por minuto como o da OpenAI: cabeçalhos x-ratelimit-* em toda
+    resposta e 429 com retry-after-ms quando estourado.
+    """
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    servidor.daemon_threads = True
+    servidor.config = {
+        "tokens": tokens, "latencia_inicial": latencia_inicial, "latencia_por_token": latencia_por_token,
+        "latencia_por_token_prompt": latencia_por_token_prompt, "cache_prefixo": cache_prefixo, "limite_rpm": limite_rpm,
+    }
+    servidor.lock = threading.Lock()
+    servidor.requisicoes = 0
+    servidor.respostas_429 = 0
+    servidor.conexoes = 0
+    servidor.balde = limite_rpm or 0
+    servidor.balde_atualizado = time.monotonic()
+    servidor.prompts_vistos = []
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/v1"
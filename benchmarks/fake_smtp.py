@@ -0,0 +1,49 @@
+# Servidor SMTP local (aiosmtpd) que imita o Gmail para benchmarks: aceita qualquer login, atrasa o handshake e falha sob demanda
+# Requer: pip install aiosmtpd
+import asyncio
+import random
+import socket
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+
+class FakeSMTPHandler:
+    """Atrasa o EHLO (custo de conexão/TLS/login) e a entrega, e recusa uma fração das mensagens com 451."""
+    def __init__(self, latencia_handshake_s=0.15, latencia_envio_s=0.0, taxa_falha=0.0, seed=11):
+        self.config = {"latencia_handshake_s": latencia_handshake_s, "latencia_envio_s": latencia_envio_s, "taxa_falha": taxa_falha}
+        self.rnd = random.Random(seed)
+        self.recebidos = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.config["latencia_handshake_s"])
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.config["latencia_envio_s"])
+        if self.rnd.random() < self.config["taxa_falha"]:
+            return "451 Falha transitoria simulada"
+        self.recebidos += 1
+        return "250 OK"
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_fake_smtp(latencia_handshake_s=0.15, latencia_envio_s=0.0, taxa_falha=0.0, timeout_ocioso_s=300):
+    """Sobe o servidor numa porta livre e retorna (controller, handler, porta); encerre com controller.stop()."""
+    handler = FakeSMTPHandler(latencia_handshake_s, latencia_envio_s, taxa_falha)
+    porta = _porta_livre()
+    controller = Controller(
+        handler, hostname="127.0.0.1", port=porta,
+        server_kwargs={
+            "timeout": timeout_ocioso_s, "auth_require_tls": False,
+            "authenticator": lambda server, session, envelope, mechanism, auth_data: AuthResult(success=True),
+        },
+    )
+    controller.start()
+    return controller, handler, porta
@@ -0,0 +1,68 @@
+# Compressão dos textos gravados no SQLite (corpo do relatório e respostas): zstd se disponível, zlib caso contrário
+# Opcional: pip install zstandard
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# O primeiro byte identifica o codec, então registros dos dois formatos convivem no mesmo banco
+CODEC_ZLIB = b"z"
+CODEC_ZSTD = b"Z"
+NIVEL_ZLIB = 9
+NIVEL_ZSTD = 12
+
+
+def comprimir(texto):
+    dados = texto.encode("utf-8")
+    if zstandard is not None:
+        # Compressores zstd não são thread-safe; um por chamada custa microssegundos
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(dados)
+    return CODEC_ZLIB + zlib.compress(dados, NIVEL_ZLIB)
+
+
+def descomprimir(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    codec, corpo = blob[:1], blob[1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(corpo).decode("utf-8")
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Registro comprimido com zstd, mas o pacote zstandard não está instalado.")
+        return zstandard.ZstdDecompressor().decompress(corpo).decode("utf-8")
+    raise ValueError(f"Codec de compressão desconhecido: {codec!r}")
+
+
+def comprimir_respostas(respostas, extras=None):
+    """Respostas da triagem na ordem das perguntas (e chaves extras, se houver) como um blob comprimido."""
+    return comprimir(json.dumps({"respostas": respostas, "extras": extras} if extras else respostas, ensure_ascii=False))
+
+
+def descomprimir_respostas(blob):
+    """Inverso de comprimir_respostas: retorna (respostas, extras)."""
+    conteudo = json.loads(descomprimir(blob) or "[]")
+    if isinstance(conteudo, list):
+        return conteudo, {}
+    return conteudo["respostas"], conteudo["extras"]
+
+
+def respostas_busca(blob):
+    """Função SQL: texto das respostas indexado pela busca, uma por linha."""
+    respostas, _ = descomprimir_respostas(blob)
+    return "\n".join(r for r in respostas if isinstance(r, str))
+
+
+# Funções SQL referenciadas pelo schema do app (view busca_relatorios_conteudo e trigger de DELETE em reports).
+# Conexões sem elas falham com "no such function" ao apagar relatórios ou ler o índice de busca.
+FUNCOES_SQL = {"descomprimir": (1, descomprimir), "respostas_busca": (1, respostas_busca)}
+
+
+def registrar_funcoes_sql(conn, funcoes=FUNCOES_SQL):
+    """Registra `funcoes` ({nome: (n_args, funcao)}) como funções SQL determinísticas na conexão e a devolve."""
+    for nome, (n_args, funcao) in funcoes.items():
+        conn.create_function(nome, n_args, funcao, deterministic=True)
+    return conn
@@ -0,0 +1,292 @@
+# Exportação anonimizada para pesquisa (item 7 do Termo de Consentimento): relatórios e feedbacks em JSONL ou Parquet
+# Lê o banco em lotes (memória constante) e anonimiza cada lote num pool de processos, preservando a ordem.
+# Uso: python exportacao_pesquisa.py --saida exportacao [--formato jsonl|parquet] [--db redeelle_relatorios.db] [--processos N]
+import argparse
+import collections
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from compressao import descomprimir, descomprimir_respostas, registrar_funcoes_sql
+from lexico_risco import normalizar_texto
+
+DB_PADRAO = "redeelle_relatorios.db"
+TAMANHO_LOTE = 500
+LOTES_EM_VOO_POR_PROCESSO = 2
+
+# Identificadores genéricos, procurados em todo texto livre. Os padrões de CPF e telefone só rodam dentro de trechos
+# numéricos candidatos (muito mais rápido que varrer o relatório inteiro com eles); CPF antes do telefone, já que
+# 11 dígitos casariam com os dois
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_TRECHO_NUMERICO = re.compile(r"[\d+(][\d\s().+-]{6,}\d")
+_CPF = re.compile(r"(?<!\d)\d{3}\.\d{3}\.\d{3}-\d{2}(?!\d)|(?<!\d)\d{11}(?!\d)")
+_TELEFONE = re.compile(r"(?<!\d)(?:\+?55[\s.-]?)?(?:\(?\d{2}\)?[\s.-]?)?9?\d{4}[\s.-]?\d{4}(?!\d)")
+_IDADE = re.compile(r"(?<!\d)(\d{1,3})(?:\s*anos)?(?!\d)", re.IGNORECASE)
+_PARTICULAS_NOME = {"de", "da", "do", "das", "dos", "e"}
+# Primeira resposta em linguagem natural ("meu nome é ..., moro em ..."), já normalizada: rótulos não são termos a
+# ocultar e viram separadores; os de lugar também marcam (com "@") que o trecho seguinte é a cidade
+_ROTULOS_IDENTIFICACAO = re.compile(
+    r"\b(?:meu nome (?:e|eh)|me chamo|chamo-me|nome|idade|tenho|anos?|whatsapp|whats|zap|wpp|telefone|tel|celular|"
+    r"contato|e-?mail|cpf|numero)\b:?"
+)
+_ROTULOS_LUGAR = re.compile(
+    r"\b(?:(?:moro|resido|vivo|morando|residente|sou natural|natural|nasci|sou)\s+(?:em|na|no|de|da|do)|cidade(?:\s+de)?)\b:?"
+)
+_PALAVRAS_VAZIAS = _PARTICULAS_NOME | {"a", "o", "em", "na", "no", "eu", "sou", "meu", "minha", "com", "aqui", "atualmente"}
+
+
+def _tabela_sem_acentos():
+    """Letras latinas para a forma sem acento e minúscula quando ela tem um só caractere (Á -> a, Ç -> c).
+
+    Como o tamanho do texto não muda, as posições encontradas no texto traduzido valem no original.
+    """
+    tabela = {}
+    for codigo in range(0x41, 0x250):
+        base = normalizar_texto(chr(codigo))[0]
+        if len(base) == 1 and base != chr(codigo):
+            tabela[codigo] = base
+    return tabela
+
+_TABELA_SEM_ACENTOS = _tabela_sem_acentos()
+
+SQL_RELATORIOS = """
+    SELECT id, timestamp, risk_alert, perguntas_versao, respostas, relatorio FROM reports WHERE id > ? ORDER BY id LIMIT ?
+"""
+SQL_FEEDBACKS = """
+    SELECT f.id, f.report_id, f.timestamp, f.feedback_text, r.respostas
+    FROM feedback f JOIN reports r ON r.id = f.report_id WHERE f.id > ? ORDER BY f.id LIMIT ?
+"""
+
+
+def _sem_palavras_vazias_nas_pontas(palavras):
+    inicio, fim = 0, len(palavras)
+    while inicio < fim and palavras[inicio] in _PALAVRAS_VAZIAS: inicio += 1
+    while fim > inicio and palavras[fim - 1] in _PALAVRAS_VAZIAS: fim -= 1
+    return palavras[inicio:fim]
+
+
+def identificacao(resposta):
+    """Separa a primeira resposta ("nome, idade, whatsapp e cidade") em (padrão dos termos a ocultar, idade).
+
+    Aceita a resposta com ou sem vírgulas e em linguagem natural: e-mail, CPF, telefone e idade são retirados e
+    servem de separador, de modo que "Ana 40 Curitiba 41988887777" ainda rende o nome e a cidade. O primeiro trecho
+    livre é o nome (cada palavra vira um termo); os demais, ou os que vêm depois de "moro em", "sou de", ..., são
+    cidades (inteiras e suas partes). O padrão é compilado uma vez por paciente e reaproveitado em todas as
+    respostas, no relatório e nos feedbacks dele.
+    """
+    texto = normalizar_texto(resposta or "")[0]
+    if "@" in texto:
+        texto = _EMAIL.sub(";", texto)
+    texto = _TRECHO_NUMERICO.sub(lambda c: ";" if _CPF.search(c.group()) or _TELEFONE.search(c.group()) else c.group(), texto)
+    idade = None
+    for correspondencia in _IDADE.finditer(texto):
+        if int(correspondencia.group(1)) < 120:
+            idade = int(correspondencia.group(1))
+            break
+    texto = _IDADE.sub(";", texto)
+    texto = _ROTULOS_IDENTIFICACAO.sub(";", _ROTULOS_LUGAR.sub(";@", texto))
+    nomes, cidades = set(), set()
+    for parte in re.split(r"[,;.!\n]|\s+-\s+", texto):
+        lugar = parte.strip().startswith("@")
+        palavras = _sem_palavras_vazias_nas_pontas(parte.replace("@", " ").split())
+        if not palavras:
+            continue
+        if not lugar and not nomes:
+            nomes.update(p for p in palavras if len(p) >= 3 and p not in _PALAVRAS_VAZIAS)
+            continue
+        cidade = " ".join(palavras)
+        cidades.add(cidade)
+        cidades.update(pedaco.strip() for pedaco in re.split(r"[/-]", cidade) if len(pedaco.strip()) >= 4)
+    grupos = [
+        f"(?P<{marcador}>" + "|".join(r"\s+".join(map(re.escape, t.split())) for t in sorted(termos, key=len, reverse=True)) + ")"
+        for marcador, termos in (("CIDADE", cidades), ("NOME", nomes)) if termos
+    ]
+    return (re.compile(r"\b(?:" + "|".join(grupos) + r")\b") if grupos else None), idade
+
+
+def _marcador(correspondencia):
+    return f"[{correspondencia.lastgroup}]"
+
+
+def _anonimizar_trecho_numerico(correspondencia):
+    return _TELEFONE.sub("[TELEFONE]", _CPF.sub("[CPF]", correspondencia.group()))
+
+
+def anonimizar_texto(texto, padrao_termos):
+    """Troca identificadores genéricos e os termos da identificação do paciente (sem diferenciar acentos) por marcadores."""
+    if not texto:
+        return texto
+    if "@" in texto:
+        texto = _EMAIL.sub("[EMAIL]", texto)
+    texto = _TRECHO_NUMERICO.sub(_anonimizar_trecho_numerico, texto)
+    if padrao_termos is None:
+        return texto
+    partes, fim_anterior = [], 0
+    for correspondencia in padrao_termos.finditer(texto.translate(_TABELA_SEM_ACENTOS)):
+        partes.append(texto[fim_anterior:correspondencia.start()])
+        partes.append(_marcador(correspondencia))
+        fim_anterior = correspondencia.end()
+    partes.append(texto[fim_anterior:])
+    return "".join(partes)
+
+
+def _pseudonimo(chave, report_id):
+    """Identificador estável dentro de uma exportação, sem relação recuperável com o id do banco."""
+    return hmac.new(chave, str(report_id).encode("ascii"), hashlib.sha256).hexdigest()[:16]
+
+
+def _data(timestamp):
+    return f"{timestamp[:4]}-{timestamp[4:6]}-{timestamp[6:8]}"
+
+
+def anonimizar_lote_relatorios(linhas, chave):
+    registros = []
+    for report_id, timestamp, risk_alert, perguntas_versao, respostas_blob, relatorio_blob in linhas:
+        # Chaves extras do dados_paciente ficam de fora: não há como saber o que contêm
+        respostas, _ = descomprimir_respostas(respostas_blob)
+        padrao_termos, idade = identificacao(respostas[0] if respostas else "")
+        registros.append({
+            "id_pesquisa": _pseudonimo(chave, report_id),
+            "data": _data(timestamp),
+            "faixa_etaria": f"{idade // 10 * 10}-{idade // 10 * 10 + 9}" if idade is not None else None,
+            "alerta_risco": risk_alert == "Sim",
+            "perguntas_versao": perguntas_versao,
+            # A primeira resposta é a identificação: sai inteira, restando só a faixa etária
+            "respostas": [None] + [anonimizar_texto(r, padrao_termos) if isinstance(r, str) else None for r in respostas[1:]],
+            "relatorio": anonimizar_texto(descomprimir(relatorio_blob), padrao_termos),
+        })
+    return registros
+
+
+def anonimizar_lote_feedbacks(linhas, chave):
+    registros = []
+    for _, report_id, timestamp, feedback_text, respostas_blob in linhas:
+        respostas, _ = descomprimir_respostas(respostas_blob)
+        padrao_termos, _ = identificacao(respostas[0] if respostas else "")
+        registros.append({
+            "id_pesquisa": _pseudonimo(chave, report_id), "data": _data(timestamp), "feedback": anonimizar_texto(feedback_text, padrao_termos),
+        })
+    return registros
+
+
+def _lotes(conn, sql, tamanho_lote):
+    """Percorre a tabela por keyset no id, um lote por vez."""
+    ultimo_id = 0
+    while True:
+        linhas = conn.execute(sql, (ultimo_id, tamanho_lote)).fetchall()
+        if not linhas:
+            return
+        yield linhas
+        ultimo_id = linhas[-1][0]
+
+
+def _mapear_em_ordem(pool, funcao, lotes, chave, max_em_voo):
+    """funcao(lote, chave) para cada lote, na ordem; no máximo max_em_voo lotes em memória ao mesmo tempo."""
+    if pool is None:
+        for lote in lotes:
+            yield funcao(lote, chave)
+        return
+    em_voo = collections.deque()
+    for lote in lotes:
+        em_voo.append(pool.submit(funcao, lote, chave))
+        if len(em_voo) >= max_em_voo:
+            yield em_voo.popleft().result()
+    while em_voo:
+        yield em_voo.popleft().result()
+
+
+class _EscritorJsonl:
+    def __init__(self, caminho, tipo):
+        self._arquivo = open(caminho, "w", encoding="utf-8")
+
+    def escrever(self, registros):
+        self._arquivo.writelines(json.dumps(registro, ensure_ascii=False) + "\n" for registro in registros)
+
+    def fechar(self):
+        self._arquivo.close()
+
+
+class _EscritorParquet:
+    def __init__(self, caminho, tipo):
+        # pyarrow só é necessário para esta saída
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if tipo == "relatorios":
+            self._schema = pa.schema([
+                ("id_pesquisa", pa.string()), ("data", pa.string()), ("faixa_etaria", pa.string()), ("alerta_risco", pa.bool_()),
+                ("perguntas_versao", pa.int64()), ("respostas", pa.list_(pa.string())), ("relatorio", pa.string()),
+            ])
+        else:
+            self._schema = pa.schema([("id_pesquisa", pa.string()), ("data", pa.string()), ("feedback", pa.string())])
+        self._tabela = pa.Table
+        self._writer = pq.ParquetWriter(caminho, self._schema, compression="zstd")
+
+    def escrever(self, registros):
+        if registros:
+            self._writer.write_table(self._tabela.from_pylist(registros, schema=self._schema))
+
+    def fechar(self):
+        self._writer.close()
+
+
+ESCRITORES = {"jsonl": _EscritorJsonl, "parquet": _EscritorParquet}
+
+
+def exportar(db_path, saida, formato="jsonl", processos=None, tamanho_lote=TAMANHO_LOTE):
+    """Grava relatorios.<formato>, feedbacks.<formato> e perguntas.json em `saida`. Retorna as contagens e a duração."""
+    os.makedirs(saida, exist_ok=True)
+    processos = processos or os.cpu_count() or 1
+    # Nova a cada exportação: ids de exportações diferentes não se cruzam
+    chave = secrets.token_bytes(32)
+    conn = registrar_funcoes_sql(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True))
+    inicio = time.perf_counter()
+    contagens = {}
+    try:
+        perguntas = {versao: json.loads(lista) for versao, lista in conn.execute("SELECT versao, perguntas FROM perguntas_triagem")}
+        with open(os.path.join(saida, "perguntas.json"), "w", encoding="utf-8") as f:
+            json.dump(perguntas, f, ensure_ascii=False, indent=2)
+        pool = ProcessPoolExecutor(processos) if processos > 1 else None
+        try:
+            for tipo, sql, funcao in (
+                ("relatorios", SQL_RELATORIOS, anonimizar_lote_relatorios), ("feedbacks", SQL_FEEDBACKS, anonimizar_lote_feedbacks),
+            ):
+                escritor = ESCRITORES[formato](os.path.join(saida, f"{tipo}.{formato}"), tipo)
+                contagens[tipo] = 0
+                try:
+                    lotes = _lotes(conn, sql, tamanho_lote)
+                    for registros in _mapear_em_ordem(pool, funcao, lotes, chave, processos * LOTES_EM_VOO_POR_PROCESSO):
+                        escritor.escrever(registros)
+                        contagens[tipo] += len(registros)
+                finally:
+                    escritor.fechar()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    finally:
+        conn.close()
+    contagens["segundos"] = time.perf_counter() - inicio
+    return contagens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta relatórios e feedbacks anonimizados para pesquisa.")
+    parser.add_argument("--db", default=DB_PADRAO)
+    parser.add_argument("--saida", required=True, help="diretório de destino")
+    parser.add_argument("--formato", choices=sorted(ESCRITORES), default="jsonl")
+    parser.add_argument("--processos", type=int, default=None, help="padrão: número de CPUs")
+    parser.add_argument("--tamanho-lote", type=int, default=TAMANHO_LOTE)
+    args = parser.parse_args()
+    resultado = exportar(args.db, args.saida, args.formato, args.processos, args.tamanho_lote)
+    linhas = resultado["relatorios"] + resultado["feedbacks"]
+    print(f"{resultado['relatorios']} relatórios e {resultado['feedbacks']} feedbacks em {resultado['segundos']:.1f} s "
+          f"({linhas / max(resultado['segundos'], 1e-9):,.0f} linhas/s) -> {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# Gateway único do processo para a API da OpenAI: cliente assíncrono com keepalive, fila com prioridade, limite de
+# taxa aprendido dos cabeçalhos x-ratelimit-* e retentativas com backoff. As sessões do Streamlit (threads) chamam
+# completar(); as requisições rodam num event loop próprio, numa thread de fundo.
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import queue
+import random
+import re
+import threading
+import time
+
+# Menor número sai primeiro
+PRIORIDADE_INTERATIVA = 0  # paciente esperando na tela (reflexão, reformulação)
+PRIORIDADE_RELATORIO = 1  # relatório gerado em segundo plano pelo outbox
+PRIORIDADE_LOTE = 2  # reprocessamentos offline
+
+CHARS_POR_TOKEN = 4
+_FIM_STREAM = object()
+
+
+def _duracao_s(valor):
+    """Durações dos cabeçalhos da OpenAI ("20ms", "1s", "6m0s" ou só o número de segundos) em segundos."""
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    partes = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", valor)
+    if not partes:
+        return None
+    return sum(float(numero) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unidade] for numero, unidade in partes)
+
+
+def _inteiro(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def estimar_tokens(kwargs):
+    """Custo de uma requisição para o limite de tokens por minuto: prompt estimado + o máximo de tokens de saída."""
+    prompt = sum(len(str(m.get("content") or "")) for m in kwargs.get("messages") or ())
+    return prompt // CHARS_POR_TOKEN + (kwargs.get("max_tokens") or 0) * (kwargs.get("n") or 1)
+
+
+class BaldeTokens:
+    """Balde de tokens cuja capacidade e reposição vêm dos cabeçalhos de limite da API.
+
+    Até a primeira resposta com cabeçalhos não limita nada.
+    """
+    def __init__(self):
+        self.capacidade = None
+        self.por_segundo = 0.0
+        self.disponivel = 0.0
+        self._atualizado = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        if self.capacidade is not None:
+            self.disponivel = min(self.capacidade, self.disponivel + (agora - self._atualizado) * self.por_segundo)
+        self._atualizado = agora
+
+    def espera(self, custo, reserva=0.0):
+        """Segundos até haver `custo` disponível, deixando intocada a fração `reserva` da capacidade."""
+        if self.capacidade is None:
+            return 0.0
+        self._repor()
+        falta = min(custo + reserva * self.capacidade, self.capacidade) - self.disponivel
+        if falta <= 0:
+            return 0.0
+        return falta / self.por_segundo if self.por_segundo > 0 else 1.0
+
+    def consumir(self, custo):
+        if self.capacidade is not None:
+            self._repor()
+            self.disponivel -= min(custo, self.capacidade)
+
+    def esvaziar(self):
+        if self.capacidade is not None:
+            self._repor()
+            self.disponivel = min(self.disponivel, 0.0)
+
+    def atualizar(self, limite, restante, reset_s):
+        """Sincroniza com o servidor: `restante` agora, de volta a `limite` em `reset_s` segundos."""
+        if limite is None or restante is None:
+            return
+        self._repor()
+        # O servidor ainda não viu as requisições que saíram daqui depois desta: fica com a visão mais conservadora
+        self.disponivel = restante if self.capacidade is None else min(self.disponivel, restante)
+        self.capacidade = limite
+        if reset_s and limite > restante:
+            self.por_segundo = (limite - restante) / reset_s
+        elif not self.por_segundo:
+            self.por_segundo = limite / 60.0  # limites da OpenAI são por minuto
+
+
+class _Pedido:
+    __slots__ = ("prioridade", "seq", "kwargs", "custo", "enfileirado_em", "despachado", "tentativas", "futuro", "saida", "chunks")
+
+    def __init__(self, prioridade, seq, kwargs, futuro=None, saida=None):
+        self.prioridade = prioridade
+        self.seq = seq
+        self.kwargs = kwargs
+        self.custo = estimar_tokens(kwargs)
+        self.enfileirado_em = time.monotonic()
+        self.despachado = False
+        self.tentativas = 0
+        self.futuro = futuro
+        self.saida = saida
+        self.chunks = 0
+
+
+class OpenAIGateway:
+    """Concentra as chamadas de chat do processo num cliente AsyncOpenAI com conexões persistentes.
+
+    Pedidos esperam numa fila por prioridade; até `max_concorrentes` ficam em voo, e `vagas_interativas` delas nunca
+    são ocupadas por prioridades de fundo. Antes de cada despacho os baldes de requisições e de tokens (ajustados pelos
+    cabeçalhos x-ratelimit-*) precisam ter saldo; prioridades de fundo só usam o que passar de `reserva_interativa`
+    da capacidade, para uma rajada de relatórios não esgotar o limite das reflexões ao vivo. 429, 408, 409, 5xx e falhas de conexão são repetidos com backoff;
+    um 429 pausa o despacho de todos até o retry-after, já que o limite é da organização inteira.
+    """
+    def __init__(self, api_key=None, base_url=None, max_concorrentes=16, vagas_interativas=8, reserva_interativa=0.2,
+                 max_tentativas=5, backoff_base_s=0.5, backoff_max_s=30.0, keepalive_s=60.0, timeout_s=120.0, janela_metricas=500):
+        self.max_concorrentes = max_concorrentes
+        self.vagas_interativas = min(vagas_interativas, max_concorrentes - 1)
+        self.reserva_interativa = reserva_interativa
+        self.max_tentativas = max_tentativas
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.balde_requisicoes = BaldeTokens()
+        self.balde_tokens = BaldeTokens()
+        self.metricas = {"requisicoes": 0, "concluidas": 0, "retentativas": 0, "respostas_429": 0, "falhas": 0, "expiradas": 0}
+        self._esperas = collections.defaultdict(lambda: collections.deque(maxlen=janela_metricas))
+        self._latencias = collections.deque(maxlen=janela_metricas)
+        self._heap = []
+        self._seq = itertools.count()
+        self._ativos = 0
+        self._ativos_fundo = 0
+        self._pausado_ate = 0.0
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="openai-gateway", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._iniciar(api_key, base_url, keepalive_s, timeout_s), self._loop).result()
+
+    async def _iniciar(self, api_key, base_url, keepalive_s, timeout_s):
+        # Pacotes só importados quando o gateway é criado
+        import httpx
+        from openai import AsyncOpenAI
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concorrentes, max_keepalive_connections=self.max_concorrentes,
+                                keepalive_expiry=keepalive_s),
+            timeout=timeout_s,
+        )
+        # Retentativas ficam com o gateway, que conhece a fila inteira
+        self._cliente = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._http, max_retries=0)
+        self._condicao = asyncio.Condition()
+        self._despachante = asyncio.create_task(self._despachar())
+
+    # --- API síncrona (chamada pelas threads das sessões) ---
+    def completar(self, prioridade, prazo_s=None, **kwargs):
+        """Como client.chat.completions.create(**kwargs), passando pela fila. Com stream=True devolve um iterador de chunks.
+
+        Sem resposta em `prazo_s` (fila + requisição) levanta TimeoutError e o pedido sai da fila, para quem chamou
+        usar uma alternativa local em vez de deixar o paciente esperando.
+        """
+        if kwargs.get("stream"):
+            saida = queue.Queue()
+            asyncio.run_coroutine_threadsafe(self._enfileirar(prioridade, kwargs, saida=saida), self._loop).result()
+            return self._iterar_stream(saida)
+        futuro = asyncio.run_coroutine_threadsafe(self._completar(prioridade, kwargs), self._loop)
+        try:
+            return futuro.result(timeout=prazo_s)
+        except concurrent.futures.TimeoutError:
+            futuro.cancel()
+            raise TimeoutError(f"Sem resposta da OpenAI em {prazo_s}s.") from None
+
+    @staticmethod
+    def _iterar_stream(saida):
+        while True:
+            item = saida.get()
+            if item is _FIM_STREAM:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def snapshot(self):
+        return asyncio.run_coroutine_threadsafe(self._snapshot(), self._loop).result()
+
+    def fechar(self):
+        asyncio.run_coroutine_threadsafe(self._fechar(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- Event loop ---
+    async def _completar(self, prioridade, kwargs):
+        futuro = self._loop.create_future()
+        await self._enfileirar(prioridade, kwargs, futuro=futuro)
+        return await futuro
+
+    async def _enfileirar(self, prioridade, kwargs, futuro=None, saida=None):
+        pedido = _Pedido(prioridade, next(self._seq), kwargs, futuro, saida)
+        self.metricas["requisicoes"] += 1
+        await self._devolver_a_fila(pedido)
+
+    async def _devolver_a_fila(self, pedido, atraso_s=0.0):
+        if atraso_s > 0:
+            await asyncio.sleep(atraso_s)
+        async with self._condicao:
+            # A sequência original mantém a posição do pedido entre os da mesma prioridade
+            heapq.heappush(self._heap, (pedido.prioridade, pedido.seq, pedido))
+            self._condicao.notify_all()
+
+    def _pode_despachar(self):
+        if not self._heap or self._ativos >= self.max_concorrentes:
+            return False
+        return self._heap[0][0] == PRIORIDADE_INTERATIVA or self._ativos_fundo < self.max_concorrentes - self.vagas_interativas
+
+    async def _despachar(self):
+        while True:
+            async with self._condicao:
+                await self._condicao.wait_for(self._pode_despachar)
+                pedido = self._heap[0][2]
+                if pedido.futuro is not None and pedido.futuro.cancelled():
+                    # Quem pediu desistiu (prazo_s) antes do despacho
+                    heapq.heappop(self._heap)
+                    self.metricas["expiradas"] += 1
+                    continue
+                reserva = 0.0 if pedido.prioridade == PRIORIDADE_INTERATIVA else self.reserva_interativa
+                espera = max(
+                    self._pausado_ate - time.monotonic(), self.balde_requisicoes.espera(1, reserva),
+                    self.balde_tokens.espera(pedido.custo, reserva),
+                )
+                if espera > 0:
+                    # Acorda antes se chegar outro pedido: ele pode ser mais prioritário que o do topo
+                    try:
+                        await asyncio.wait_for(self._condicao.wait(), timeout=espera)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self._heap)
+                self.balde_requisicoes.consumir(1)
+                self.balde_tokens.consumir(pedido.custo)
+                self._ativos += 1
+                self._ativos_fundo += pedido.prioridade != PRIORIDADE_INTERATIVA
+                if not pedido.despachado:
+                    pedido.despachado = True
+                    self._esperas[pedido.prioridade].append(time.monotonic() - pedido.enfileirado_em)
+            asyncio.create_task(self._executar(pedido))
+
+    async def _executar(self, pedido):
+        try:
+            await self._chamar(pedido)
+            self.metricas["concluidas"] += 1
+            self._latencias.append(time.monotonic() - pedido.enfileirado_em)
+        except Exception as erro:
+            atraso = self._atraso_retentativa(pedido, erro)
+            if atraso is None:
+                self.metricas["falhas"] += 1
+                if pedido.saida is not None:
+                    pedido.saida.put(erro)
+                elif not pedido.futuro.done():
+                    pedido.futuro.set_exception(erro)
+            else:
+                self.metricas["retentativas"] += 1
+                asyncio.create_task(self._devolver_a_fila(pedido, atraso))
+        finally:
+            async with self._condicao:
+                self._ativos -= 1
+                self._ativos_fundo -= pedido.prioridade != PRIORIDADE_INTERATIVA
+                self._condicao.notify_all()
+
+    async def _chamar(self, pedido):
+        pedido.tentativas += 1
+        bruta = await self._cliente.chat.completions.with_raw_response.create(**pedido.kwargs)
+        self._ler_limites(bruta.headers)
+        resposta = bruta.parse()
+        if pedido.saida is None:
+            if not pedido.futuro.done():
+                pedido.futuro.set_result(resposta)
+            return
+        async for chunk in resposta:
+            pedido.chunks += 1
+            pedido.saida.put(chunk)
+        pedido.saida.put(_FIM_STREAM)
+
+    def _ler_limites(self, headers):
+        for balde, sufixo in ((self.balde_requisicoes, "requests"), (self.balde_tokens, "tokens")):
+            balde.atualizar(
+                _inteiro(headers.get(f"x-ratelimit-limit-{sufixo}")), _inteiro(headers.get(f"x-ratelimit-remaining-{sufixo}")),
+                _duracao_s(headers.get(f"x-ratelimit-reset-{sufixo}")),
+            )
+
+    def _atraso_retentativa(self, pedido, erro):
+        """Segundos até a próxima tentativa, ou None se o erro não deve ser repetido."""
+        import openai
+        if pedido.chunks or pedido.tentativas >= self.max_tentativas:
+            # Um stream que já entregou texto não pode ser refeito sem duplicá-lo
+            return None
+        atraso = min(self.backoff_max_s, self.backoff_base_s * (2 ** (pedido.tentativas - 1))) * random.uniform(0.5, 1.0)
+        if isinstance(erro, openai.RateLimitError):
+            if getattr(erro, "code", None) == "insufficient_quota":
+                return None
+            self.metricas["respostas_429"] += 1
+            headers = erro.response.headers
+            self._ler_limites(headers)
+            retry_after_ms = _duracao_s(headers.get("retry-after-ms"))
+            retry_after = retry_after_ms / 1000 if retry_after_ms is not None else _duracao_s(headers.get("retry-after"))
+            if retry_after is not None:
+                atraso = max(atraso, retry_after)
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + atraso)
+            self.balde_requisicoes.esvaziar()
+            return atraso
+        if isinstance(erro, openai.APIStatusError):
+            return atraso if erro.status_code in (408, 409) or erro.status_code >= 500 else None
+        if isinstance(erro, openai.APIConnectionError):  # inclui APITimeoutError
+            return atraso
+        return None
+
+    async def _snapshot(self):
+        resumo = dict(self.metricas)
+        resumo["em_voo"] = self._ativos
+        fila = collections.Counter(prioridade for prioridade, _, _ in self._heap)
+        for prioridade, esperas in sorted(self._esperas.items()):
+            ordenadas = sorted(esperas)
+            resumo[f"fila_{prioridade}"] = fila.get(prioridade, 0)
+            for nome, q in (("p50", 0.50), ("p95", 0.95)):
+                resumo[f"espera_fila_{prioridade}_{nome}_ms"] = ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000
+        latencias = sorted(self._latencias)
+        for nome, q in (("latencia_p50_ms", 0.50), ("latencia_p95_ms", 0.95)):
+            resumo[nome] = latencias[min(len(latencias) - 1, int(q * len(latencias)))] * 1000 if latencias else 0.0
+        resumo["limite_requisicoes"] = self.balde_requisicoes.capacidade
+        resumo["limite_tokens"] = self.balde_tokens.capacidade
+        return resumo
+
+    async def _fechar(self):
+        self._despachante.cancel()
+        await self._http.aclose()
@@ -0,0 +1,171 @@
+# Detector de falas de risco: autômato Aho-Corasick sobre um léxico versionado, insensível a acentos
+import functools
+import json
+import os
+import unicodedata
+from collections import deque, namedtuple
+
+LEXICO_ARQUIVO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexico_risco.json")
+
+RiskMatch = namedtuple("RiskMatch", ["inicio", "fim", "termo", "categoria", "trecho"])
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalizar_char(c):
+    decomposto = unicodedata.normalize("NFKD", c)
+    return "".join(ch for ch in decomposto if not unicodedata.combining(ch)).casefold()
+
+
+def _tabela_um_para_um():
+    """Caracteres latinos cuja forma normalizada tem exatamente um caractere (á -> a, Ç -> c, tab -> espaço)."""
+    tabela = {ord(c): " " for c in "\t\n\r\x0b\x0c"}
+    for codigo in range(0x41, 0x250):
+        normalizado = _normalizar_char(chr(codigo))
+        if len(normalizado) == 1 and normalizado != chr(codigo):
+            tabela[codigo] = normalizado
+    return tabela
+
+_TABELA_UM_PARA_UM = _tabela_um_para_um()
+
+
+def normalizar_texto(texto):
+    """Remove acentos, aplica casefold e colapsa espaços.
+
+    Retorna o texto normalizado e, para cada caractere dele, o índice do caractere de origem,
+    para que os trechos encontrados possam ser devolvidos no texto original.
+    """
+    rapido = texto.translate(_TABELA_UM_PARA_UM)
+    if rapido.isascii() and len(rapido) == len(texto) and "  " not in rapido:
+        # Caminho rápido: cada caractere vira exatamente um e não há espaços a colapsar, então o mapa é a identidade
+        return rapido, range(len(texto))
+    normalizado = []
+    mapa = []
+    ultimo_espaco = True
+    for i, c in enumerate(texto):
+        if c.isspace():
+            if not ultimo_espaco:
+                normalizado.append(" ")
+                mapa.append(i)
+            ultimo_espaco = True
+            continue
+        ultimo_espaco = False
+        for ch in (c.lower() if c < "\x80" else _normalizar_char(c)):
+            normalizado.append(ch)
+            mapa.append(i)
+    return "".join(normalizado), mapa
+
+
+def _dobrar_para_prefiltro(texto):
+    """Forma aproximada de normalizar_texto, toda em C: casefold, espaços colapsados, acentos e demais caracteres
+    não ASCII removidos.
+
+    Não devolve posições; só serve para descartar rápido textos em que nenhum termo pode casar. Remover um caractere
+    pode juntar pedaços e deixar passar um texto a mais, nunca esconder um termo que normalizar_texto encontraria.
+    """
+    return " ".join(unicodedata.normalize("NFKD", texto.casefold()).split()).encode("ascii", "ignore").decode("ascii")
+
+
+def _eh_letra(texto, i):
+    return 0 <= i < len(texto) and texto[i].isalnum()
+
+
+class LexicoRisco:
+    """Autômato compilado uma única vez com todos os termos do léxico."""
+    def __init__(self, categorias, versao="desconhecida"):
+        self.versao = versao
+        self.categorias = categorias
+        self._goto = [{}]
+        self._falha = [0]
+        self._saidas = [[]]
+        chaves = set()
+        for categoria, termos in categorias.items():
+            for termo in termos:
+                chaves.add(self._adicionar(termo, categoria))
+        self._compilar()
+        # Pré-filtro: a maioria dos textos não contém nenhum termo e nem chega à normalização com mapa de posições
+        # nem ao autômato (laço em Python por caractere). Das chaves ficam só as que não contêm outra ("matar" já
+        # cobre "me matar"), testadas com `in` sobre _dobrar_para_prefiltro
+        self._chaves_prefiltro = tuple(sorted(c for c in chaves if not any(outra != c and outra in c for outra in chaves)))
+
+    @classmethod
+    def carregar(cls, path=LEXICO_ARQUIVO):
+        with open(path, "r", encoding="utf-8") as f:
+            conteudo = json.load(f)
+        return cls(conteudo["categorias"], versao=conteudo.get("versao", "desconhecida"))
+
+    def _adicionar(self, termo, categoria):
+        prefixo = termo.endswith("*")
+        chave, _ = normalizar_texto(termo.rstrip("*"))
+        estado = 0
+        for c in chave:
+            proximo = self._goto[estado].get(c)
+            if proximo is None:
+                proximo = len(self._goto)
+                self._goto[estado][c] = proximo
+                self._goto.append({})
+                self._falha.append(0)
+                self._saidas.append([])
+            estado = proximo
+        self._saidas[estado].append((len(chave), termo, categoria, prefixo))
+        return chave
+
+    def _compilar(self):
+        fila = deque(self._goto[0].values())
+        while fila:
+            estado = fila.popleft()
+            for c, proximo in self._goto[estado].items():
+                fila.append(proximo)
+                falha = self._falha[estado]
+                while falha and c not in self._goto[falha]:
+                    falha = self._falha[falha]
+                self._falha[proximo] = self._goto[falha].get(c, 0)
+                self._saidas[proximo] = self._saidas[proximo] + self._saidas[self._falha[proximo]]
+
+    def buscar(self, texto):
+        """Retorna todas as ocorrências (com posição no texto original e categoria)."""
+        if not texto:
+            return []
+        dobrado = _dobrar_para_prefiltro(texto)
+        if not any(chave in dobrado for chave in self._chaves_prefiltro):
+            return []
+        normalizado, mapa = normalizar_texto(texto)
+        goto, falha, saidas = self._goto, self._falha, self._saidas
+        candidatos = []
+        estado = 0
+        for fim, c in enumerate(normalizado):
+            while estado and c not in goto[estado]:
+                estado = falha[estado]
+            estado = goto[estado].get(c, 0)
+            if not saidas[estado]:
+                continue
+            for tamanho, termo, categoria, prefixo in saidas[estado]:
+                inicio = fim - tamanho + 1
+                # Termos casam apenas em início de palavra; sem "*", também exigem fim de palavra
+                if _eh_letra(normalizado, inicio - 1) or (not prefixo and _eh_letra(normalizado, fim + 1)):
+                    continue
+                fim_palavra = fim
+                if prefixo:
+                    while _eh_letra(normalizado, fim_palavra + 1):
+                        fim_palavra += 1
+                candidatos.append((inicio, fim_palavra, termo, categoria))
+        # Ocorrências sobrepostas: fica só a mais longa ("me matar" é suicídio, não também homicídio por "matar*")
+        candidatos.sort(key=lambda c: (c[0] - c[1], c[0]))
+        escolhidos = []
+        for candidato in candidatos:
+            if all(candidato[1] < outro[0] or candidato[0] > outro[1] for outro in escolhidos):
+                escolhidos.append(candidato)
+        encontrados = []
+        for inicio, fim_palavra, termo, categoria in sorted(escolhidos):
+            inicio_orig, fim_orig = mapa[inicio], mapa[fim_palavra] + 1
+            encontrados.append(RiskMatch(inicio_orig, fim_orig, termo, categoria, texto[inicio_orig:fim_orig]))
+        return encontrados
+
+    def tem_risco(self, texto):
+        return bool(self.buscar(texto))
+
+    def varrer(self, itens):
+        """Modo em lote: consome (id, texto) de forma preguiçosa e produz (id, ocorrências) só quando há risco."""
+        for item_id, texto in itens:
+            encontrados = self.buscar(texto)
+            if encontrados:
+                yield item_id, encontrados
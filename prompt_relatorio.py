@@ -0,0 +1,117 @@
+# Prompt do relatório: prefixo estático byte a byte estável (cacheável pelo provedor) + respostas dentro de um orçamento de tokens
+import functools
+import hashlib
+import math
+from collections import namedtuple
+
+MODELO_PADRAO = "gpt-4o"
+# Estimativa usada quando o tiktoken (ou o vocabulário dele) não está disponível; conservadora para português
+CHARS_POR_TOKEN_ESTIMADO = 3.5
+# A estimativa ainda pode subcontar textos com muitos acentos e palavras curtas: sem contagem exata, o orçamento de
+# respostas efetivo é só esta fração do configurado
+MARGEM_ORCAMENTO_ESTIMADO = 0.8
+MARCADOR_TRECHO_OMITIDO = " [... trecho omitido pelo limite de tokens ...] "
+
+PromptMontado = namedtuple(
+    "PromptMontado", ["messages", "versao", "impressao_prefixo", "tokens_prefixo", "tokens_respostas", "respostas_truncadas"]
+)
+
+
+@functools.lru_cache(maxsize=None)
+def carregar_codificador(modelo):
+    """Codificador do tiktoken para o modelo, carregado uma vez por processo; None se não puder ser carregado.
+
+    O vocabulário é baixado no primeiro uso (ou lido de TIKTOKEN_CACHE_DIR).
+    """
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(modelo)
+    except Exception as e:
+        # Pacote ausente ou vocabulário sem download possível: a contagem vira estimativa
+        print(f"AVISO: tiktoken indisponível para {modelo} ({type(e).__name__}); tokens do prompt serão estimados por caracteres.")
+        return None
+
+# Carregado na importação: nenhum relatório paga o download do vocabulário
+carregar_codificador(MODELO_PADRAO)
+
+
+class ContadorTokens:
+    """Conta tokens localmente com o tiktoken do modelo, ou estima por caracteres se ele não puder ser carregado."""
+    def __init__(self, modelo):
+        self._codificador = carregar_codificador(modelo)
+
+    @property
+    def exato(self):
+        return self._codificador is not None
+
+    def contar(self, texto):
+        if self._codificador is not None:
+            return len(self._codificador.encode(texto))
+        return math.ceil(len(texto) / CHARS_POR_TOKEN_ESTIMADO)
+
+    def truncar(self, texto, max_tokens):
+        """Mantém o início (2/3) e o fim (1/3) do texto, marcando o trecho removido."""
+        if self.contar(texto) <= max_tokens:
+            return texto
+        inicio_n = max_tokens * 2 // 3
+        fim_n = max_tokens - inicio_n
+        if self._codificador is not None:
+            tokens = self._codificador.encode(texto)
+            inicio, fim = self._codificador.decode(tokens[:inicio_n]), self._codificador.decode(tokens[-fim_n:])
+        else:
+            inicio = texto[:int(inicio_n * CHARS_POR_TOKEN_ESTIMADO)]
+            fim = texto[-int(fim_n * CHARS_POR_TOKEN_ESTIMADO):]
+        return inicio.rstrip() + MARCADOR_TRECHO_OMITIDO + fim.lstrip()
+
+
+class PromptRelatorioBuilder:
+    """Monta as mensagens do relatório.
+
+    A mensagem de sistema contém só texto estático (papel, estrutura do exame, teorias, intervenções), montado uma vez:
+    é o prefixo que o provedor pode reaproveitar entre relatórios. As respostas do paciente vão depois, na mensagem do
+    usuário. Qualquer mudança no texto estático deve vir com uma nova `versao`.
+    """
+    def __init__(self, versao, sistema, instrucoes, pedido_final, modelo=MODELO_PADRAO, orcamento_respostas_tokens=6000,
+                 min_tokens_por_resposta=200):
+        self.versao = versao
+        self.prefixo = f"{sistema.strip()}\n\n{instrucoes.strip()}"
+        self.pedido_final = pedido_final.strip()
+        self.orcamento_respostas_tokens = orcamento_respostas_tokens
+        self.min_tokens_por_resposta = min_tokens_por_resposta
+        self.contador = ContadorTokens(modelo)
+        self.orcamento_efetivo_tokens = (
+            orcamento_respostas_tokens if self.contador.exato else int(orcamento_respostas_tokens * MARGEM_ORCAMENTO_ESTIMADO)
+        )
+        self.tokens_prefixo = self.contador.contar(self.prefixo)
+        self.impressao_prefixo = hashlib.sha256(f"{versao}\n{self.prefixo}".encode("utf-8")).hexdigest()[:12]
+
+    def _limite_por_resposta(self, tamanhos):
+        """Maior limite L tal que sum(min(t, L)) cabe no orçamento: respostas curtas ficam intactas, as longas dividem o resto."""
+        if sum(tamanhos) <= self.orcamento_efetivo_tokens:
+            return None
+        restante = self.orcamento_efetivo_tokens
+        ordenados = sorted(tamanhos)
+        for i, tamanho in enumerate(ordenados):
+            parcela = restante / (len(ordenados) - i)
+            if tamanho > parcela:
+                return max(int(parcela), self.min_tokens_por_resposta)
+            restante -= tamanho
+        return None
+
+    def montar(self, dados_paciente):
+        itens = [(p, r) for p, r in dados_paciente.items() if isinstance(p, str) and isinstance(r, str)]
+        tamanhos = [self.contador.contar(resposta) for _, resposta in itens]
+        limite = self._limite_por_resposta(tamanhos)
+        linhas = []
+        tokens_respostas = 0
+        truncadas = 0
+        for (pergunta, resposta), tamanho in zip(itens, tamanhos):
+            if limite is not None and tamanho > limite:
+                resposta = self.contador.truncar(resposta, limite)
+                tamanho = limite
+                truncadas += 1
+            linhas.append(f"- {pergunta}: {resposta}")
+            tokens_respostas += tamanho
+        conteudo_usuario = "## Informações do Paciente e Respostas da Triagem:\n" + "\n".join(linhas) + f"\n\n{self.pedido_final}"
+        messages = [{"role": "system", "content": self.prefixo}, {"role": "user", "content": conteudo_usuario}]
+        return PromptMontado(messages, self.versao, self.impressao_prefixo, self.tokens_prefixo, tokens_respostas, truncadas)
@@ -0,0 +1,209 @@
+# Regeneração em lote de relatórios já gravados com o prompt atual (versao_prompt_relatorio), fora do Streamlit
+# Seleciona relatórios por filtro e refaz cada um a partir das respostas guardadas, com até --concorrencia chamadas em
+# voo pelo gateway, na prioridade de lote. Cada relatório regenerado é gravado na hora em relatorio_versoes (o original
+# continua em reports), e essa tabela é o checkpoint: repetir o comando retoma de onde parou, pulando os que já têm
+# a versão atual. Roda no diretório do app, sobre o banco local e sem o aquecimento do app (nem download automático,
+# nem worker do outbox); com --sincronizar baixa o banco do bucket se não houver cópia local e envia as alterações.
+# O envio só acontece se o bucket ainda estiver na seq de que a cópia local partiu: se o app (ou outra execução)
+# sincronizou no meio, a CLI para de enviar e termina com erro em vez de sobrescrever o bucket com uma base nova.
+# Mesmo assim, o app em execução sobrescreveria o envio da CLI no sync seguinte dele; por isso --sincronizar deve
+# rodar na máquina do app, com o app parado.
+# Uso: python regeneracao_relatorios.py [--desde AAAA-MM-DD] [--ate AAAA-MM-DD] [--alerta Sim|Não] [--ids 1,2,3]
+#      [--limite N] [--concorrencia N] [--sincronizar]
+import argparse
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import app_streamlit as app
+from gateway_openai import PRIORIDADE_LOTE, OpenAIGateway
+from sync_gcs import SyncDivergente
+
+CONCORRENCIA_PADRAO = 8
+TAMANHO_LOTE = 200
+INTERVALO_PROGRESSO_S = 10
+INTERVALO_SYNC_S = 60
+
+SQL_PENDENTES = """
+    SELECT r.id, r.perguntas_versao, r.respostas, r.risk_alert FROM reports r
+    WHERE r.id > ?{filtros} AND NOT EXISTS (
+        SELECT 1 FROM relatorio_versoes v WHERE v.report_id = r.id AND v.prompt_versao = ?
+    )
+    ORDER BY r.id LIMIT ?
+"""
+SQL_CONTAGEM = """
+    SELECT COUNT(*) FROM reports r
+    WHERE 1{filtros} AND NOT EXISTS (SELECT 1 FROM relatorio_versoes v WHERE v.report_id = r.id AND v.prompt_versao = ?)
+"""
+
+
+def filtros_sql(desde=None, ate=None, alerta=None, ids=None):
+    """Condições extras sobre reports (alias r) e seus parâmetros. `desde` e `ate` são datas, ambas inclusivas."""
+    condicoes, parametros = [], []
+    if desde:
+        condicoes.append("r.timestamp >= ?")
+        parametros.append(desde.strftime("%Y%m%d"))
+    if ate:
+        condicoes.append("r.timestamp < ?")
+        parametros.append((ate + datetime.timedelta(days=1)).strftime("%Y%m%d"))
+    if alerta:
+        condicoes.append("r.risk_alert = ?")
+        parametros.append(alerta)
+    if ids:
+        condicoes.append(f"r.id IN ({', '.join('?' * len(ids))})")
+        parametros.extend(ids)
+    return "".join(f" AND {condicao}" for condicao in condicoes), parametros
+
+
+def _pendentes(db, prompt_versao, filtros, parametros, limite=None, tamanho_lote=TAMANHO_LOTE):
+    """(report_id, dados_paciente) ainda sem a versão atual, em ordem de id e lidos em lotes (memória constante)."""
+    perguntas = {}
+    ultimo_id, entregues = 0, 0
+    while limite is None or entregues < limite:
+        linhas = db.ler(SQL_PENDENTES.format(filtros=filtros), (ultimo_id, *parametros, prompt_versao, tamanho_lote))
+        if not linhas:
+            return
+        for report_id, perguntas_versao, respostas_blob, risk_alert in linhas:
+            if perguntas_versao not in perguntas:
+                linha = db.ler_um("SELECT perguntas FROM perguntas_triagem WHERE versao = ?", (perguntas_versao,))
+                perguntas[perguntas_versao] = tuple(json.loads(linha[0])) if linha else ()
+            yield report_id, app.expandir_dados_paciente(perguntas_versao, respostas_blob, risk_alert, perguntas[perguntas_versao])
+            entregues += 1
+            if limite is not None and entregues >= limite:
+                return
+        ultimo_id = linhas[-1][0]
+
+
+def _gravar_versao(db, report_id, prompt_versao, relatorio):
+    # Outra execução simultânea pode ter chegado antes: a primeira versão gravada vale
+    db.executar(
+        "INSERT INTO relatorio_versoes (report_id, prompt_versao, relatorio, gerado_em) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (report_id, prompt_versao) DO NOTHING",
+        (report_id, prompt_versao, app.comprimir(relatorio), datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+    )
+
+
+def regenerar(gateway, concorrencia=CONCORRENCIA_PADRAO, limite=None, sincronizar=False, tamanho_lote=TAMANHO_LOTE, **filtros):
+    """Regenera os relatórios selecionados por `filtros` (ver filtros_sql) que ainda não têm a versão atual do prompt.
+
+    Retorna {"selecionados", "regenerados", "falhas", "segundos", "sync_recusado"}; os que falharem ficam para a
+    próxima execução. Se um sync for recusado porque o bucket mudou (SyncDivergente), nada mais é enviado nem
+    selecionado; o que já foi regenerado fica só no banco local.
+    """
+    db = app._get_db_manager()
+    prompt_versao = app.versao_prompt_relatorio()
+    filtros, parametros = filtros_sql(**filtros)
+    selecionados = db.ler_um(SQL_CONTAGEM.format(filtros=filtros), (*parametros, prompt_versao))[0]
+    if limite is not None:
+        selecionados = min(selecionados, limite)
+    print(f"{selecionados} relatório(s) a regenerar com o prompt {prompt_versao}.")
+    resultado = {"selecionados": selecionados, "regenerados": 0, "falhas": 0, "sync_recusado": False}
+    lock = threading.Lock()
+    recusado = threading.Event()
+
+    def sincronizar_agora():
+        if recusado.is_set():
+            return
+        try:
+            envio = app.sync_engine.sync(exigir_mesma_seq=True)
+            print(f"Banco enviado ao bucket ({envio['modo']}, seq {envio['seq']}, {envio['bytes']} bytes).")
+        except SyncDivergente as e:
+            recusado.set()
+            resultado["sync_recusado"] = True
+            print(f"ERRO: sync recusado, {e}. Outro processo escreveu no bucket; pare o app, baixe o banco de novo e repita.")
+        except Exception as e:
+            print(f"ERRO ao enviar o banco ao bucket: {e}")
+
+    fila = queue.Queue(maxsize=2 * concorrencia)
+    inicio = time.perf_counter()
+
+    def trabalhador():
+        while (item := fila.get()) is not None:
+            report_id, dados = item
+            try:
+                relatorio = app.completar_relatorio(app.montar_prompt_relatorio(dados), PRIORIDADE_LOTE, gateway)
+                if not relatorio:
+                    raise ValueError("a IA devolveu um relatório vazio")
+                _gravar_versao(db, report_id, prompt_versao, relatorio)
+                with lock: resultado["regenerados"] += 1
+            except Exception as e:
+                with lock: resultado["falhas"] += 1
+                print(f"ERRO ao regenerar o relatório {report_id}: {e}")
+
+    parar = threading.Event()
+    def acompanhar():
+        ultimo_sync = time.monotonic()
+        while not parar.wait(INTERVALO_PROGRESSO_S):
+            with lock: feitos, falhas = resultado["regenerados"], resultado["falhas"]
+            decorrido = time.perf_counter() - inicio
+            print(f"{feitos + falhas}/{selecionados} ({falhas} falha(s)), {feitos / decorrido * 60:.1f} relatórios/min")
+            if sincronizar and time.monotonic() - ultimo_sync >= INTERVALO_SYNC_S:
+                sincronizar_agora()
+                ultimo_sync = time.monotonic()
+
+    trabalhadores = [threading.Thread(target=trabalhador, name=f"regeneracao-{i}", daemon=True) for i in range(concorrencia)]
+    for t in trabalhadores: t.start()
+    acompanhamento = threading.Thread(target=acompanhar, name="regeneracao-progresso", daemon=True)
+    acompanhamento.start()
+    for item in _pendentes(db, prompt_versao, filtros, parametros, limite, tamanho_lote):
+        if recusado.is_set():
+            break
+        fila.put(item)
+    for _ in trabalhadores: fila.put(None)
+    for t in trabalhadores: t.join()
+    parar.set()
+    acompanhamento.join()
+    if sincronizar:
+        sincronizar_agora()
+    resultado["segundos"] = time.perf_counter() - inicio
+    return resultado
+
+
+def criar_gateway(concorrencia):
+    """Gateway próprio do processo: sem sessões ao vivo aqui, todas as vagas ficam para o lote, mas a reserva do limite
+    de taxa (que é da chave, compartilhado com o app) continua de fora."""
+    return OpenAIGateway(
+        api_key=os.getenv("OPENAI_API_KEY"), max_concorrentes=concorrencia, vagas_interativas=0,
+        reserva_interativa=app.OPENAI_RESERVA_INTERATIVA, max_tentativas=app.OPENAI_MAX_TENTATIVAS, keepalive_s=app.OPENAI_KEEPALIVE_S
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenera relatórios gravados com a versão atual do prompt do relatório.")
+    parser.add_argument("--desde", type=datetime.date.fromisoformat, help="só relatórios a partir desta data (AAAA-MM-DD)")
+    parser.add_argument("--ate", type=datetime.date.fromisoformat, help="só relatórios até esta data, inclusive (AAAA-MM-DD)")
+    parser.add_argument("--alerta", choices=["Sim", "Não"], help="só relatórios com este alerta de risco")
+    parser.add_argument("--ids", type=lambda valor: [int(i) for i in valor.split(",")], help="só estes relatórios (ex.: 12,15,40)")
+    parser.add_argument("--limite", type=int, help="no máximo N relatórios nesta execução")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA_PADRAO, help="chamadas à OpenAI em voo ao mesmo tempo")
+    parser.add_argument("--sincronizar", action="store_true", help="baixa o banco do bucket se não houver cópia local e envia as alterações (com o app parado)")
+    args = parser.parse_args(argv)
+
+    if args.sincronizar:
+        if not os.path.exists(app.DB_NAME):
+            app.download_database()
+        if not app.sync_engine.em_dia():
+            print("ERRO: a cópia local não corresponde ao bucket (o app sincronizou depois dela). "
+                  f"Pare o app, apague {app.DB_NAME} para baixar o banco de novo e repita.")
+            return 2
+    app.init_db()
+    gateway = criar_gateway(args.concorrencia)
+    try:
+        resultado = regenerar(
+            gateway, args.concorrencia, args.limite, args.sincronizar,
+            desde=args.desde, ate=args.ate, alerta=args.alerta, ids=args.ids
+        )
+    finally:
+        gateway.fechar()
+    print(f"{resultado['regenerados']} relatório(s) regenerados e {resultado['falhas']} falha(s) em {resultado['segundos']:.0f} s.")
+    if resultado["sync_recusado"]:
+        return 2
+    return 1 if resultado["falhas"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
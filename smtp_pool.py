@@ -0,0 +1,139 @@
+# Sessão SMTP persistente: reaproveita a conexão autenticada, reconecta quando fica obsoleta e repete com backoff
+import collections
+import random
+import smtplib
+import threading
+import time
+
+
+class SMTPConnectionManager:
+    """Mantém uma conexão SMTP aberta entre envios, serializada por um lock.
+
+    Conexões ociosas por mais de `keepalive_s` são descartadas; acima de `noop_apos_s` de ociosidade
+    um NOOP confirma que o servidor ainda responde antes do envio.
+    """
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, timeout=30,
+                 keepalive_s=240, noop_apos_s=20, max_tentativas=3, backoff_base_s=0.5, janela_metricas=500):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.keepalive_s = keepalive_s
+        self.noop_apos_s = noop_apos_s
+        self.max_tentativas = max_tentativas
+        self.backoff_base_s = backoff_base_s
+        self._lock = threading.Lock()
+        self._conn = None
+        self._ultimo_uso = 0.0
+        self.metricas = {"envios": 0, "falhas": 0, "retentativas": 0, "conexoes": 0}
+        self._latencias = collections.deque(maxlen=janela_metricas)
+
+    def _conectar(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            try:
+                conn.login(self.username, self.password)
+            except BaseException:
+                # A conexão ainda não foi guardada em self._conn: sem fechar aqui o socket vazaria
+                conn.close()
+                raise
+        self.metricas["conexoes"] += 1
+        return conn
+
+    def _fechar(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except OSError:
+                pass
+            self._conn = None
+
+    def _descartar(self):
+        """Fecha sem QUIT: usado quando a conexão já caiu."""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+    def _obter_conexao(self):
+        ociosidade = time.monotonic() - self._ultimo_uso
+        if self._conn is not None and ociosidade > self.keepalive_s:
+            self._fechar()
+        elif self._conn is not None and ociosidade > self.noop_apos_s:
+            try:
+                if self._conn.noop()[0] != 250:
+                    self._fechar()
+            except OSError:
+                self._descartar()
+        if self._conn is None:
+            self._conn = self._conectar()
+        return self._conn
+
+    def enviar(self, msg):
+        """Envia a mensagem; erros de autenticação e recusas permanentes (5xx) não são repetidos.
+
+        Levanta a última exceção se todas as tentativas falharem.
+        """
+        inicio = time.perf_counter()
+        with self._lock:
+            tentativa = 0
+            while True:
+                reaproveitada = self._conn is not None
+                try:
+                    self._obter_conexao().send_message(msg)
+                    self._ultimo_uso = time.monotonic()
+                    self.metricas["envios"] += 1
+                    self._latencias.append(time.perf_counter() - inicio)
+                    return True
+                except smtplib.SMTPAuthenticationError:
+                    self._fechar()
+                    self.metricas["falhas"] += 1
+                    raise
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                    # Recusa do servidor com a sessão ainda de pé: limpa a transação e mantém a conexão. Na saudação
+                    # (SMTPConnectError, SMTPHeloError dentro de _conectar) ainda não há conexão guardada
+                    if self._conn is not None:
+                        try:
+                            self._conn.rset()
+                        except OSError:
+                            self._descartar()
+                    # Só 4xx (ex.: 451) é temporário; um 5xx (destinatário inexistente, mensagem rejeitada) falharia igual
+                    codigos = [codigo for codigo, _ in e.recipients.values()] if isinstance(e, smtplib.SMTPRecipientsRefused) else [e.smtp_code]
+                    if not all(400 <= codigo < 500 for codigo in codigos):
+                        self.metricas["falhas"] += 1
+                        raise
+                    erro = e
+                except OSError as e:
+                    # Queda de rede ou SMTPServerDisconnected (SMTPException herda de OSError)
+                    self._descartar()
+                    if reaproveitada:
+                        # Sessão obsoleta derrubada pelo servidor: reconecta na hora, sem contar como tentativa
+                        continue
+                    erro = e
+                tentativa += 1
+                if tentativa >= self.max_tentativas:
+                    self.metricas["falhas"] += 1
+                    raise erro
+                self.metricas["retentativas"] += 1
+                atraso = self.backoff_base_s * (2 ** (tentativa - 1))
+                print(f"Falha no envio SMTP (tentativa {tentativa}): {erro}. Nova tentativa em {atraso:.2f}s.")
+                time.sleep(atraso + random.uniform(0, atraso * 0.5))
+
+    def fechar(self):
+        with self._lock:
+            self._fechar()
+
+    def snapshot(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+            resumo = dict(self.metricas)
+        for nome, q in (("latencia_p50_ms", 0.50), ("latencia_p95_ms", 0.95)):
+            resumo[nome] = latencias[min(len(latencias) - 1, int(q * len(latencias)))] * 1000 if latencias else 0.0
+        return resumo
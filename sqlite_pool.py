@@ -0,0 +1,160 @@
+# Camada de acesso compartilhada ao SQLite: WAL, pool de conexões de leitura e fila única de escrita
+import contextlib
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from compressao import registrar_funcoes_sql
+
+ESCRITAS_POR_LOTE = 64
+MAX_LEITORES = 4
+
+
+class SQLiteConnectionManager:
+    """Gerencia as conexões do processo com um banco SQLite.
+
+    Leituras emprestam, a cada chamada, uma conexão de um pool de até `max_leitores` (reaproveitadas entre chamadas e
+    threads, com cache de statements preparados): o Streamlit roda cada rerun numa thread nova, então uma conexão
+    por thread seria reaberta a cada interação.
+    Escritas passam por uma única thread escritora, que agrupa operações enfileiradas numa só transação
+    (cada uma isolada por SAVEPOINT), então escritores do mesmo processo nunca disputam o lock do arquivo. Se a
+    conexão de escrita não puder ser aberta, o erro é devolvido a quem está esperando e a abertura é refeita no lote
+    seguinte.
+    `funcoes` ({nome: (n_args, funcao)}) são registradas como funções SQL determinísticas em todas as conexões.
+    """
+    def __init__(self, db_path, busy_timeout_ms=5000, cached_statements=256, funcoes=None, max_leitores=MAX_LEITORES):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.funcoes = dict(funcoes or {})
+        self.max_leitores = max_leitores
+        # LIFO: a conexão devolvida por último, com o cache de statements mais quente, é a próxima emprestada
+        self._leitores_livres = queue.LifoQueue()
+        self._leitores_abertos = 0
+        self._lock_leitores = threading.Lock()
+        self._conn_escrita = None
+        self._fila = queue.Queue()
+        self._writer = threading.Thread(target=self._loop_escrita, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def _abrir(self, isolation_level=""):
+        conn = sqlite3.connect(
+            self.db_path, timeout=self.busy_timeout_ms / 1000, cached_statements=self.cached_statements,
+            isolation_level=isolation_level, check_same_thread=False
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return registrar_funcoes_sql(conn, self.funcoes)
+
+    def _emprestar_leitor(self):
+        try:
+            return self._leitores_livres.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock_leitores:
+            abrir = self._leitores_abertos < self.max_leitores
+            if abrir:
+                self._leitores_abertos += 1
+        if abrir:
+            try:
+                return self._abrir()
+            except Exception:
+                with self._lock_leitores:
+                    self._leitores_abertos -= 1
+                raise
+        try:
+            return self._leitores_livres.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"nenhuma das {self.max_leitores} conexões de leitura ficou livre a tempo") from None
+
+    @contextlib.contextmanager
+    def conexao(self):
+        """Empresta uma conexão de leitura do pool durante o bloco `with` (uso: `with db.conexao() as conn:`)."""
+        conn = self._emprestar_leitor()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._leitores_livres.put(conn)
+
+    def ler(self, sql, params=()):
+        with self.conexao() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def ler_um(self, sql, params=()):
+        with self.conexao() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def escrever(self, operacao):
+        """Executa operacao(conn) na thread escritora, dentro de uma transação, e devolve o resultado."""
+        if threading.current_thread() is self._writer:
+            return operacao(self._conn_escrita)
+        futuro = Future()
+        self._fila.put((operacao, futuro))
+        return futuro.result()
+
+    def executar(self, sql, params=()):
+        """Atalho para uma única instrução de escrita. Retorna (lastrowid, rowcount)."""
+        def operacao(conn):
+            cursor = conn.execute(sql, params)
+            return cursor.lastrowid, cursor.rowcount
+        return self.escrever(operacao)
+
+    def compactar(self):
+        """VACUUM numa conexão própria (não pode rodar dentro de transação). Use sem escritas em andamento."""
+        conn = self._abrir(isolation_level=None)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def _loop_escrita(self):
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < ESCRITAS_POR_LOTE:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            if self._conn_escrita is None:
+                try:
+                    # Autocommit no driver: as transações são controladas explicitamente em _executar_lote
+                    self._conn_escrita = self._abrir(isolation_level=None)
+                except Exception as e:
+                    # Sem isso a thread morreria e todo escrever() ficaria preso para sempre em futuro.result()
+                    for _, futuro in lote:
+                        futuro.set_exception(e)
+                    continue
+            self._executar_lote(lote)
+
+    def _executar_lote(self, lote):
+        conn = self._conn_escrita
+        resultados = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for operacao, futuro in lote:
+                conn.execute("SAVEPOINT operacao")
+                try:
+                    resultados.append((futuro, operacao(conn), None))
+                    conn.execute("RELEASE operacao")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operacao")
+                    conn.execute("RELEASE operacao")
+                    resultados.append((futuro, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
@@ -0,0 +1,293 @@
+# Sincronização incremental do banco SQLite com o bucket (GCS ou diretório local)
+# O banco é enviado como um snapshot base + deltas de páginas alteradas, registrados num manifest.
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+DELTA_MAGIC = b"RELDELTA1"
+
+
+class LocalBucket:
+    """Substituto do bucket em disco local, usado em testes e benchmarks."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, name.replace("/", "__"))
+
+    def get(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, name, data):
+        tmp_path = self._path(name) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(name))
+
+    def delete(self, name):
+        if os.path.exists(self._path(name)):
+            os.remove(self._path(name))
+
+
+class GCSBucket:
+    """Bucket do Google Cloud Storage; o cliente é criado apenas no primeiro acesso."""
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    def _get_bucket(self):
+        if self._bucket is None:
+            from google.cloud import storage
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        return self._bucket
+
+    def get(self, name):
+        blob = self._get_bucket().blob(name)
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    def put(self, name, data):
+        self._get_bucket().blob(name).upload_from_string(data, content_type="application/octet-stream")
+
+    def delete(self, name):
+        blob = self._get_bucket().blob(name)
+        if blob.exists():
+            blob.delete()
+
+
+def _hash_pagina(pagina):
+    return hashlib.blake2b(pagina, digest_size=16).hexdigest()
+
+
+def _codificar_delta(page_size, page_count, paginas):
+    partes = [DELTA_MAGIC, struct.pack(">III", page_size, page_count, len(paginas))]
+    for page_no, conteudo in paginas:
+        partes.append(struct.pack(">I", page_no))
+        partes.append(conteudo)
+    return zlib.compress(b"".join(partes), 6)
+
+
+def _decodificar_delta(data):
+    raw = zlib.decompress(data)
+    if not raw.startswith(DELTA_MAGIC):
+        raise ValueError("Delta de sincronização inválido.")
+    offset = len(DELTA_MAGIC)
+    page_size, page_count, n_paginas = struct.unpack_from(">III", raw, offset)
+    offset += 12
+    paginas = []
+    for _ in range(n_paginas):
+        (page_no,) = struct.unpack_from(">I", raw, offset)
+        offset += 4
+        paginas.append((page_no, raw[offset:offset + page_size]))
+        offset += page_size
+    return page_size, page_count, paginas
+
+
+class SyncDivergente(RuntimeError):
+    """O bucket recebeu escritas de outro processo desde a última restauração ou sync desta cópia local."""
+
+
+def _mesma_seq(estado, manifest):
+    return (estado or {}).get("seq") == (manifest or {}).get("seq")
+
+
+class DeltaSyncEngine:
+    """Envia apenas as páginas alteradas do banco desde o último sync, compactando periodicamente."""
+    def __init__(self, bucket, db_path, prefix=None, compactar_apos_deltas=100, compactar_fracao_base=0.5):
+        self.bucket = bucket
+        self.db_path = db_path
+        self.prefix = prefix or os.path.basename(db_path)
+        self.manifest_name = f"{self.prefix}.manifest.json"
+        self.legacy_name = self.prefix
+        self.state_path = f"{db_path}.sync.json"
+        self.compactar_apos_deltas = compactar_apos_deltas
+        self.compactar_fracao_base = compactar_fracao_base
+        self._lock = threading.Lock()
+        # Lock só dos contadores: registrar_escrita roda na thread da interface e não pode esperar um sync em andamento
+        self._lock_metricas = threading.Lock()
+        self.metricas = {"escritas": 0, "syncs": 0, "bytes_enviados": 0, "paginas_enviadas": 0, "compactacoes": 0}
+
+    # --- estado local ---
+    def _carregar_estado(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _salvar_estado(self, estado):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(estado, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _carregar_manifest(self):
+        data = self.bucket.get(self.manifest_name)
+        return json.loads(data) if data else None
+
+    # --- snapshot consistente ---
+    def _snapshot(self):
+        """Copia o banco via backup API do SQLite, que preserva a numeração das páginas."""
+        fd, tmp_path = tempfile.mkstemp(prefix="redeelle_snapshot_", suffix=".db")
+        os.close(fd)
+        src = sqlite3.connect(self.db_path)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            src.backup(dst)
+            page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+        return tmp_path, page_size
+
+    def em_dia(self):
+        """True se o bucket continua na geração que esta cópia local restaurou ou enviou por último."""
+        with self._lock:
+            return _mesma_seq(self._carregar_estado(), self._carregar_manifest())
+
+    def registrar_escrita(self):
+        with self._lock_metricas:
+            self.metricas["escritas"] += 1
+
+    def sync(self, exigir_mesma_seq=False):
+        """Sincroniza o banco local com o bucket. Retorna um resumo do envio.
+
+        Com `exigir_mesma_seq`, levanta SyncDivergente em vez de sobrescrever o bucket com uma base nova quando outro
+        processo escreveu nele desde a última restauração ou sync desta cópia.
+        """
+        with self._lock:
+            snapshot_path, page_size = self._snapshot()
+            try:
+                return self._sync_snapshot(snapshot_path, page_size, exigir_mesma_seq)
+            finally:
+                os.remove(snapshot_path)
+
+    def _sync_snapshot(self, snapshot_path, page_size, exigir_mesma_seq=False):
+        with open(snapshot_path, "rb") as f:
+            conteudo = f.read()
+        page_count = len(conteudo) // page_size
+        hashes = [_hash_pagina(conteudo[i * page_size:(i + 1) * page_size]) for i in range(page_count)]
+        estado = self._carregar_estado()
+        manifest = self._carregar_manifest()
+        if exigir_mesma_seq and not _mesma_seq(estado, manifest):
+            raise SyncDivergente(
+                f"o bucket está na seq {(manifest or {}).get('seq')}, mas esta cópia partiu da seq {(estado or {}).get('seq')}"
+            )
+        # Outro processo pode ter escrito no bucket: nesse caso o delta não se aplicaria e enviamos uma base nova
+        divergente = (
+            estado is None or manifest is None or manifest.get("seq") != estado.get("seq")
+            or estado.get("page_size") != page_size
+        )
+        precisa_compactar = divergente or (
+            len(estado["deltas"]) >= self.compactar_apos_deltas
+            or estado.get("bytes_deltas", 0) >= self.compactar_fracao_base * estado.get("bytes_base", 0)
+        )
+        seq = (manifest or {}).get("seq", 0) + 1
+        if precisa_compactar:
+            resultado = self._enviar_base(conteudo, seq, page_size, page_count, hashes, manifest)
+        else:
+            resultado = self._enviar_delta(conteudo, seq, page_size, page_count, hashes, estado)
+        with self._lock_metricas:
+            self.metricas["syncs"] += 1
+            self.metricas["bytes_enviados"] += resultado["bytes"]
+            self.metricas["paginas_enviadas"] += resultado["paginas"]
+        return resultado
+
+    def _enviar_base(self, conteudo, seq, page_size, page_count, hashes, manifest_anterior):
+        base_name = f"{self.prefix}.base.{seq:08d}"
+        data = zlib.compress(conteudo, 6)
+        self.bucket.put(base_name, data)
+        manifest = {"seq": seq, "base": base_name, "deltas": [], "page_size": page_size, "page_count": page_count,
+                    "updated_at": time.time()}
+        manifest_bytes = json.dumps(manifest).encode("utf-8")
+        self.bucket.put(self.manifest_name, manifest_bytes)
+        # Objetos da geração anterior só são apagados depois que o novo manifest está no bucket
+        if manifest_anterior:
+            for nome in [manifest_anterior.get("base")] + manifest_anterior.get("deltas", []):
+                if nome:
+                    self.bucket.delete(nome)
+        self._salvar_estado({"seq": seq, "base": base_name, "deltas": [], "page_size": page_size,
+                             "hashes": hashes, "bytes_base": len(data), "bytes_deltas": 0})
+        with self._lock_metricas:
+            self.metricas["compactacoes"] += 1
+        return {"modo": "base", "seq": seq, "paginas": page_count, "bytes": len(data) + len(manifest_bytes)}
+
+    def _enviar_delta(self, conteudo, seq, page_size, page_count, hashes, estado):
+        hashes_anteriores = estado["hashes"]
+        alteradas = [
+            (i, conteudo[i * page_size:(i + 1) * page_size])
+            for i, h in enumerate(hashes) if i >= len(hashes_anteriores) or hashes_anteriores[i] != h
+        ]
+        if not alteradas and page_count == len(hashes_anteriores):
+            return {"modo": "sem_alteracoes", "seq": estado["seq"], "paginas": 0, "bytes": 0}
+        delta_name = f"{self.prefix}.delta.{seq:08d}"
+        data = _codificar_delta(page_size, page_count, alteradas)
+        self.bucket.put(delta_name, data)
+        deltas = estado["deltas"] + [delta_name]
+        manifest = {"seq": seq, "base": estado["base"], "deltas": deltas, "page_size": page_size,
+                    "page_count": page_count, "updated_at": time.time()}
+        manifest_bytes = json.dumps(manifest).encode("utf-8")
+        self.bucket.put(self.manifest_name, manifest_bytes)
+        estado.update({"seq": seq, "deltas": deltas, "page_count": page_count, "hashes": hashes,
+                       "bytes_deltas": estado.get("bytes_deltas", 0) + len(data)})
+        self._salvar_estado(estado)
+        return {"modo": "delta", "seq": seq, "paginas": len(alteradas), "bytes": len(data) + len(manifest_bytes)}
+
+    def restore(self):
+        """Reconstrói o banco local a partir do bucket (base + deltas). Retorna False se não houver banco remoto."""
+        with self._lock:
+            manifest = self._carregar_manifest()
+            if manifest is None:
+                legado = self.bucket.get(self.legacy_name)
+                if legado is None:
+                    return False
+                self._gravar_banco(legado)
+                return True
+            base_data = self.bucket.get(manifest["base"])
+            conteudo = bytearray(zlib.decompress(base_data))
+            page_size = manifest["page_size"]
+            bytes_deltas = 0
+            for delta_name in manifest["deltas"]:
+                delta_data = self.bucket.get(delta_name)
+                bytes_deltas += len(delta_data)
+                _, page_count, paginas = _decodificar_delta(delta_data)
+                tamanho = page_count * page_size
+                if len(conteudo) < tamanho:
+                    conteudo.extend(b"\x00" * (tamanho - len(conteudo)))
+                del conteudo[tamanho:]
+                for page_no, pagina in paginas:
+                    conteudo[page_no * page_size:(page_no + 1) * page_size] = pagina
+            self._gravar_banco(bytes(conteudo))
+            page_count = len(conteudo) // page_size
+            self._salvar_estado({
+                "seq": manifest["seq"], "base": manifest["base"], "deltas": manifest["deltas"], "page_size": page_size,
+                "hashes": [_hash_pagina(conteudo[i * page_size:(i + 1) * page_size]) for i in range(page_count)],
+                "bytes_base": len(base_data), "bytes_deltas": bytes_deltas,
+            })
+            return True
+
+    def _gravar_banco(self, conteudo):
+        tmp_path = f"{self.db_path}.restore.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(conteudo)
+        # Um WAL remanescente pertence ao arquivo antigo e corromperia o banco restaurado
+        for sufixo in ("-wal", "-shm"):
+            if os.path.exists(self.db_path + sufixo):
+                os.remove(self.db_path + sufixo)
+        os.replace(tmp_path, self.db_path)
+
+    def bytes_por_escrita(self):
+        with self._lock_metricas:
+            escritas = self.metricas["escritas"]
+            return self.metricas["bytes_enviados"] / escritas if escritas else 0.0
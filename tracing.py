@@ -0,0 +1,124 @@
+# Rastreamento leve: spans com duração e uso de tokens, agregados em memória e gravados em lote junto ao relatório
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+_trace_atual = contextvars.ContextVar("trace_id", default=None)
+
+Span = collections.namedtuple("Span", ["trace_id", "nome", "inicio", "duracao_ms", "modelo", "prompt_tokens", "completion_tokens", "erro"])
+
+LIMITES_HISTOGRAMA_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _SpanAtivo:
+    __slots__ = ("_rastreador", "nome", "modelo", "prompt_tokens", "completion_tokens", "_inicio", "_t0")
+
+    def __init__(self, rastreador, nome, modelo):
+        self._rastreador = rastreador
+        self.nome = nome
+        self.modelo = modelo
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def __enter__(self):
+        self._inicio = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        self._rastreador._registrar(self, time.perf_counter() - self._t0, tipo.__name__ if tipo else None)
+        return False
+
+    def registrar_uso(self, usage):
+        """Copia prompt_tokens/completion_tokens do `usage` de uma completion (ausente em alguns streams)."""
+        if usage is not None:
+            self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+            self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+
+class Rastreador:
+    """Coleta spans do processo.
+
+    Todo span alimenta os agregados em memória (histograma de duração e contadores de tokens, expostos no formato
+    Prometheus). Spans feitos dentro de `contexto(trace_id)` também ficam pendentes até `descarregar(trace_id)`, para
+    serem gravados de uma vez quando o relatório daquele atendimento existir; nada é escrito no caminho quente.
+    """
+    def __init__(self, max_traces_pendentes=1000):
+        self.max_traces_pendentes = max_traces_pendentes
+        self._lock = threading.Lock()
+        self._pendentes = collections.OrderedDict()
+        self._duracoes = {}
+        self._tokens = collections.Counter()
+        self._erros = collections.Counter()
+
+    def span(self, nome, modelo=None):
+        return _SpanAtivo(self, nome, modelo)
+
+    @contextlib.contextmanager
+    def contexto(self, trace_id):
+        token = _trace_atual.set(trace_id)
+        try:
+            yield
+        finally:
+            _trace_atual.reset(token)
+
+    def _registrar(self, span, duracao_s, erro):
+        trace_id = _trace_atual.get()
+        with self._lock:
+            agregado = self._duracoes.get(span.nome)
+            if agregado is None:
+                agregado = self._duracoes[span.nome] = [0, 0.0, [0] * len(LIMITES_HISTOGRAMA_S)]
+            agregado[0] += 1
+            agregado[1] += duracao_s
+            for i, limite in enumerate(LIMITES_HISTOGRAMA_S):
+                if duracao_s <= limite:
+                    agregado[2][i] += 1
+                    break
+            if span.modelo:
+                self._tokens[(span.modelo, "prompt")] += span.prompt_tokens or 0
+                self._tokens[(span.modelo, "completion")] += span.completion_tokens or 0
+            if erro:
+                self._erros[(span.nome, erro)] += 1
+            if trace_id is None:
+                return
+            pendentes = self._pendentes.get(trace_id)
+            if pendentes is None:
+                if len(self._pendentes) >= self.max_traces_pendentes:
+                    self._pendentes.popitem(last=False)
+                pendentes = self._pendentes[trace_id] = []
+            pendentes.append(Span(
+                trace_id, span.nome, span._inicio, duracao_s * 1000, span.modelo, span.prompt_tokens, span.completion_tokens, erro
+            ))
+
+    def descarregar(self, trace_id):
+        """Remove e devolve os spans pendentes do atendimento."""
+        with self._lock:
+            return self._pendentes.pop(trace_id, [])
+
+    def prometheus(self, prefixo="redeelle"):
+        """Agregados do processo no formato de texto do Prometheus."""
+        with self._lock:
+            duracoes = {nome: (n, soma, list(buckets)) for nome, (n, soma, buckets) in self._duracoes.items()}
+            tokens = dict(self._tokens)
+            erros = dict(self._erros)
+        linhas = [
+            f"# HELP {prefixo}_span_duracao_segundos Duração das etapas instrumentadas.",
+            f"# TYPE {prefixo}_span_duracao_segundos histogram",
+        ]
+        for nome, (n, soma, buckets) in sorted(duracoes.items()):
+            acumulado = 0
+            for limite, quantidade in zip(LIMITES_HISTOGRAMA_S, buckets):
+                acumulado += quantidade
+                linhas.append(f'{prefixo}_span_duracao_segundos_bucket{{span="{nome}",le="{limite}"}} {acumulado}')
+            linhas.append(f'{prefixo}_span_duracao_segundos_bucket{{span="{nome}",le="+Inf"}} {n}')
+            linhas.append(f'{prefixo}_span_duracao_segundos_sum{{span="{nome}"}} {soma:.6f}')
+            linhas.append(f'{prefixo}_span_duracao_segundos_count{{span="{nome}"}} {n}')
+        linhas += [f"# HELP {prefixo}_tokens_total Tokens consumidos nas completions.", f"# TYPE {prefixo}_tokens_total counter"]
+        for (modelo, tipo), quantidade in sorted(tokens.items()):
+            linhas.append(f'{prefixo}_tokens_total{{modelo="{modelo}",tipo="{tipo}"}} {quantidade}')
+        linhas += [f"# HELP {prefixo}_span_erros_total Etapas que terminaram com exceção.", f"# TYPE {prefixo}_span_erros_total counter"]
+        for (nome, erro), quantidade in sorted(erros.items()):
+            linhas.append(f'{prefixo}_span_erros_total{{span="{nome}",erro="{erro}"}} {quantidade}')
+        return "\n".join(linhas) + "\n"